@@ -2,9 +2,11 @@ import click
 from flask import (
     Blueprint,
     Flask,
+    Response,
     request,
     jsonify,
     redirect,
+    stream_with_context,
     url_for,
     has_request_context,
 )
@@ -20,9 +22,16 @@ from werkzeug.routing import PathConverter
 from werkzeug.exceptions import InternalServerError
 
 from src.ClickProfiler import ClickProfiler
-from src.DatasetLoader import DatasetLoader
+from src.DatasetLoader import DatasetLoader, get_dataset_loader
+from src.Deadline import DEADLINE_HEADER, Deadline, DeadlineExceeded
 from src.scripts.utils import normalise_title, MentionRegexException
+from src.scripts.ngram_utils import warm_tokenizers
+from src.scripts.anchor_stats import build_anchor_stats
+from src.AnchorMatcher import build_anchor_matcher
+from src.BloomFilter import build_bloom_filter
+from src.EmbeddingStore import build_embedding_store
 from src.MediaWikiApi import MediaWikiApi
+from src.batch_query import run_batch_query
 from src.query import Query
 from src.LogstashAwareJSONRequestLogFormatter import (
     LogstashAwareJSONRequestLogFormatter,
@@ -48,6 +57,8 @@ class ProxyPassMiddleware(object):
 load_dotenv()
 blueprint = Blueprint("mwaddlink", __name__)
 
+NDJSON_MIMETYPE = "application/x-ndjson"
+
 
 class InvalidAPIUsage(Exception):
     # Custom response class for API errors.
@@ -82,6 +93,8 @@ def create_app():
     url_prefix = os.environ.get("URL_PREFIX", "")
     if url_prefix != "":
         flask_app.wsgi_app = ProxyPassMiddleware(flask_app.wsgi_app, url_prefix)
+    # Load the tokenizers of the configured languages before gunicorn forks the workers.
+    warm_tokenizers()
 
     swagger_config = {
         "headers": [],
@@ -205,6 +218,248 @@ def cli_query(ctx: click.Context, *args, **kwargs):
     query(*args, **kwargs)
 
 
+@blueprint.cli.command("batch-query")
+@click.option(
+    "--input",
+    "input_file",
+    default="-",
+    type=click.File("r", encoding="utf-8"),
+    help="JSONL file with one page per line, with wiki, title, revid and wikitext (default: stdin)",
+)
+@click.option(
+    "--output",
+    "output_file",
+    default="-",
+    type=click.File("w", encoding="utf-8"),
+    help="JSONL file to write the result of each page to (default: stdout)",
+)
+@click.option(
+    "--processes",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Number of worker processes (defaults to the number of CPUs)",
+)
+@click.option(
+    "--chunk-size",
+    default=20,
+    type=click.IntRange(min=1),
+    help="Maximum number of consecutive pages of a wiki that a worker processes at once",
+)
+@click.option(
+    "--threshold",
+    default=0.5,
+    required=False,
+    type=float,
+    help="Threshold value for links to be recommended",
+)
+@click.option(
+    "--max-recommendations",
+    default=15,
+    required=False,
+    type=int,
+    help="Maximum number of link recommendations to query (set to -1 for all)",
+)
+@click.option(
+    "--sections-to-exclude",
+    default=[],
+    required=False,
+    type=str,
+    multiple=True,
+    help="Section title to exclude from link suggestion generation.",
+)
+@click.option(
+    "--timeout",
+    default=60.0,
+    type=click.FloatRange(min=0, min_open=True),
+    help="Time budget per page in seconds",
+)
+@click.option(
+    "--progress-interval",
+    default=100,
+    type=click.IntRange(min=0),
+    help="Number of pages after which progress is reported on stderr (0 for none)",
+)
+def cli_batch_query(
+    input_file,
+    output_file,
+    processes,
+    chunk_size,
+    threshold,
+    max_recommendations,
+    sections_to_exclude,
+    timeout,
+    progress_interval,
+):
+    """
+    Recommend links for many pages offline, e.g. for backfills. The pages are read as JSONL
+    records with wiki (e.g. 'dewiki'), title, revid and wikitext, and optionally pageid,
+    language_code (required for wikis other than Wikipedias) and sections_to_exclude. Workers
+    keep the datasets and models of the wikis they have processed loaded, and consecutive pages
+    of a wiki are processed in chunks. The results are written as JSONL in the order of the
+    records; the progress and throughput are reported on stderr.
+    """
+    run_batch_query(
+        lines=input_file,
+        output=output_file,
+        processes=processes or os.cpu_count() or 1,
+        chunk_size=chunk_size,
+        progress_interval=progress_interval,
+        progress=lambda stats: click.echo(json.dumps(stats), err=True),
+        worker_settings={
+            "backend": os.environ.get("DB_BACKEND"),
+            "data_dir": app.root_path,
+            "threshold": threshold,
+            "max_recommendations": max_recommendations,
+            "sections_to_exclude": list(sections_to_exclude),
+            "timeout": timeout,
+        },
+    )
+
+
+@blueprint.cli.command("build-anchor-stats")
+@click.option(
+    "--wiki-id",
+    required=True,
+    type=str,
+    help="Wiki ID for which to precompute the anchor statistics (e.g. 'cswiki')",
+)
+def cli_build_anchor_stats(wiki_id):
+    """
+    Precompute the per-anchor statistics used as model features into
+    data/{wiki_id}/{wiki_id}.anchorstats.sqlite, for use with the SQLite backend. The checksum of
+    the anchors dataset is saved along with them, as they are only used until the anchors change.
+    With MySQL, load-datasets.py computes them when importing the anchors dataset.
+    """
+    from sqlitedict import SqliteDict
+
+    datasetloader = DatasetLoader(
+        backend="sqlite", wiki_id=wiki_id, data_dir=app.root_path
+    )
+    anchors = datasetloader.get("anchors")
+    checksum = datasetloader.get_sqlite_checksum("anchors")
+    anchorstats_path = datasetloader.get_sqlite_path("anchorstats")
+    with SqliteDict(anchorstats_path) as anchor_stats:
+        for anchor, stats in build_anchor_stats(anchors.items()):
+            anchor_stats[anchor] = stats
+        anchor_stats.commit()
+    with open("%s.checksum" % anchorstats_path, "w") as checksum_file:
+        checksum_file.write("%s  %s\n" % (checksum, os.path.basename(anchorstats_path)))
+
+
+@blueprint.cli.command("build-embedding-store")
+@click.option(
+    "--wiki-id",
+    required=True,
+    type=str,
+    help="Wiki ID for which to build the embedding store (e.g. 'cswiki')",
+)
+def cli_build_embedding_store(wiki_id):
+    """
+    Build the memory-mapped embedding store data/{wiki_id}/{wiki_id}.w2vfiltered.store from the
+    w2vfiltered SQLite dataset. When present, it is used instead of the SQLite dataset. With MySQL,
+    load-datasets.py builds the stores in EMBEDDING_STORE_DIR.
+    """
+    from sqlitedict import SqliteDict
+
+    datasetloader = DatasetLoader(
+        backend="sqlite", wiki_id=wiki_id, data_dir=app.root_path
+    )
+    build_embedding_store(
+        SqliteDict(datasetloader.get_sqlite_path("w2vfiltered")).items(),
+        datasetloader.get_embedding_store_path(),
+        datasetloader.get_sqlite_checksum("w2vfiltered"),
+    )
+
+
+@blueprint.cli.command("build-anchor-matcher")
+@click.option(
+    "--wiki-id",
+    required=True,
+    type=str,
+    help="Wiki ID for which to build the anchor matcher (e.g. 'cswiki')",
+)
+def cli_build_anchor_matcher(wiki_id):
+    """
+    Build the anchor matcher data/{wiki_id}/{wiki_id}.anchors.matcher from the anchors SQLite
+    dataset. When present, it is used to find candidate mentions (for v2 models). With MySQL,
+    load-datasets.py builds the matchers in ANCHOR_MATCHER_DIR.
+    """
+    from sqlitedict import SqliteDict
+
+    datasetloader = DatasetLoader(
+        backend="sqlite", wiki_id=wiki_id, data_dir=app.root_path
+    )
+    build_anchor_matcher(
+        SqliteDict(datasetloader.get_sqlite_path("anchors")).keys(),
+        datasetloader.get_anchor_matcher_path(),
+        datasetloader.get_sqlite_checksum("anchors"),
+    )
+
+
+@blueprint.cli.command("build-anchor-filter")
+@click.option(
+    "--wiki-id",
+    required=True,
+    type=str,
+    help="Wiki ID for which to build the anchor filter (e.g. 'cswiki')",
+)
+@click.option(
+    "--false-positive-rate",
+    default=None,
+    required=False,
+    type=float,
+    help="False positive rate of the filter (defaults to ANCHOR_FILTER_FALSE_POSITIVE_RATE or 0.01)",
+)
+def cli_build_anchor_filter(wiki_id, false_positive_rate):
+    """
+    Build the membership filter data/{wiki_id}/{wiki_id}.anchors.bloom over the anchors SQLite
+    dataset. When present, mentions that are not anchors are dropped before looking them up, until
+    the anchors dataset changes. With MySQL, load-datasets.py builds the filters.
+    """
+    from sqlitedict import SqliteDict
+
+    datasetloader = DatasetLoader(
+        backend="sqlite", wiki_id=wiki_id, data_dir=app.root_path
+    )
+    anchors = SqliteDict(datasetloader.get_sqlite_path("anchors"))
+    build_bloom_filter(
+        anchors.keys(),
+        len(anchors),
+        false_positive_rate,
+        datasetloader.get_sqlite_checksum("anchors"),
+    ).save(datasetloader.get_anchor_filter_path())
+
+
+def get_wiki_id(project, wiki_domain):
+    if project == "wikipedia":
+        # FIXME: What we should do instead is rename the datasets to {project}{domain} e.g. wikipediafr
+        # to avoid this hack
+        return "%swiki" % wiki_domain
+    return "%s%s" % (wiki_domain, project)
+
+
+def check_model_path(datasetloader: DatasetLoader, project, wiki_domain):
+    path, valid_domains = datasetloader.get_model_path()
+    if not path:
+        warning_message = "Unable to process request for %s/%s" % (project, wiki_domain)
+        logger.warning(warning_message)
+        if not has_request_context():
+            print(warning_message)
+        raise InvalidAPIUsage(
+            warning_message,
+            status_code=400,
+            payload={"valid_project_domain_pairs": valid_domains},
+        )
+
+
+def get_application_version():
+    return (
+        subprocess.check_output(["git", "rev-parse", "--short", "HEAD"])
+        .decode("ascii")
+        .strip()
+    )
+
+
 @blueprint.route(
     "/v1/linkrecommendations/<string:project>/<string:wiki_domain>/<title:page_title>",
     methods=["POST", "GET"],
@@ -220,34 +475,55 @@ def query(
     sections_to_exclude=None,
     language_code=None,
 ):
+    # The time budget of the request covers fetching the page as well as processing it.
+    deadline = (
+        Deadline.from_header(request.headers.get(DEADLINE_HEADER))
+        if has_request_context()
+        else Deadline()
+    )
     if sections_to_exclude is None:
         sections_to_exclude = []
-    if project == "wikipedia":
-        # FIXME: What we should do instead is rename the datasets to {project}{domain} e.g. wikipediafr
-        # to avoid this hack
-        wiki_id = "%swiki" % wiki_domain
-    else:
-        wiki_id = "%s%s" % (wiki_domain, project)
+    wiki_id = get_wiki_id(project, wiki_domain)
 
     revision = (
         revision if revision is not None else request.args.get("revision", 0, int)
     )
-    datasetloader = DatasetLoader(
+    with get_dataset_loader(
         backend=os.environ.get("DB_BACKEND"), wiki_id=wiki_id, data_dir=app.root_path
-    )
-
-    path, valid_domains = datasetloader.get_model_path()
-    if not path:
-        warning_message = "Unable to process request for %s/%s" % (project, wiki_domain)
-        logger.warning(warning_message)
-        if not has_request_context():
-            print(warning_message)
-        raise InvalidAPIUsage(
-            warning_message,
-            status_code=400,
-            payload={"valid_project_domain_pairs": valid_domains},
+    ) as datasetloader:
+        return query_with_datasetloader(
+            datasetloader,
+            project,
+            wiki_domain,
+            wiki_id,
+            page_title,
+            revision,
+            threshold,
+            max_recommendations,
+            sections_to_exclude,
+            language_code,
+            deadline,
         )
 
+
+def query_with_datasetloader(
+    datasetloader: DatasetLoader,
+    project,
+    wiki_domain,
+    wiki_id,
+    page_title,
+    revision,
+    threshold,
+    max_recommendations,
+    sections_to_exclude,
+    language_code,
+    deadline: Deadline = None,
+):
+    if deadline is None:
+        deadline = Deadline()
+    datasetloader.set_deadline(deadline)
+    check_model_path(datasetloader, project, wiki_domain)
+
     if has_request_context() and request.method == "POST":
         data = request.json
         validate(data, "Input", "swagger/linkrecommendations.yml")
@@ -258,6 +534,7 @@ def query(
                 proxy_api_url=os.environ.get("MEDIAWIKI_PROXY_API_BASE_URL"),
                 project=project,
                 wiki_domain=wiki_domain,
+                deadline=deadline,
             )
             data = mw_api.get_article(page_title, revision=revision)
             if revision:
@@ -270,6 +547,8 @@ def query(
                     print(page_not_found_message)
                 raise InvalidAPIUsage(message=page_not_found_message, status_code=404)
             raise e
+        except DeadlineExceeded as e:
+            raise InvalidAPIUsage(message=str(e), status_code=504)
 
     # FIXME: We're supposed to be able to read these defaults from the Swagger spec
     if has_request_context():
@@ -302,12 +581,9 @@ def query(
             page_title=normalise_title(page_title),
             max_recommendations=data["max_recommendations"],
             sections_to_exclude=data["sections_to_exclude"],
+            deadline=deadline,
         )
-        result["meta"]["application_version"] = (
-            subprocess.check_output(["git", "rev-parse", "--short", "HEAD"])
-            .decode("ascii")
-            .strip()
-        )
+        result["meta"]["application_version"] = get_application_version()
         response = jsonify(result)
 
         logger.debug(response)
@@ -321,11 +597,118 @@ def query(
                 "revid": data["revid"],
             },
         )
+    except DeadlineExceeded as e:
+        # The deadline passed before the page was processed, e.g. while loading the model.
+        raise InvalidAPIUsage(message=str(e), status_code=504)
     if not has_request_context():
         print(json.dumps(response.get_json(), indent=4))
     return response
 
 
+@blueprint.route(
+    "/v1/batch/linkrecommendations/<string:project>/<string:wiki_domain>",
+    methods=["POST"],
+    merge_slashes=False,
+)
+def batch_query(project, wiki_domain):
+    """
+    Recommend links for many pages of a wiki in one request. The pages share the model and the
+    dataset handles, and each page gets its own result or error.
+
+    With "Accept: application/x-ndjson", the results are streamed as one JSON object per line, each
+    as soon as it is computed; errors that occur while streaming are sent as error objects.
+    """
+    deadline = Deadline.from_header(request.headers.get(DEADLINE_HEADER))
+    data = request.json
+    validate(data, "BatchInput", "swagger/linkrecommendations.yml")
+    max_items = int(os.environ.get("BATCH_MAX_ITEMS", 100))
+    if len(data["items"]) > max_items:
+        raise InvalidAPIUsage("A batch can contain at most %d items" % max_items)
+    items = [
+        dict(item, page_title=normalise_title(item["page_title"]))
+        for item in data["items"]
+    ]
+    wiki_id = get_wiki_id(project, wiki_domain)
+    stream = (
+        request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE])
+        == NDJSON_MIMETYPE
+    )
+    application_version = get_application_version()
+    datasetloader = get_dataset_loader(
+        backend=os.environ.get("DB_BACKEND"), wiki_id=wiki_id, data_dir=app.root_path
+    )
+    datasetloader.acquire()
+    try:
+        datasetloader.set_deadline(deadline)
+        check_model_path(datasetloader, project, wiki_domain)
+    except Exception:
+        datasetloader.release()
+        raise
+    # The pages are only processed while the results are consumed.
+    results = Query(logger, datasetloader).run_batch(
+        items=items,
+        wiki_id=wiki_id,
+        language_code=request.args.get("language_code", wiki_domain),
+        threshold=float(request.args.get("threshold", 0.5)),
+        max_recommendations=int(request.args.get("max_recommendations", 15)),
+        sections_to_exclude=data.get(
+            "sections_to_exclude", request.args.getlist("sections_to_exclude")
+        ),
+        deadline=deadline,
+    )
+
+    if stream:
+        # The next page is processed once the server has sent the previous result.
+        response = Response(
+            stream_with_context(get_ndjson_lines(results, application_version)),
+            mimetype=NDJSON_MIMETYPE,
+        )
+        response.call_on_close(datasetloader.release)
+        return response
+
+    try:
+        results = [
+            add_application_version(result, application_version) for result in results
+        ]
+    except DeadlineExceeded as e:
+        # The deadline passed before any page was processed, e.g. while loading the model.
+        raise InvalidAPIUsage(message=str(e), status_code=504)
+    finally:
+        datasetloader.release()
+    return jsonify({"results": results, "results_count": len(results)})
+
+
+def add_application_version(result: dict, application_version: str) -> dict:
+    if "meta" in result:
+        result["meta"]["application_version"] = application_version
+    return result
+
+
+def get_ndjson_lines(results, application_version: str):
+    """
+    Serialize the results of a batch as NDJSON. As the response has already started, errors are
+    sent as an error object instead of an error response.
+    """
+    try:
+        for result in results:
+            yield json.dumps(
+                add_application_version(result, application_version), ensure_ascii=False
+            ) + "\n"
+    except DeadlineExceeded as e:
+        yield json.dumps({"error": {"code": 504, "message": str(e)}}) + "\n"
+    except Exception as e:
+        logger.error(
+            {
+                "type": type(e).__name__,
+                "description": str(e),
+                "trace": traceback.format_tb(e.__traceback__),
+            }
+        )
+        yield json.dumps(
+            {"error": {"code": 500, "message": "Internal Server Error"}}
+        ) + "\n"
+
+
 @blueprint.route("/healthz", methods=["GET"])
 def healthz():
     """
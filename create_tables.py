@@ -16,7 +16,7 @@ def create_tables(mysql_connection=None, raw_args=None):
         default=None,
         type=str,
         required=False,
-        help="Wiki ID to use for table creation. Can be omitted for model and checksum tables.",
+        help="Wiki ID to use for table creation. Can be omitted for model, anchorfilter and checksum tables.",
     )
     parser.add_argument(
         "--tables",
@@ -24,10 +24,12 @@ def create_tables(mysql_connection=None, raw_args=None):
         nargs="+",
         default=[
             "anchors",
+            "anchorstats",
             "redirects",
             "pageids",
             "w2vfiltered",
             "model",
+            "anchorfilter",
             "checksum",
         ],
         required=False,
@@ -39,7 +41,7 @@ def create_tables(mysql_connection=None, raw_args=None):
         mysql_connection = get_mysql_connection()
     with mysql_connection.cursor() as cursor:
         for table in args.tables:
-            if table in ["model", "checksum"]:
+            if table in ["model", "anchorfilter", "checksum"]:
                 tablename = "%s_%s" % (table_prefix, table)
             else:
                 tablename = "%s_%s_%s" % (table_prefix, args.wiki_id, table)
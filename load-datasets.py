@@ -14,7 +14,16 @@ import logging
 import json_logging
 from contextlib import redirect_stdout
 
-from src.mysql import get_mysql_connection, import_model_to_table
+from src.AnchorMatcher import open_anchor_matcher
+from src.EmbeddingStore import open_embedding_store
+from src.mysql import (
+    build_anchor_matcher_from_table,
+    build_embedding_store_from_table,
+    get_mysql_connection,
+    import_anchor_filter_to_table,
+    import_anchor_stats_to_table,
+    import_model_to_table,
+)
 from create_tables import create_tables
 
 ANALYTICS_BASE_URL_LEGACY = os.getenv(
@@ -97,6 +106,41 @@ def handle_args():
         If the checksums differ, the datasets are downloaded to the directory specified by --path, verified, and loaded.
         """,
     )
+    parser.add_argument(
+        "--embedding-store-dir",
+        default=os.getenv("EMBEDDING_STORE_DIR"),
+        type=str,
+        required=False,
+        help="""
+        Directory in which to build memory-mapped embedding stores from the w2vfiltered datasets
+        (defaults to the EMBEDDING_STORE_DIR environment variable). The service uses a store instead of
+        the w2vfiltered table if EMBEDDING_STORE_DIR points to the same directory. If not set, no
+        stores are built.
+        """,
+    )
+    parser.add_argument(
+        "--anchor-filter-false-positive-rate",
+        default=float(os.getenv("ANCHOR_FILTER_FALSE_POSITIVE_RATE", 0.01)),
+        type=float,
+        required=False,
+        help="""
+        False positive rate of the membership filters built over the anchors datasets (defaults to the
+        ANCHOR_FILTER_FALSE_POSITIVE_RATE environment variable, or 0.01). Lower rates drop more
+        non-anchors before querying the anchors table, at the cost of larger filters.
+        """,
+    )
+    parser.add_argument(
+        "--anchor-matcher-dir",
+        default=os.getenv("ANCHOR_MATCHER_DIR"),
+        type=str,
+        required=False,
+        help="""
+        Directory in which to build anchor matchers from the anchors datasets (defaults to the
+        ANCHOR_MATCHER_DIR environment variable). The service uses a matcher to find candidate
+        mentions if ANCHOR_MATCHER_DIR points to the same directory. If not set, no matchers are
+        built.
+        """,
+    )
     parser.add_argument(
         "--output-format",
         choices=["print", "json"],
@@ -187,6 +231,46 @@ def verify_checksum(dataset_name, wiki_id, table_prefix):
         raise AssertionError(f"Failed to verify checksum for {filename}")
 
 
+def get_tables_for_datasets(datasets):
+    """
+    Get the per-wiki tables needed for a list of datasets, including derived datasets.
+    """
+    tables = list(datasets)
+    if "anchors" in datasets:
+        tables.append("anchorstats")
+    return tables
+
+
+def get_stored_checksum(connection, checksum_table, wiki_id, dataset):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT value FROM {checksum_table} WHERE lookup = %s".format(
+                checksum_table=checksum_table
+            ),
+            ("%s_%s" % (wiki_id, dataset),),
+        )
+        result = cursor.fetchone()
+    return None if result is None else result[0].decode("utf-8")
+
+
+def update_stored_checksum(cursor, checksum_table, wiki_id, dataset, checksum):
+    cursor.execute(
+        "DELETE FROM {checksum_table} WHERE lookup = %s".format(
+            checksum_table=checksum_table
+        ),
+        ("%s_%s" % (wiki_id, dataset),),
+    )
+    cursor.execute(
+        "INSERT INTO {checksum_table} (lookup, value) VALUES(%s,%s)".format(
+            checksum_table=checksum_table
+        ),
+        (
+            "%s_%s" % (wiki_id, dataset),
+            checksum,
+        ),
+    )
+
+
 def _get_wikis(base_url: str) -> dict[str, str]:
     all_datasets_url = requests.compat.urljoin(base_url, "wikis.txt")
     with requests.get(
@@ -222,8 +306,11 @@ def run(args: argparse.Namespace):
             dataset_name_for_table="checksum", connection=mysql_connection
         )
         ensure_table_exists(dataset_name_for_table="model", connection=mysql_connection)
+        ensure_table_exists(
+            dataset_name_for_table="anchorfilter", connection=mysql_connection
+        )
         for wiki_id in wiki_ids.keys():
-            for dataset in datasets:
+            for dataset in get_tables_for_datasets(datasets):
                 ensure_table_exists(
                     dataset_name_for_table=dataset,
                     connection=mysql_connection,
@@ -342,7 +429,67 @@ def run(args: argparse.Namespace):
             else:
                 datasets_to_import = datasets
 
-            if not len(datasets_to_import):
+            # anchorstats is derived from anchors, so it is rebuilt whenever anchors are imported,
+            # or if it is missing (e.g. for anchors imported before anchorstats existed).
+            build_anchor_stats = "anchors" in datasets_to_import or (
+                "anchors" in datasets
+                and get_stored_checksum(
+                    mysql_connection, checksum_table, wiki_id, "anchorstats"
+                )
+                is None
+            )
+
+            # The anchor filter is derived from anchors as well, and is rebuilt if it was built
+            # from other anchors than the imported ones.
+            build_anchor_filter = "anchors" in datasets_to_import or (
+                "anchors" in datasets
+                and get_stored_checksum(
+                    mysql_connection, checksum_table, wiki_id, "anchorfilter"
+                )
+                != get_stored_checksum(
+                    mysql_connection, checksum_table, wiki_id, "anchors"
+                )
+            )
+
+            embedding_store_path = None
+            if args.embedding_store_dir and "w2vfiltered" in datasets:
+                embedding_store_path = os.path.join(
+                    args.embedding_store_dir, "%s.w2vfiltered.store" % wiki_id
+                )
+                embedding_store = open_embedding_store(embedding_store_path)
+                if (
+                    "w2vfiltered" not in datasets_to_import
+                    and embedding_store is not None
+                    and embedding_store.checksum
+                    == get_stored_checksum(
+                        mysql_connection, checksum_table, wiki_id, "w2vfiltered"
+                    )
+                ):
+                    embedding_store_path = None
+
+            anchor_matcher_path = None
+            if args.anchor_matcher_dir and "anchors" in datasets:
+                anchor_matcher_path = os.path.join(
+                    args.anchor_matcher_dir, "%s.anchors.matcher" % wiki_id
+                )
+                anchor_matcher = open_anchor_matcher(anchor_matcher_path)
+                if (
+                    "anchors" not in datasets_to_import
+                    and anchor_matcher is not None
+                    and anchor_matcher.checksum
+                    == get_stored_checksum(
+                        mysql_connection, checksum_table, wiki_id, "anchors"
+                    )
+                ):
+                    anchor_matcher_path = None
+
+            if (
+                not len(datasets_to_import)
+                and not build_anchor_stats
+                and not build_anchor_filter
+                and not embedding_store_path
+                and not anchor_matcher_path
+            ):
                 print("  ", "All datasets for %s are up-to-date!" % wiki_id)
                 continue
 
@@ -403,26 +550,109 @@ def run(args: argparse.Namespace):
                         "%s.checksum"
                         % get_dataset_filename(dataset, wiki_id, table_prefix)
                     ) as checksum_file:
-                        cursor.execute(
-                            "DELETE FROM {checksum_table} WHERE lookup = %s".format(
-                                checksum_table=checksum_table
-                            ),
-                            ("%s_%s" % (wiki_id, dataset),),
-                        )
                         # checksum file is in the default format output from shasum utility,
                         # so it contains the SHA followed by a space and then the filename.
                         remote_checksum = checksum_file.readline().split(" ")[0]
-                        cursor.execute(
-                            "INSERT INTO {checksum_table} (lookup, value) VALUES(%s,%s)".format(
-                                checksum_table=checksum_table
-                            ),
-                            (
-                                "%s_%s" % (wiki_id, dataset),
-                                remote_checksum,
-                            ),
+                        update_stored_checksum(
+                            cursor, checksum_table, wiki_id, dataset, remote_checksum
                         )
                     print(cli_ok_status)
 
+                if build_anchor_stats:
+                    print("  ", "Processing dataset: anchorstats")
+                    print(
+                        "    ",
+                        "Computing anchor statistics...",
+                        end="",
+                        flush=True,
+                    )
+                    num_rows = import_anchor_stats_to_table(
+                        cursor=cursor, wiki_id=wiki_id, table_prefix=table_prefix
+                    )
+                    print(cli_ok_status)
+                    print("       %d rows inserted" % num_rows)
+                    print("    ", "Updating stored checksum...", end="", flush=True)
+                    # The statistics are only valid for the anchors they were computed from,
+                    # so they share the checksum of the anchors dataset.
+                    update_stored_checksum(
+                        cursor,
+                        checksum_table,
+                        wiki_id,
+                        "anchorstats",
+                        get_stored_checksum(
+                            mysql_connection, checksum_table, wiki_id, "anchors"
+                        ),
+                    )
+                    print(cli_ok_status)
+
+                if build_anchor_filter:
+                    print("  ", "Processing dataset: anchorfilter")
+                    print(
+                        "    ",
+                        "Building anchor filter...",
+                        end="",
+                        flush=True,
+                    )
+                    anchors_checksum = get_stored_checksum(
+                        mysql_connection, checksum_table, wiki_id, "anchors"
+                    )
+                    num_rows = import_anchor_filter_to_table(
+                        cursor=cursor,
+                        wiki_id=wiki_id,
+                        checksum=anchors_checksum,
+                        false_positive_rate=args.anchor_filter_false_positive_rate,
+                        table_prefix=table_prefix,
+                    )
+                    print(cli_ok_status)
+                    print("       %d anchors in filter" % num_rows)
+                    print("    ", "Updating stored checksum...", end="", flush=True)
+                    update_stored_checksum(
+                        cursor,
+                        checksum_table,
+                        wiki_id,
+                        "anchorfilter",
+                        anchors_checksum,
+                    )
+                    print(cli_ok_status)
+
+                if embedding_store_path:
+                    print(
+                        "    ",
+                        "Building embedding store %s..." % embedding_store_path,
+                        end="",
+                        flush=True,
+                    )
+                    num_rows = build_embedding_store_from_table(
+                        cursor=cursor,
+                        wiki_id=wiki_id,
+                        path=embedding_store_path,
+                        checksum=get_stored_checksum(
+                            mysql_connection, checksum_table, wiki_id, "w2vfiltered"
+                        ),
+                        table_prefix=table_prefix,
+                    )
+                    print(cli_ok_status)
+                    print("       %d embeddings stored" % num_rows)
+
+                if anchor_matcher_path:
+                    print(
+                        "    ",
+                        "Building anchor matcher %s..." % anchor_matcher_path,
+                        end="",
+                        flush=True,
+                    )
+                    num_rows = build_anchor_matcher_from_table(
+                        cursor=cursor,
+                        wiki_id=wiki_id,
+                        path=anchor_matcher_path,
+                        checksum=get_stored_checksum(
+                            mysql_connection, checksum_table, wiki_id, "anchors"
+                        ),
+                        table_prefix=table_prefix,
+                    )
+                    print(cli_ok_status)
+                    print("       %d anchors stored" % num_rows)
+
                 print("  ", "Committing...", end="", flush=True)
                 mysql_connection.commit()
                 print(cli_ok_status)
@@ -0,0 +1,209 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from bisect import bisect_left
+from collections import deque
+from collections.abc import Generator, Iterable
+
+import numpy as np
+
+ARRAYS = ["edge_start", "edge_chars", "edge_targets", "fail", "output", "dict_link"]
+
+
+class AnchorMatcher:
+    def __init__(self, path: str):
+        """
+        Aho-Corasick automaton over the (lowercased) keys of the anchors dataset, used to find all
+        anchors in a text in one pass instead of looking up every n-gram of the text.
+
+        The automaton is a directory (see build_anchor_matcher) of flat arrays which are
+        memory-mapped, so all gunicorn workers on a host share them:
+        - edge_start: for each node, the index of its first outgoing edge (CSR layout)
+        - edge_chars, edge_targets: code point and target node of each edge, sorted by code point
+          per node
+        - fail: the failure link of each node
+        - output: length of the anchor ending at the node, 0 if no anchor ends there
+        - dict_link: the nearest node on the failure chain where an anchor ends, 0 if there is none
+        :param path: Path to the automaton directory
+        """
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as meta_file:
+            meta = json.load(meta_file)
+        self.checksum = meta.get("checksum")
+        self.arrays = {
+            name: np.load(os.path.join(path, "%s.npy" % name), mmap_mode="r")
+            for name in ARRAYS
+        }
+        # Indexing memoryviews returns Python ints, which is much faster than indexing the arrays
+        # for the one-character-at-a-time traversal.
+        self.edge_start = memoryview(self.arrays["edge_start"])
+        self.edge_chars = memoryview(self.arrays["edge_chars"])
+        self.edge_targets = memoryview(self.arrays["edge_targets"])
+        self.fail = memoryview(self.arrays["fail"])
+        self.output = memoryview(self.arrays["output"])
+        self.dict_link = memoryview(self.arrays["dict_link"])
+
+    def __contains__(self, key: str) -> bool:
+        node = 0
+        for char in key:
+            node = self._goto(node, ord(char))
+            if node < 0:
+                return False
+        return self.output[node] > 0
+
+    def find(self, text: str) -> Generator[tuple[int, int], None, None]:
+        """
+        Find all occurrences of anchors in a text, including overlapping ones.
+        :param text: The lowercased text
+        :return: Generator of (start, end) character offsets of the occurrences, ordered by end
+        """
+        node = 0
+        for end, char in enumerate(text, start=1):
+            code = ord(char)
+            while True:
+                child = self._goto(node, code)
+                if child >= 0:
+                    node = child
+                    break
+                if node == 0:
+                    break
+                node = self.fail[node]
+            match = node if self.output[node] else self.dict_link[node]
+            while match:
+                yield end - self.output[match], end
+                match = self.dict_link[match]
+
+    def _goto(self, node: int, code: int) -> int:
+        low, high = self.edge_start[node], self.edge_start[node + 1]
+        edge = bisect_left(self.edge_chars, code, low, high)
+        if edge < high and self.edge_chars[edge] == code:
+            return self.edge_targets[edge]
+        return -1
+
+
+def build_anchor_matcher(
+    anchors: Iterable[str], path: str, checksum: str = None
+) -> int:
+    """
+    Build an anchor matcher from the keys of an anchors dataset.
+
+    The automaton is written to a temporary directory next to path which then replaces path, so
+    workers that have the old automaton mapped keep working until they reopen it.
+    :param anchors: The anchors
+    :param path: Path to the automaton directory
+    :param checksum: Checksum of the anchors dataset the automaton was built from
+    :return: The number of anchors in the automaton
+    """
+    # Build the trie from the sorted anchors, so that each anchor shares the nodes of the common
+    # prefix with the previous anchor. Node i + 1 is the target of edge i.
+    parents, chars, output = [], [], [0]
+    path_nodes = [0]
+    previous = ""
+    count = 0
+    for anchor in sorted(set(anchors)):
+        if not anchor:
+            continue
+        prefix = 0
+        for a, b in zip(previous, anchor):
+            if a != b:
+                break
+            prefix += 1
+        del path_nodes[prefix + 1 :]
+        for char in anchor[prefix:]:
+            parents.append(path_nodes[-1])
+            chars.append(ord(char))
+            output.append(0)
+            path_nodes.append(len(output) - 1)
+        output[path_nodes[-1]] = len(anchor)
+        previous = anchor
+        count += 1
+
+    num_nodes = len(output)
+    parents_array = np.array(parents, dtype=np.int64)
+    chars_array = np.array(chars, dtype=np.uint32)
+    order = np.lexsort((chars_array, parents_array))
+    edge_chars = chars_array[order]
+    edge_targets = (order + 1).astype(np.int32)
+    edge_start = np.searchsorted(parents_array[order], np.arange(num_nodes + 1)).astype(
+        np.int32
+    )
+
+    # Compute the failure and dictionary links breadth-first.
+    edge_start_list = edge_start.tolist()
+    edge_chars_list = edge_chars.tolist()
+    edge_targets_list = edge_targets.tolist()
+
+    def goto(node, code):
+        low, high = edge_start_list[node], edge_start_list[node + 1]
+        edge = bisect_left(edge_chars_list, code, low, high)
+        if edge < high and edge_chars_list[edge] == code:
+            return edge_targets_list[edge]
+        return -1
+
+    fail = [0] * num_nodes
+    dict_link = [0] * num_nodes
+    queue = deque([0])
+    while queue:
+        node = queue.popleft()
+        for edge in range(edge_start_list[node], edge_start_list[node + 1]):
+            child, code = edge_targets_list[edge], edge_chars_list[edge]
+            queue.append(child)
+            if node == 0:
+                continue
+            state = fail[node]
+            while goto(state, code) < 0 and state != 0:
+                state = fail[state]
+            target = goto(state, code)
+            fail[child] = target if target >= 0 else 0
+            fallback = fail[child]
+            dict_link[child] = fallback if output[fallback] else dict_link[fallback]
+
+    arrays = {
+        "edge_start": edge_start,
+        "edge_chars": edge_chars,
+        "edge_targets": edge_targets,
+        "fail": np.array(fail, dtype=np.int32),
+        "output": np.array(output, dtype=np.int32),
+        "dict_link": np.array(dict_link, dtype=np.int32),
+    }
+    parent = os.path.dirname(os.path.abspath(path))
+    tmp_path = tempfile.mkdtemp(dir=parent, prefix=".anchormatcher")
+    for name in ARRAYS:
+        np.save(os.path.join(tmp_path, "%s.npy" % name), arrays[name])
+    with open(os.path.join(tmp_path, "meta.json"), mode="w") as meta_file:
+        json.dump({"checksum": checksum, "count": count}, meta_file)
+    os.chmod(tmp_path, 0o755)
+    if os.path.exists(path):
+        old_path = tempfile.mkdtemp(dir=parent, prefix=".anchormatcher")
+        os.rename(path, os.path.join(old_path, "matcher"))
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path)
+    else:
+        os.rename(tmp_path, path)
+    return count
+
+
+_open_matchers = {}
+_open_matchers_lock = threading.Lock()
+
+
+def open_anchor_matcher(path: str) -> AnchorMatcher:
+    """
+    Open an anchor matcher, reusing the matcher already opened by this process unless it was
+    rebuilt since.
+    :return: The matcher, or None if there is no matcher at path
+    """
+    meta_path = os.path.join(path, "meta.json")
+    try:
+        stat = os.stat(meta_path)
+    except FileNotFoundError:
+        return None
+    version = (stat.st_ino, stat.st_mtime_ns)
+    with _open_matchers_lock:
+        matcher, matcher_version = _open_matchers.get(path, (None, None))
+        if matcher is None or matcher_version != version:
+            matcher = AnchorMatcher(path)
+            _open_matchers[path] = (matcher, version)
+    return matcher
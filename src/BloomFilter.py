@@ -0,0 +1,206 @@
+import hashlib
+import math
+import os
+import struct
+import tempfile
+import threading
+from collections.abc import Iterable
+
+MAGIC = b"MWBF"
+# magic, format version, number of bits, number of hash functions, number of keys, false positive
+# rate and checksum length, followed by the checksum and the bit array.
+HEADER = struct.Struct("<4sHQIQdH")
+VERSION = 1
+
+
+class BloomFilter:
+    def __init__(
+        self,
+        num_bits: int,
+        num_hashes: int,
+        bits: bytes = None,
+        count: int = 0,
+        false_positive_rate: float = None,
+        checksum: str = None,
+    ):
+        """
+        Probabilistic set membership filter, used to drop candidate mentions that are definitely not
+        anchors before looking them up in the anchors dataset.
+
+        Keys that were added are always reported as present; other keys are reported as present
+        with a probability of about false_positive_rate.
+        :param num_bits: Size of the bit array
+        :param num_hashes: Number of hash functions
+        :param bits: The bit array, all zeros if omitted
+        :param count: Number of keys in the filter
+        :param false_positive_rate: The false positive rate the filter was sized for
+        :param checksum: Checksum of the dataset the filter was built from
+        """
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bits if bits is not None else bytearray((num_bits + 7) // 8)
+        self.count = count
+        self.false_positive_rate = false_positive_rate
+        self.checksum = checksum
+        # Per-process statistics, reported in the request log.
+        self.checks = 0
+        self.rejections = 0
+
+    @classmethod
+    def create(
+        cls, num_keys: int, false_positive_rate: float, checksum: str = None
+    ) -> "BloomFilter":
+        """
+        Create an empty filter sized for num_keys keys at the given false positive rate.
+        """
+        num_keys = max(num_keys, 1)
+        num_bits = math.ceil(
+            -num_keys * math.log(false_positive_rate) / (math.log(2) ** 2)
+        )
+        num_hashes = max(1, round(num_bits / num_keys * math.log(2)))
+        return cls(
+            num_bits,
+            num_hashes,
+            false_positive_rate=false_positive_rate,
+            checksum=checksum,
+        )
+
+    def add(self, key: str):
+        for index in self._get_indexes(key):
+            self.bits[index >> 3] |= 1 << (index & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        self.checks += 1
+        for index in self._get_indexes(key):
+            if not self.bits[index >> 3] & (1 << (index & 7)):
+                self.rejections += 1
+                return False
+        return True
+
+    def get_expected_false_positive_rate(self) -> float:
+        """
+        :return: The false positive rate expected from the number of keys in the filter
+        """
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** (
+            self.num_hashes
+        )
+
+    def get_stats(self) -> dict:
+        return {
+            "false_positive_rate": self.false_positive_rate,
+            "expected_false_positive_rate": self.get_expected_false_positive_rate(),
+            "checks": self.checks,
+            "rejections": self.rejections,
+        }
+
+    def to_bytes(self) -> bytes:
+        checksum = (self.checksum or "").encode("utf-8")
+        return (
+            HEADER.pack(
+                MAGIC,
+                VERSION,
+                self.num_bits,
+                self.num_hashes,
+                self.count,
+                self.false_positive_rate or 0.0,
+                len(checksum),
+            )
+            + checksum
+            + bytes(self.bits)
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "BloomFilter":
+        (
+            magic,
+            version,
+            num_bits,
+            num_hashes,
+            count,
+            false_positive_rate,
+            checksum_length,
+        ) = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a bloom filter or unsupported version")
+        offset = HEADER.size
+        checksum = data[offset : offset + checksum_length].decode("utf-8") or None
+        offset += checksum_length
+        bits = bytes(data[offset:])
+        return cls(
+            num_bits,
+            num_hashes,
+            bits=bits,
+            count=count,
+            false_positive_rate=false_positive_rate or None,
+            checksum=checksum,
+        )
+
+    def save(self, path: str):
+        """
+        Write the filter to a file, replacing the file atomically.
+        """
+        tmp_fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)), prefix=".bloomfilter"
+        )
+        with os.fdopen(tmp_fd, mode="wb") as file:
+            file.write(self.to_bytes())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+
+    def _get_indexes(self, key: str):
+        # Double hashing: the k indexes are derived from two 64 bit hashes.
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        hash_a = int.from_bytes(digest[:8], "little")
+        hash_b = int.from_bytes(digest[8:], "little") | 1
+        return [(hash_a + i * hash_b) % self.num_bits for i in range(self.num_hashes)]
+
+
+def get_false_positive_rate() -> float:
+    return float(os.environ.get("ANCHOR_FILTER_FALSE_POSITIVE_RATE", 0.01))
+
+
+def build_bloom_filter(
+    keys: Iterable[str],
+    num_keys: int,
+    false_positive_rate: float = None,
+    checksum: str = None,
+) -> BloomFilter:
+    """
+    Build a filter over the keys of a dataset.
+    :param keys: The keys
+    :param num_keys: The number of keys, used to size the filter
+    :param false_positive_rate: The false positive rate, defaults to the
+      ANCHOR_FILTER_FALSE_POSITIVE_RATE environment variable and falls back to 0.01
+    :param checksum: Checksum of the dataset the filter is built from
+    """
+    bloom_filter = BloomFilter.create(
+        num_keys, false_positive_rate or get_false_positive_rate(), checksum
+    )
+    for key in keys:
+        bloom_filter.add(key)
+    return bloom_filter
+
+
+_open_filters = {}
+_open_filters_lock = threading.Lock()
+
+
+def open_bloom_filter(path: str) -> BloomFilter:
+    """
+    Open a filter file, reusing the filter already loaded by this process unless the file was
+    replaced since.
+    :return: The filter, or None if there is no filter at path
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    version = (stat.st_ino, stat.st_mtime_ns)
+    with _open_filters_lock:
+        bloom_filter, filter_version = _open_filters.get(path, (None, None))
+        if bloom_filter is None or filter_version != version:
+            with open(path, mode="rb") as file:
+                bloom_filter = BloomFilter.from_bytes(file.read())
+            _open_filters[path] = (bloom_filter, version)
+    return bloom_filter
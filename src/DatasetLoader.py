@@ -1,12 +1,20 @@
+from collections import OrderedDict
 from typing import Tuple
 import tempfile
+import threading
 import os
 
+from src.AnchorMatcher import AnchorMatcher, open_anchor_matcher
+from src.BloomFilter import BloomFilter, open_bloom_filter
+from src.Deadline import Deadline
+from src.EmbeddingStore import EmbeddingStore, open_embedding_store
+from src.LookupCache import lookup_cache
+
 if os.getenv("DB_BACKEND") != "mysql":
     from sqlitedict import SqliteDict
 else:
     from src import MySqlDict
-    from src.mysql import get_mysql_connection
+    from src.mysql import get_connection_pool
 
 
 class DatasetLoader:
@@ -19,43 +27,295 @@ class DatasetLoader:
             self.model_path = os.path.join(
                 tempfile.gettempdir(), "{0}.linkmodel.json".format(wiki_id)
             )
-            self.mysql_connection = get_mysql_connection()
         else:
             self.model_path = os.path.join(
                 data_dir, "data/{0}/{0}.linkmodel.json".format(wiki_id)
             )
+        self.mysql_connection = None
+        self.datasets = {}
+        self.deadline = None
+        self.in_use = False
+        # Set when the loader is evicted from the cache or not cached at all, see close_when_released().
+        self.close_on_release = False
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def acquire(self):
+        """
+        Prepare the dataset handles for a request. With MySQL, a connection is borrowed from the
+        connection pool and bound to the handles, and their per-request state is reset.
+        """
+        with self.lock:
+            self.in_use = True
+        if self.backend != "mysql":
+            return
+        self.mysql_connection = get_connection_pool().borrow()
+        for dataset in self.datasets.values():
+            dataset.set_connection(self.mysql_connection)
+            dataset.reset_query_count()
+            # Values can change when datasets are reloaded, so don't keep them across requests.
+            # The shared lookup cache is invalidated by the dataset checksums instead.
+            dataset.in_process_cache.clear()
+        for tablename, dataset in list(self.datasets.items()):
+            if dataset.lookup_cache is not None:
+                dataset.checksum = self._get_checksum(tablename)
+
+    def set_deadline(self, deadline: Deadline = None):
+        """
+        Bound the dataset queries of the current request by its deadline (with MySQL).
+        :param deadline: The deadline, or None for no limit
+        """
+        self.deadline = deadline
+        if self.backend != "mysql":
+            return
+        for dataset in self.datasets.values():
+            dataset.set_deadline(deadline)
+
+    def release(self):
+        """
+        Return the connection borrowed by acquire() to the connection pool. If the loader is no
+        longer cached, the dataset handles are closed too.
+        """
+        with self.lock:
+            self.in_use = False
+            close_datasets = self.close_on_release
+        self.set_deadline(None)
+        if self.mysql_connection is not None:
+            get_connection_pool().release(self.mysql_connection)
+            self.mysql_connection = None
+        if close_datasets:
+            self._close_datasets()
+
+    def close(self):
+        """
+        Close the dataset handles.
+        """
+        self.release()
+        self._close_datasets()
+
+    def close_when_released(self):
+        """
+        Close the dataset handles now if the loader isn't in use by a request, otherwise once the
+        request releases it.
+        """
+        with self.lock:
+            if self.in_use:
+                self.close_on_release = True
+                return
+        self.close()
+
+    def _close_datasets(self):
+        for dataset in self.datasets.values():
+            if self.backend != "mysql":
+                dataset.close()
+        self.datasets = {}
 
     def get(self, tablename=None):
+        if tablename == "w2vfiltered":
+            embedding_store = self.get_embedding_store()
+            if embedding_store is not None:
+                return embedding_store
+        if tablename in self.datasets:
+            return self.datasets[tablename]
         if self.backend == "mysql":
+            if self.mysql_connection is None:
+                self.acquire()
             if tablename in ["model", "checksum"]:
                 table = "%s_%s" % (self.table_prefix, tablename)
             else:
                 table = "%s_%s_%s" % (self.table_prefix, self.wiki_id, tablename)
-            return MySqlDict.MySqlDict(
+            dataset = MySqlDict.MySqlDict(
                 tablename=table,
                 conn=self.mysql_connection,
                 datasetname=tablename,
+                deadline=self.deadline,
             )
+            if tablename not in ["model", "checksum"]:
+                dataset.lookup_cache = lookup_cache
+                dataset.checksum = self._get_checksum(tablename)
         else:
-            return SqliteDict(
-                os.path.join(
-                    self.data_dir,
-                    ("data/{0}/{0}.%s.sqlite" % tablename).format(self.wiki_id),
-                )
+            dataset = SqliteDict(self.get_sqlite_path(tablename))
+        self.datasets[tablename] = dataset
+        return dataset
+
+    def _get_checksum(self, tablename) -> str:
+        # The checksums are also needed for the response, so these lookups are not wasted.
+        try:
+            return self.get("checksum")["%s_%s" % (self.wiki_id, tablename)]
+        except KeyError:
+            return None
+
+    def get_sqlite_path(self, tablename) -> str:
+        return os.path.join(
+            self.data_dir,
+            ("data/{0}/{0}.%s.sqlite" % tablename).format(self.wiki_id),
+        )
+
+    def get_sqlite_checksum(self, tablename) -> str:
+        """
+        Get a checksum identifying the current version of a SQLite dataset: the checksum in the
+        checksum file next to it if it exists, otherwise the modification time and size of the
+        SQLite file.
+        :return:
+        The checksum, or None if there is no such dataset
+        """
+        path = self.get_sqlite_path(tablename)
+        checksum_path = "%s.checksum" % path
+        if os.path.exists(checksum_path):
+            with open(checksum_path) as checksum_file:
+                return checksum_file.readline().split(" ")[0].strip()
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        return "%d-%d" % (stat.st_mtime_ns, stat.st_size)
+
+    def get_embedding_store_path(self) -> str:
+        """
+        Get the path of the memory-mapped embedding store (see EmbeddingStore.py) for the wiki. With
+        SQLite, the store is kept next to the SQLite files; with MySQL, in EMBEDDING_STORE_DIR.
+        :return:
+        The path, or None if no directory for embedding stores is configured
+        """
+        if self.backend == "mysql":
+            embedding_store_dir = os.environ.get("EMBEDDING_STORE_DIR")
+            if not embedding_store_dir:
+                return None
+            return os.path.join(
+                embedding_store_dir, "%s.w2vfiltered.store" % self.wiki_id
+            )
+        return os.path.join(
+            self.data_dir, "data/{0}/{0}.w2vfiltered.store".format(self.wiki_id)
+        )
+
+    def get_embedding_store(self) -> EmbeddingStore:
+        """
+        Get the embedding store for the wiki if there is one. With MySQL, the store is only used if
+        it was built from the w2vfiltered dataset that is currently imported.
+        :return:
+        The embedding store, or None
+        """
+        path = self.get_embedding_store_path()
+        if path is None:
+            return None
+        embedding_store = open_embedding_store(path)
+        if embedding_store is None or self.backend != "mysql":
+            return embedding_store
+        if self._is_current(embedding_store.checksum, "w2vfiltered"):
+            return embedding_store
+        return None
+
+    def get_anchor_matcher_path(self) -> str:
+        """
+        Get the path of the anchor matcher (see AnchorMatcher.py) for the wiki. With SQLite, the
+        matcher is kept next to the SQLite files; with MySQL, in ANCHOR_MATCHER_DIR.
+        :return:
+        The path, or None if no directory for anchor matchers is configured
+        """
+        if self.backend == "mysql":
+            anchor_matcher_dir = os.environ.get("ANCHOR_MATCHER_DIR")
+            if not anchor_matcher_dir:
+                return None
+            return os.path.join(anchor_matcher_dir, "%s.anchors.matcher" % self.wiki_id)
+        return os.path.join(
+            self.data_dir, "data/{0}/{0}.anchors.matcher".format(self.wiki_id)
+        )
+
+    def get_anchor_matcher(self) -> AnchorMatcher:
+        """
+        Get the anchor matcher for the wiki if there is one. The matcher is only used if it was built
+        from the current anchors dataset (with MySQL, the one that is currently imported).
+        :return:
+        The anchor matcher, or None
+        """
+        path = self.get_anchor_matcher_path()
+        if path is None:
+            return None
+        anchor_matcher = open_anchor_matcher(path)
+        if anchor_matcher is None:
+            return None
+        if self.backend != "mysql":
+            if anchor_matcher.checksum != self.get_sqlite_checksum("anchors"):
+                return None
+            return anchor_matcher
+        if self._is_current(anchor_matcher.checksum, "anchors"):
+            return anchor_matcher
+        return None
+
+    def get_anchor_filter_path(self) -> str:
+        """
+        Get the path of the anchor filter (see BloomFilter.py) for the wiki, next to the model.
+        """
+        return os.path.join(
+            os.path.dirname(self.model_path), "%s.anchors.bloom" % self.wiki_id
+        )
+
+    def get_anchor_filter(self) -> BloomFilter:
+        """
+        Get the filter over the anchors of the wiki if there is one. The filter is only used if it
+        was built from the current anchors dataset. With MySQL, the filter is read from the
+        anchorfilter table and saved next to the model.
+        :return:
+        The anchor filter, or None
+        """
+        path = self.get_anchor_filter_path()
+        if self.backend != "mysql":
+            anchor_filter = open_bloom_filter(path)
+            if anchor_filter is None:
+                return None
+            if anchor_filter.checksum != self.get_sqlite_checksum("anchors"):
+                return None
+            return anchor_filter
+        checksum = self._get_checksum("anchors")
+        if checksum is None or not self._is_current(checksum, "anchorfilter"):
+            return None
+        anchor_filter = open_bloom_filter(path)
+        if anchor_filter is None or anchor_filter.checksum != checksum:
+            anchor_filter = self._load_anchor_filter_from_mysql(path)
+        return anchor_filter
+
+    def _is_current(self, checksum: str, tablename: str) -> bool:
+        # Whether an artifact built from a dataset was built from the currently imported dataset.
+        stored_checksum = self._get_checksum(tablename)
+        return stored_checksum is not None and stored_checksum == checksum
+
+    def has_dataset(self, tablename) -> bool:
+        """
+        Check whether an optional dataset (e.g. anchorstats, which is derived from anchors when
+        importing datasets) is available for the wiki.
+        """
+        if self.backend == "mysql":
+            return "%s_%s" % (self.wiki_id, tablename) in self.get("checksum")
+        if not os.path.exists(self.get_sqlite_path(tablename)):
+            return False
+        if tablename == "anchorstats":
+            # Like with MySQL, the statistics share the checksum of the anchors they were computed
+            # from, so they are not used once the anchors change.
+            return self.get_sqlite_checksum(tablename) == self.get_sqlite_checksum(
+                "anchors"
             )
+        return True
 
     def get_model_path(self) -> Tuple[str, list]:
         """
         Get the path to the model. If we're using SQLite, it's assumed the model already exists
         in the data/{wiki_id} directory. If we're using MySQL, check if the model exists in the temp dir
-        and if so return that path, otherwise attempt to load from MySQL, save it to the system temp dir
+        and was saved for the current model checksum and if so return that path, otherwise attempt to
+        load from MySQL, save it to the system temp dir
         :return:
         A tuple of model path (if model is found) and a list of valid domains (if model not found)
         """
-        if os.path.exists(self.model_path):
-            return self.model_path, []
-        elif self.backend == "mysql":
+        if self.backend == "mysql":
+            if os.path.exists(self.model_path) and self._is_model_file_current():
+                return self.model_path, []
             return self._load_model_from_mysql()
+        elif os.path.exists(self.model_path):
+            return self.model_path, []
         else:
             # SQLite backend.
             # TODO: Could generate a list of valid project/subdomain pairs by traversing the
@@ -63,12 +323,75 @@ class DatasetLoader:
             # be left for a follow-up some day.
             return "", []
 
+    def get_model_checksum(self) -> str:
+        """
+        Get a checksum identifying the current version of the model. With MySQL this is the checksum
+        stored in the checksum table by load-datasets.py. With SQLite, the checksum file next to the
+        model is used if it exists, otherwise the modification time and size of the model file.
+        :return:
+        The checksum of the model
+        """
+        if self.backend == "mysql":
+            stored_checksum = self._get_stored_model_checksum()
+            if stored_checksum is not None:
+                return stored_checksum
+        checksum_path = self._get_model_checksum_path()
+        if os.path.exists(checksum_path):
+            with open(checksum_path) as checksum_file:
+                return checksum_file.readline().split(" ")[0].strip()
+        stat = os.stat(self.model_path)
+        return "%d-%d" % (stat.st_mtime_ns, stat.st_size)
+
+    def _get_model_checksum_path(self) -> str:
+        return "%s.checksum" % self.model_path
+
+    def _get_stored_model_checksum(self) -> str:
+        # The checksum of the model in the checksum table, or None if there is none.
+        try:
+            return self.get("checksum")["%s_model" % self.wiki_id]
+        except KeyError:
+            return None
+
+    def _is_model_file_current(self) -> bool:
+        # Whether the model in the temp dir was saved from the model that is currently imported.
+        stored_checksum = self._get_stored_model_checksum()
+        if stored_checksum is None:
+            return True
+        checksum_path = self._get_model_checksum_path()
+        if not os.path.exists(checksum_path):
+            return False
+        with open(checksum_path) as checksum_file:
+            return checksum_file.readline().split(" ")[0].strip() == stored_checksum
+
+    def _load_anchor_filter_from_mysql(self, path: str) -> BloomFilter:
+        """
+        Obtain the anchor filter from a MySQL table and write to disk.
+        :return:
+        The anchor filter, or None if there is no filter for the wiki
+        """
+        if self.mysql_connection is None:
+            self.acquire()
+        cursor = self.mysql_connection.cursor()
+        cursor.execute(
+            "SELECT value FROM {tablename} WHERE lookup = %s".format(
+                tablename="%s_anchorfilter" % self.table_prefix
+            ),
+            (self.wiki_id,),
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        BloomFilter.from_bytes(row[0]).save(path)
+        return open_bloom_filter(path)
+
     def _load_model_from_mysql(self) -> Tuple[str, list]:
         """
         Obtain the link recommendation model from a MySQL table and write to disk.
         :return:
         A tuple of model path (if model is found) and a list of valid domains (if model not found)
         """
+        if self.mysql_connection is None:
+            self.acquire()
         cursor = self.mysql_connection.cursor()
         cursor.execute("SELECT value FROM lr_model WHERE lookup = %s", (self.wiki_id,))
         model = cursor.fetchone()
@@ -82,8 +405,59 @@ class DatasetLoader:
                 domain_name = domain[0].replace("wiki", "")
                 valid_domains.append("%s/%s" % ("wikipedia", domain_name))
             return "", valid_domains
-        file = open(self.model_path, mode="w")
-        output = model[0].decode("utf-8")
-        file.write(output)
-        file.close()
+        # Replace the files atomically, as other workers may be reading them.
+        stored_checksum = self._get_stored_model_checksum()
+        temp_path = "%s.%d.tmp" % (self.model_path, os.getpid())
+        with open(temp_path, mode="w") as file:
+            file.write(model[0].decode("utf-8"))
+        os.replace(temp_path, self.model_path)
+        checksum_path = self._get_model_checksum_path()
+        if stored_checksum is None:
+            if os.path.exists(checksum_path):
+                os.remove(checksum_path)
+        else:
+            with open(temp_path, mode="w") as file:
+                file.write(stored_checksum)
+            os.replace(temp_path, checksum_path)
         return self.model_path, []
+
+
+_dataset_loaders = OrderedDict()
+_dataset_loaders_lock = threading.Lock()
+
+
+def get_dataset_loader(backend="mysql", wiki_id=None, data_dir=None) -> DatasetLoader:
+    """
+    Get the DatasetLoader for a wiki, reusing the loader (and its dataset handles) of a previous
+    request in this process. Use the loader as a context manager for the duration of a request.
+
+    Up to DATASET_LOADER_CACHE_SIZE loaders are kept, the least recently used ones are closed (once
+    released, if they are in use). A loader that is in use by a concurrent request is not shared; a
+    new one is returned instead, which is closed once released.
+    """
+    key = (backend, wiki_id, data_dir)
+    max_size = int(os.environ.get("DATASET_LOADER_CACHE_SIZE", 32))
+    with _dataset_loaders_lock:
+        datasetloader = _dataset_loaders.get(key)
+        if datasetloader is not None and datasetloader.in_use:
+            # Not cached, so it is closed once the request is done with it.
+            datasetloader = DatasetLoader(
+                backend=backend, wiki_id=wiki_id, data_dir=data_dir
+            )
+            datasetloader.close_on_release = True
+            return datasetloader
+        if datasetloader is None:
+            datasetloader = DatasetLoader(
+                backend=backend, wiki_id=wiki_id, data_dir=data_dir
+            )
+            _dataset_loaders[key] = datasetloader
+        _dataset_loaders.move_to_end(key)
+        evicted = []
+        while len(_dataset_loaders) > max_size:
+            _, oldest = _dataset_loaders.popitem(last=False)
+            evicted.append(oldest)
+        # Mark the loader as in use before releasing the lock, so it isn't handed out twice.
+        datasetloader.in_use = True
+    for oldest in evicted:
+        oldest.close_when_released()
+    return datasetloader
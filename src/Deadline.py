@@ -0,0 +1,72 @@
+import os
+import time
+
+# Request header with which clients can set a shorter time budget, in seconds.
+DEADLINE_HEADER = "X-Request-Timeout"
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, stage: str, budget: float):
+        """
+        Raised when the time budget of a request is used up.
+        :param stage: The processing stage during which the budget ran out
+        :param budget: The time budget of the request in seconds
+        """
+        super().__init__(
+            "Time budget of %g seconds exceeded during %s" % (budget, stage)
+        )
+        self.stage = stage
+        self.budget = budget
+
+
+class Deadline:
+    def __init__(self, budget: float = None, clock=time.monotonic):
+        """
+        Time budget of a request, shared by all stages of processing it: fetching the page,
+        parsing it, looking up the datasets, classifying the mentions and placing the links.
+        Stages check the deadline at cheap points, so that a request returns the links found
+        so far instead of being killed by gunicorn.
+        :param budget: The time budget in seconds, starting now; defaults to GUNICORN_TIMEOUT
+          minus a one second buffer to return the response
+        :param clock: Function returning the current time in seconds
+        """
+        self.budget = (
+            budget
+            if budget is not None
+            else float(os.environ.get("GUNICORN_TIMEOUT", 30)) - 1
+        )
+        self.clock = clock
+        self.expires_at = self.clock() + self.budget
+
+    @classmethod
+    def from_header(cls, value: str = None, clock=time.monotonic) -> "Deadline":
+        """
+        Create the deadline of a request from the value of DEADLINE_HEADER. Clients can only
+        shorten the default budget; missing, invalid and larger values are ignored.
+        """
+        deadline = cls(clock=clock)
+        try:
+            budget = float(value)
+        except (TypeError, ValueError):
+            return deadline
+        if 0 < budget < deadline.budget:
+            deadline.expires_at -= deadline.budget - budget
+            deadline.budget = budget
+        return deadline
+
+    def remaining(self) -> float:
+        """
+        :return: The remaining time in seconds, 0 once the deadline has passed
+        """
+        return max(0.0, self.expires_at - self.clock())
+
+    def expired(self) -> bool:
+        return self.clock() >= self.expires_at
+
+    def check(self, stage: str):
+        """
+        :param stage: The processing stage, reported when the deadline has passed
+        :raises DeadlineExceeded: If the deadline has passed
+        """
+        if self.expired():
+            raise DeadlineExceeded(stage, self.budget)
@@ -0,0 +1,155 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections.abc import Iterable
+
+import numpy as np
+
+
+class EmbeddingStore:
+    def __init__(self, path: str, datasetname: str = "w2vfiltered"):
+        """
+        Read-only store of unit-normalized float32 embeddings, used in place of the w2vfiltered dataset.
+
+        The store is a directory (see build_embedding_store) holding a contiguous vector matrix and the
+        titles sorted by their UTF-8 encoding. Both are memory-mapped, so all gunicorn workers on a host
+        share the same physical pages, and cosine similarity is a dot product of two rows.
+        :param path: Path to the store directory
+        :param datasetname: The name of the dataset the store replaces
+        """
+        self.path = path
+        self.datasetname = datasetname
+        with open(os.path.join(path, "meta.json")) as meta_file:
+            meta = json.load(meta_file)
+        self.checksum = meta.get("checksum")
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.titles = np.load(os.path.join(path, "titles.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        # The store doesn't issue any queries, but is reported like the other datasets.
+        self.query_count = 0
+        self.query_details = {}
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def __contains__(self, key):
+        return self.get_row(key) is not None
+
+    def __getitem__(self, key):
+        row = self.get_row(key)
+        if row is None:
+            raise KeyError(key)
+        return self.vectors[row]
+
+    def get(self, key, default=None):
+        row = self.get_row(key)
+        return default if row is None else self.vectors[row]
+
+    def get_many(self, keys: Iterable) -> dict:
+        """
+        Like MySqlDict.get_many: the embeddings of the keys that are in the store.
+        """
+        rows = {key: self.get_row(key) for key in keys}
+        return {key: self.vectors[row] for key, row in rows.items() if row is not None}
+
+    def get_row(self, key: str) -> int:
+        """
+        Binary search for a title in the sorted titles.
+        :return: The row of the title in the vector matrix, or None if the title is not in the store
+        """
+        encoded_key = key.encode("utf-8")
+        low, high = 0, len(self.offsets) - 1
+        while low < high:
+            middle = (low + high) // 2
+            title = self._get_title(middle)
+            if title < encoded_key:
+                low = middle + 1
+            elif title > encoded_key:
+                high = middle
+            else:
+                return middle
+        return None
+
+    def similarity(self, key_a: str, key_b: str) -> float:
+        """
+        Cosine similarity of the embeddings of two titles. Like getDistEmb, this is 0 if either title
+        is missing or has an all-zero embedding.
+        """
+        row_a = self.get_row(key_a)
+        row_b = self.get_row(key_b)
+        if row_a is None or row_b is None:
+            return 0.0
+        return float(np.dot(self.vectors[row_a], self.vectors[row_b]))
+
+    def _get_title(self, row: int) -> bytes:
+        return self.titles[self.offsets[row] : self.offsets[row + 1]].tobytes()
+
+
+def build_embedding_store(embeddings: Iterable, path: str, checksum: str = None) -> int:
+    """
+    Build an embedding store from (title, vector) pairs, e.g. the items of the w2vfiltered dataset.
+
+    The store is written to a temporary directory next to path which then replaces path, so workers
+    that have the old store mapped keep working until they reopen it.
+    :param embeddings: (title, vector) pairs
+    :param path: Path to the store directory
+    :param checksum: Checksum of the dataset the store was built from
+    :return: The number of embeddings in the store
+    """
+    items = sorted(
+        ((title.encode("utf-8"), vector) for title, vector in embeddings),
+        key=lambda item: item[0],
+    )
+    vectors = np.array([vector for _, vector in items], dtype=np.float32)
+    if len(items):
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        # All-zero embeddings stay zero, so their similarity to anything is 0.
+        vectors = np.divide(
+            vectors, norms, out=np.zeros_like(vectors), where=norms != 0
+        )
+    offsets = np.zeros(len(items) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(title) for title, _ in items])
+    titles = np.frombuffer(b"".join(title for title, _ in items), dtype=np.uint8)
+
+    parent = os.path.dirname(os.path.abspath(path))
+    tmp_path = tempfile.mkdtemp(dir=parent, prefix=".embeddingstore")
+    np.save(os.path.join(tmp_path, "vectors.npy"), vectors)
+    np.save(os.path.join(tmp_path, "titles.npy"), titles)
+    np.save(os.path.join(tmp_path, "offsets.npy"), offsets)
+    with open(os.path.join(tmp_path, "meta.json"), mode="w") as meta_file:
+        json.dump({"checksum": checksum, "count": len(items)}, meta_file)
+    os.chmod(tmp_path, 0o755)
+    if os.path.exists(path):
+        old_path = tempfile.mkdtemp(dir=parent, prefix=".embeddingstore")
+        os.rename(path, os.path.join(old_path, "store"))
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path)
+    else:
+        os.rename(tmp_path, path)
+    return len(items)
+
+
+_open_stores = {}
+_open_stores_lock = threading.Lock()
+
+
+def open_embedding_store(path: str) -> EmbeddingStore:
+    """
+    Open an embedding store, reusing the store already opened by this process unless it was rebuilt
+    since.
+    :return: The store, or None if there is no store at path
+    """
+    meta_path = os.path.join(path, "meta.json")
+    try:
+        stat = os.stat(meta_path)
+    except FileNotFoundError:
+        return None
+    version = (stat.st_ino, stat.st_mtime_ns)
+    with _open_stores_lock:
+        store, store_version = _open_stores.get(path, (None, None))
+        if store is None or store_version != version:
+            store = EmbeddingStore(path)
+            _open_stores[path] = (store, version)
+    return store
@@ -0,0 +1,217 @@
+import json
+import os
+from typing import Tuple
+
+import numpy as np
+import xgboost as xgb
+
+
+class InferenceBackend:
+    """
+    Scores feature rows with a link model. Backends follow the predict_proba interface of
+    xgboost.XGBClassifier, so they can be passed to classify_links in place of the model.
+    """
+
+    name = None
+
+    def predict_proba(self, features: np.ndarray) -> np.ndarray:
+        """
+        :param features: A (rows, features) array of feature rows
+        :return: A (rows, 2) array with the probabilities of the negative and positive class
+        """
+        raise NotImplementedError
+
+
+class ClassifierBackend(InferenceBackend):
+    name = "classifier"
+
+    def __init__(self, model: xgb.XGBClassifier):
+        """
+        Uses the predict_proba method of the scikit-learn wrapper.
+        :param model: The link model
+        """
+        self.model = model
+
+    def predict_proba(self, features: np.ndarray) -> np.ndarray:
+        return self.model.predict_proba(features)
+
+
+class InplacePredictBackend(InferenceBackend):
+    name = "inplace"
+
+    def __init__(self, model: xgb.XGBClassifier, nthread: int = None):
+        """
+        Calls Booster.inplace_predict directly, skipping the input validation of the
+        scikit-learn wrapper and the DMatrix construction.
+        :param model: The link model
+        :param nthread: Number of threads to use for prediction (INFERENCE_NTHREAD). Batches
+          are small, so the default of one thread avoids the thread pool overhead.
+        """
+        self.booster = model.get_booster()
+        self.booster.set_param(
+            {"nthread": nthread or int(os.environ.get("INFERENCE_NTHREAD", 1))}
+        )
+        self.iteration_range = get_iteration_range(self.booster)
+
+    def predict_proba(self, features: np.ndarray) -> np.ndarray:
+        probabilities = self.booster.inplace_predict(
+            features, iteration_range=self.iteration_range, predict_type="value"
+        )
+        return np.column_stack((1 - probabilities, probabilities))
+
+
+class NumpyTreeBackend(InferenceBackend):
+    name = "numpy"
+
+    def __init__(self, model: xgb.XGBClassifier):
+        """
+        Flattens the trees of the booster into NumPy node arrays and evaluates all trees for all
+        rows at once, one tree level per step. This avoids calling into XGBoost at all, which is
+        fastest for the small batches of a single text node.
+        :param model: The link model. Only gbtree boosters with the binary:logistic objective and
+          numerical splits are supported.
+        """
+        booster = model.get_booster()
+        learner = json.loads(booster.save_raw(raw_format="json"))["learner"]
+        if learner["objective"]["name"] != "binary:logistic":
+            raise ValueError("Unsupported objective %s" % learner["objective"]["name"])
+        if learner["gradient_booster"]["name"] != "gbtree":
+            raise ValueError(
+                "Unsupported booster %s" % learner["gradient_booster"]["name"]
+            )
+        gbtree = learner["gradient_booster"]["model"]
+        trees = gbtree["trees"]
+        _, end = get_iteration_range(booster)
+        if end:
+            num_parallel_tree = int(gbtree["gbtree_model_param"]["num_parallel_tree"])
+            trees = trees[: end * num_parallel_tree]
+
+        base_score = parse_base_score(learner["learner_model_param"]["base_score"])
+        self.base_margin = np.float32(np.log(base_score / (1 - base_score)))
+
+        roots = []
+        left, right, split_indices, split_conditions, default_left = [], [], [], [], []
+        self.max_depth = 0
+        offset = 0
+        for tree in trees:
+            if any(tree["split_type"]):
+                raise ValueError("Categorical splits are not supported")
+            tree_left = np.array(tree["left_children"], dtype=np.int64)
+            tree_right = np.array(tree["right_children"], dtype=np.int64)
+            roots.append(offset)
+            # Leaves point to themselves, so rows that reached a leaf stay there.
+            own_index = np.arange(len(tree_left)) + offset
+            is_leaf = tree_left == -1
+            left.append(np.where(is_leaf, own_index, tree_left + offset))
+            right.append(np.where(is_leaf, own_index, tree_right + offset))
+            split_indices.append(tree["split_indices"])
+            # For leaves, split_conditions holds the leaf value.
+            split_conditions.append(tree["split_conditions"])
+            default_left.append(tree["default_left"])
+            self.max_depth = max(self.max_depth, get_tree_depth(tree_left, tree_right))
+            offset += len(tree_left)
+
+        self.roots = np.array(roots, dtype=np.int64)
+        self.left = np.concatenate(left)
+        self.right = np.concatenate(right)
+        self.split_indices = np.concatenate(split_indices).astype(np.int64)
+        self.split_conditions = np.concatenate(split_conditions).astype(np.float32)
+        self.default_left = np.concatenate(default_left).astype(bool)
+
+    def predict_proba(self, features: np.ndarray) -> np.ndarray:
+        features = np.asarray(features, dtype=np.float32)
+        rows = np.arange(features.shape[0])[:, None]
+        nodes = np.broadcast_to(self.roots, (features.shape[0], len(self.roots)))
+        for _ in range(self.max_depth):
+            values = features[rows, self.split_indices[nodes]]
+            go_left = np.where(
+                np.isnan(values),
+                self.default_left[nodes],
+                values < self.split_conditions[nodes],
+            )
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        # Accumulate the leaf values tree by tree in single precision, like XGBoost does.
+        leaf_values = np.concatenate(
+            (
+                np.full((features.shape[0], 1), self.base_margin, dtype=np.float32),
+                self.split_conditions[nodes],
+            ),
+            axis=1,
+        )
+        margin = np.cumsum(leaf_values, axis=1, dtype=np.float32)[:, -1]
+        probabilities = 1 / (1 + np.exp(-margin))
+        return np.column_stack((1 - probabilities, probabilities))
+
+
+backends = {
+    backend.name: backend
+    for backend in [ClassifierBackend, InplacePredictBackend, NumpyTreeBackend]
+}
+
+
+def get_inference_backend(
+    model: xgb.XGBClassifier, name: str = None
+) -> InferenceBackend:
+    """
+    Create an inference backend for a model.
+    :param model: The link model
+    :param name: The name of the backend, defaults to the INFERENCE_BACKEND environment variable
+      and falls back to "inplace". If the model is not supported by the backend, the "inplace"
+      backend is used instead.
+    """
+    name = name or os.environ.get("INFERENCE_BACKEND", InplacePredictBackend.name)
+    if name not in backends:
+        raise ValueError("Unknown inference backend %s" % name)
+    try:
+        return backends[name](model)
+    except ValueError:
+        return InplacePredictBackend(model)
+
+
+def as_inference_backend(model) -> InferenceBackend:
+    """
+    Wrap a model that isn't an inference backend yet, e.g. an XGBClassifier passed to
+    process_page directly, with the backend that calls its own predict_proba.
+    """
+    if isinstance(model, InferenceBackend):
+        return model
+    return ClassifierBackend(model)
+
+
+def get_iteration_range(booster: xgb.Booster) -> Tuple[int, int]:
+    # Same as XGBClassifier.predict_proba: models trained with early stopping only use the
+    # trees up to the best iteration.
+    best_iteration = booster.attr("best_iteration")
+    if best_iteration is None:
+        return 0, 0
+    return 0, int(best_iteration) + 1
+
+
+def parse_base_score(value: str) -> float:
+    """
+    Parse the base_score of a model saved as JSON. XGBoost writes it as a number (e.g. "5E-1"),
+    and since 3.0 as a vector with one entry per target (e.g. "[5E-1]").
+    :raises ValueError: If the value isn't a number or a vector with a single entry
+    """
+    value = value.strip()
+    if value.startswith("[") and value.endswith("]"):
+        entries = [entry for entry in value[1:-1].split(",") if entry.strip()]
+        if len(entries) != 1:
+            raise ValueError("Unsupported base_score %s" % value)
+        value = entries[0]
+    return float(value)
+
+
+def get_tree_depth(left: np.ndarray, right: np.ndarray) -> int:
+    depth = 0
+    level = [0]
+    while True:
+        level = [
+            child
+            for node in level
+            for child in (left[node], right[node])
+            if child != -1
+        ]
+        if not level:
+            return depth
+        depth += 1
@@ -0,0 +1,76 @@
+from collections.abc import Iterable
+
+# Ends each anchor in the automaton, so that no substring spans two anchors.
+SEPARATOR = "\x00"
+
+
+class LinkedMentionIndex:
+    def __init__(self, anchors: Iterable[str] = ()):
+        """
+        Index of the anchors that are linked in a page, answering whether a mention is part of
+        any of them in time linear in the length of the mention instead of scanning all anchors.
+
+        The index is a suffix automaton over the anchors, each followed by a separator, which
+        accepts exactly the substrings of the anchors. Anchors are added incrementally, in
+        amortized time linear in their length.
+        :param anchors: The anchors that are linked initially
+        """
+        # Per state: outgoing transitions, suffix link and length of the longest substring
+        # that ends in the state.
+        self.transitions = [{}]
+        self.links = [-1]
+        self.lengths = [0]
+        self.last = 0
+        self.anchors = set()
+        for anchor in anchors:
+            self.add(anchor)
+
+    def add(self, anchor: str):
+        if anchor in self.anchors:
+            return
+        self.anchors.add(anchor)
+        for char in anchor + SEPARATOR:
+            self._extend(char)
+
+    def contains(self, mention: str) -> bool:
+        """
+        :return: Whether the mention is a substring of any anchor in the index
+        """
+        if SEPARATOR in mention:
+            return any(mention in anchor for anchor in self.anchors)
+        state = 0
+        for char in mention:
+            state = self.transitions[state].get(char, -1)
+            if state < 0:
+                return False
+        # The root accepts the empty string, which is only part of an anchor if there is one.
+        return state > 0 or bool(self.anchors)
+
+    def __len__(self) -> int:
+        return len(self.anchors)
+
+    def _extend(self, char: str):
+        transitions, links, lengths = self.transitions, self.links, self.lengths
+        current = len(lengths)
+        transitions.append({})
+        links.append(0)
+        lengths.append(lengths[self.last] + 1)
+        state = self.last
+        while state >= 0 and char not in transitions[state]:
+            transitions[state][char] = current
+            state = links[state]
+        if state >= 0:
+            target = transitions[state][char]
+            if lengths[state] + 1 == lengths[target]:
+                links[current] = target
+            else:
+                clone = len(lengths)
+                transitions.append(dict(transitions[target]))
+                links.append(links[target])
+                lengths.append(lengths[state] + 1)
+                while state >= 0 and transitions[state].get(char) == target:
+                    transitions[state][char] = clone
+                    state = links[state]
+                links[target] = clone
+                links[current] = clone
+        self.last = current
@@ -0,0 +1,109 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+# Approximate per-entry overhead of the OrderedDict entry, key tuple, size bookkeeping and the
+# per-table key index.
+ENTRY_OVERHEAD = 200
+
+
+class LookupCache:
+    def __init__(self, max_bytes: int = None):
+        """
+        Per-process cache of dataset lookups, shared by the MySqlDict instances of all requests.
+
+        Entries are keyed by table and lookup, and store the value as it was read from the table, i.e.
+        pickled, so that their size in memory is bounded by max_bytes. Misses are cached too (as an
+        empty value), as most lookups of anchors are misses. Each table's entries are tied to the
+        checksum of the dataset they were read from, and are dropped when a lookup is done with a
+        different checksum, i.e. after the dataset was reloaded. The least recently used entries are
+        evicted once the cache exceeds max_bytes.
+        :param max_bytes: Maximum approximate size of the cached entries in bytes
+          (LOOKUP_CACHE_MAX_BYTES); 0 disables the cache
+        """
+        self.max_bytes = (
+            max_bytes
+            if max_bytes is not None
+            else int(os.environ.get("LOOKUP_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+        )
+        self.entries = OrderedDict()
+        # The cached lookups of each table, to drop them when the checksum changes.
+        self.table_keys = {}
+        self.checksums = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, table: str, checksum: str, key: str, default=None):
+        """
+        :return: The cached (pickled) value, an empty value for a cached miss, or default if the
+          lookup isn't cached for this checksum of the dataset
+        """
+        with self.lock:
+            self._check_checksum(table, checksum)
+            entry = self.entries.get((table, key))
+            if entry is None:
+                self.misses += 1
+                return default
+            self.entries.move_to_end((table, key))
+            self.hits += 1
+            return entry[0]
+
+    def set(self, table: str, checksum: str, key: str, value: bytes):
+        """
+        Cache the value of a lookup.
+        :param value: The pickled value, or an empty value if the lookup wasn't found
+        """
+        if not self.max_bytes:
+            return
+        size = get_entry_size(key, value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            self._check_checksum(table, checksum)
+            previous = self.entries.pop((table, key), None)
+            if previous is not None:
+                self.total_bytes -= previous[1]
+            self.entries[(table, key)] = (value, size)
+            self.table_keys.setdefault(table, set()).add(key)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                (evicted_table, evicted_key), (_, evicted_size) = self.entries.popitem(
+                    last=False
+                )
+                self.table_keys[evicted_table].discard(evicted_key)
+                self.total_bytes -= evicted_size
+
+    def get_stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+        }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.table_keys.clear()
+            self.checksums.clear()
+            self.total_bytes = 0
+
+    def _check_checksum(self, table: str, checksum: str):
+        if self.checksums.get(table) == checksum:
+            return
+        for key in self.table_keys.pop(table, ()):
+            self.total_bytes -= self.entries.pop((table, key))[1]
+        self.checksums[table] = checksum
+
+
+def get_entry_size(key: str, value: bytes) -> int:
+    """
+    :return: The approximate size of an entry in memory, including the key and the bookkeeping
+    """
+    return sys.getsizeof(key) + sys.getsizeof(value) + ENTRY_OVERHEAD
+
+
+lookup_cache = LookupCache()
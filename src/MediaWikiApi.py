@@ -1,6 +1,8 @@
 import requests
 from urllib.parse import urlparse
 
+from src.Deadline import Deadline, DeadlineExceeded
+
 
 class MediaWikiApi:
     def __init__(
@@ -9,6 +11,7 @@ class MediaWikiApi:
         api_url: str = None,
         proxy_api_url: str = None,
         project: str = "wikipedia",
+        deadline: Deadline = None,
     ):
         """
         :param wiki_domain The wiki domain to use with queries, e.g. "en" for English Wikipedia.
@@ -19,9 +22,12 @@ class MediaWikiApi:
         :param proxy_api_url: The proxy URL to use for network requests (only scheme and network location
           is used). In production it is a value like http://localhost:6500.
         :param project The project to use for the request, e.g. "wikipedia" or "wiktionary"
+        :param deadline The deadline of the current request; requests to MediaWiki time out when
+          it passes
         """
         self.proxy_api_url = proxy_api_url
         self.project = project
+        self.deadline = deadline
         # Ensure that wiki IDs like bat_smg are converted to bat-smg for domain resolution.
         self.wiki_domain = wiki_domain.replace("_", "-")
 
@@ -52,7 +58,17 @@ class MediaWikiApi:
                     scheme=parsed_proxy.scheme, netloc=parsed_proxy.netloc
                 ).geturl()
 
-            r = requests.request(method, url, *args, **kwargs)
+            if self.deadline is not None:
+                self.deadline.check("MediaWiki API request")
+                kwargs["timeout"] = self.deadline.remaining()
+            try:
+                r = requests.request(method, url, *args, **kwargs)
+            except requests.Timeout as e:
+                if self.deadline is None:
+                    raise
+                raise DeadlineExceeded(
+                    "MediaWiki API request", self.deadline.budget
+                ) from e
             if not r.is_redirect:
                 break
 
@@ -0,0 +1,130 @@
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from typing import Tuple
+
+import xgboost as xgb
+
+from src.InferenceBackend import InferenceBackend, get_inference_backend
+from src.scripts.model_utils import get_model_version
+
+
+class ModelRegistryEntry:
+    def __init__(
+        self,
+        checksum: str,
+        model: xgb.XGBClassifier,
+        backend: InferenceBackend,
+        version: str,
+        size: int,
+    ):
+        """
+        A loaded link model along with the metadata needed to decide whether it can be reused.
+        :param checksum: The checksum of the model file the model was loaded from
+        :param model: The loaded model
+        :param backend: The inference backend used to score candidates with the model
+        :param version: The model version as detected by get_model_version ("v1" or "v2")
+        :param size: Approximate in-memory size of the model in bytes
+        """
+        self.checksum = checksum
+        self.model = model
+        self.backend = backend
+        self.version = version
+        self.size = size
+
+
+class ModelRegistry:
+    def __init__(self, max_models: int = None, max_bytes: int = None):
+        """
+        Per-process registry of loaded link models, keyed by wiki ID and model checksum.
+
+        Loading the JSON link model is expensive, so models are kept across requests and only
+        reloaded when the checksum of the model changes. The least recently used models are evicted
+        once either of the configured limits is reached.
+        :param max_models: Maximum number of models to keep loaded (MODEL_REGISTRY_MAX_MODELS)
+        :param max_bytes: Maximum approximate total size of the loaded models in bytes
+          (MODEL_REGISTRY_MAX_BYTES)
+        """
+        self.max_models = (
+            max_models
+            if max_models is not None
+            else int(os.environ.get("MODEL_REGISTRY_MAX_MODELS", 32))
+        )
+        self.max_bytes = (
+            max_bytes
+            if max_bytes is not None
+            else int(os.environ.get("MODEL_REGISTRY_MAX_BYTES", 512 * 1024 * 1024))
+        )
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(
+        self, wiki_id: str, checksum: str, model_path: str
+    ) -> Tuple[InferenceBackend, str]:
+        """
+        Get the model for a wiki, loading it from model_path if it isn't loaded yet or if the
+        loaded model has a different checksum.
+        :return: A tuple of the inference backend for the model and the model version
+        """
+        with self.lock:
+            entry = self.entries.get(wiki_id)
+            if entry is not None and entry.checksum == checksum:
+                self.entries.move_to_end(wiki_id)
+                self.hits += 1
+                return entry.backend, entry.version
+            self.misses += 1
+
+        entry = self._load(checksum, model_path)
+        with self.lock:
+            self._remove(wiki_id)
+            self.entries[wiki_id] = entry
+            self.total_bytes += entry.size
+            self._evict()
+        return entry.backend, entry.version
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def get_stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "models": len(self.entries),
+            "bytes": self.total_bytes,
+        }
+
+    @staticmethod
+    def _load(checksum: str, model_path: str) -> ModelRegistryEntry:
+        model = xgb.XGBClassifier(n_jobs=min([int(multiprocessing.cpu_count() / 4), 8]))
+        model.load_model(model_path)
+        size = len(model.get_booster().save_raw())
+        return ModelRegistryEntry(
+            checksum=checksum,
+            model=model,
+            backend=get_inference_backend(model),
+            version=get_model_version(model),
+            size=size,
+        )
+
+    def _remove(self, wiki_id: str):
+        entry = self.entries.pop(wiki_id, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+
+    def _evict(self):
+        # Always keep the most recently used model, even if it exceeds the memory cap by itself.
+        while len(self.entries) > 1 and (
+            len(self.entries) > self.max_models or self.total_bytes > self.max_bytes
+        ):
+            wiki_id = next(iter(self.entries))
+            self._remove(wiki_id)
+
+
+# Models are loaded lazily, so this is safe to share with gunicorn's preload_app.
+model_registry = ModelRegistry()
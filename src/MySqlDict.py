@@ -1,7 +1,17 @@
 from collections import UserDict
+import math
+import os
 import pickle
 from dotenv import load_dotenv
 
+from src.Deadline import Deadline, DeadlineExceeded
+from src.LookupCache import LookupCache
+
+# Error code of MariaDB when a statement exceeds its max_statement_time.
+STATEMENT_TIMEOUT_ERROR = 1969
+# Value stored in the lookup cache for lookups that weren't found.
+NOT_FOUND = b""
+
 
 class NotFound(UserDict):
     def __init__(self, **kwargs):
@@ -10,7 +20,18 @@ class NotFound(UserDict):
 
 
 class MySqlDict(UserDict):
-    def __init__(self, tablename=None, conn=None, datasetname=None, **kwargs):
+    def __init__(
+        self,
+        tablename=None,
+        conn=None,
+        datasetname=None,
+        lookup_cache: LookupCache = None,
+        checksum: str = None,
+        filter_max_keys: int = None,
+        filter_max_bytes: int = None,
+        deadline: Deadline = None,
+        **kwargs
+    ):
         """
         Like SqlDict (https://pypi.org/project/sqldict/), but using MySQL as the backend.
 
@@ -18,14 +39,51 @@ class MySqlDict(UserDict):
         :param tablename: The tablename to connect to
         :param conn: The MySQL connection object
         :param datasetname: The name of the dataset to query
+        :param lookup_cache: Cache of lookups shared across requests. Only used if checksum is set.
+        :param checksum: The checksum of the dataset, used to invalidate the lookup cache
+        :param filter_max_keys: Maximum number of keys per filter query (MYSQL_FILTER_MAX_KEYS)
+        :param filter_max_bytes: Maximum size of the keys per filter query in bytes, which must stay
+          below the max_allowed_packet of the server (MYSQL_FILTER_MAX_BYTES)
+        :param deadline: Deadline of the current request, see set_deadline()
         :param kwargs: Additional arguments (currently unused)
         """
         super().__init__(**kwargs)
         load_dotenv()
         self.tablename = tablename
         self.datasetname = datasetname
+        self.lookup_cache = lookup_cache
+        self.checksum = checksum
+        self.filter_max_keys = filter_max_keys or int(
+            os.environ.get("MYSQL_FILTER_MAX_KEYS", 1000)
+        )
+        self.filter_max_bytes = filter_max_bytes or int(
+            os.environ.get("MYSQL_FILTER_MAX_BYTES", 1024 * 1024)
+        )
+        self.set_connection(conn)
+        self.deadline = deadline
+        self.in_process_cache = {}
+        self.reset_query_count()
+
+    def set_connection(self, conn):
+        """
+        Use another connection, e.g. one borrowed from the connection pool for the current request.
+        :param conn: The MySQL connection object
+        """
         self.conn = conn
         self.cursor = self.conn.cursor()
+
+    def set_deadline(self, deadline: Deadline = None):
+        """
+        Bound the queries by the deadline of the current request: no query is started once it has
+        passed, and each query gets the remaining time as its max_statement_time.
+        :param deadline: The deadline, or None for no limit
+        """
+        self.deadline = deadline
+
+    def reset_query_count(self):
+        """
+        Reset the query statistics, which are reported per request.
+        """
         self.query_count = 0
         self.query_details = {
             "__len__": 0,
@@ -37,14 +95,15 @@ class MySqlDict(UserDict):
             "__contains__": 0,
             "__getitem__": 0,
             "in_process_cache_access_count": 0,
+            "lookup_cache_hits": 0,
+            "lookup_cache_misses": 0,
         }
-        self.in_process_cache = {}
 
     def __len__(self):
         get_len_query = "SELECT COUNT(*) FROM {tablename}".format(
             tablename=self.tablename
         )
-        self.cursor.execute(get_len_query)
+        self._execute(get_len_query)
         self.query_count += 1
         self.query_details["__len__"] += 1
         rows = self.cursor.fetchone()
@@ -54,7 +113,7 @@ class MySqlDict(UserDict):
         get_max_query = "SELECT MAX(ROWID) FROM {tablename}".format(
             tablename=self.tablename
         )
-        self.cursor.execute(get_max_query)
+        self._execute(get_max_query)
         self.query_count += 1
         self.query_details["__bool__"] += 1
         result = self.cursor.fetchone()
@@ -64,7 +123,7 @@ class MySqlDict(UserDict):
         get_keys_query = "SELECT lookup FROM {tablename}".format(
             tablename=self.tablename
         )
-        self.cursor.execute(get_keys_query)
+        self._execute(get_keys_query)
         self.query_count += 1
         self.query_details["iterkeys"] += 1
         for row in self.cursor.fetchall():
@@ -74,7 +133,7 @@ class MySqlDict(UserDict):
         get_values_query = "SELECT value FROM {tablename}".format(
             tablename=self.tablename
         )
-        self.cursor.execute(get_values_query)
+        self._execute(get_values_query)
         self.query_count += 1
         self.query_details["itervalues"] += 1
         for value in self.cursor.fetchall():
@@ -84,7 +143,7 @@ class MySqlDict(UserDict):
         get_items_query = "SELECT lookup, value FROM {tablename}".format(
             tablename=self.tablename
         )
-        self.cursor.execute(get_items_query)
+        self._execute(get_items_query)
         self.query_count += 1
         self.query_details["iteritems"] += 1
         for key, value in self.cursor.fetchall():
@@ -109,9 +168,16 @@ class MySqlDict(UserDict):
         if not len(keys):
             return {}
 
-        chunk_size = 50
-        for i in range(0, len(keys), chunk_size):
-            chunked_keys = keys[i : i + chunk_size]
+        uncached_keys = []
+        for key in keys:
+            value = self._get_cached(key)
+            if value is None:
+                uncached_keys.append(key)
+            elif not isinstance(value, NotFound):
+                filtered[key] = value
+        keys = uncached_keys
+
+        for chunked_keys in self.get_filter_chunks(keys):
             item_list = ",".join(["%s"] * len(chunked_keys))
             query = "SELECT lookup, value FROM {tablename} WHERE lookup IN ({item_list})".format(
                 tablename=self.tablename,
@@ -119,56 +185,159 @@ class MySqlDict(UserDict):
             )
             self.query_details["filter"] += 1
             self.query_count += 1
-            self.cursor.execute(query, tuple(chunked_keys))
+            self._execute(query, tuple(chunked_keys))
             for found in self.cursor.fetchall():
                 filtered[found[0]] = pickle.loads(found[1])
+                self._set_cached(found[0], filtered[found[0]], found[1])
+            for key in chunked_keys:
+                if key not in filtered:
+                    self._set_cached(key, NotFound(), NOT_FOUND)
 
         return filtered
 
+    def get_many(self, keys: list) -> dict:
+        """
+        Fetch the values of many keys at once, e.g. the embeddings of all candidate link targets.
+        :type keys: list The keys to fetch, duplicates are fetched once
+        :rtype: dict The found keys and their values; missing keys are left out
+        """
+        return self.filter(list(dict.fromkeys(keys)))
+
+    def get_filter_chunks(self, keys: list) -> list:
+        """
+        Split the keys of a filter query into as few chunks as the limits on the number of keys and
+        on the size of the query allow. The keys are spread evenly over the chunks, so that a large
+        filter isn't followed by a tiny one.
+        :type keys: list The keys to split
+        :rtype: list A list of lists of keys
+        """
+        # Keys are quoted and escaped, which at most doubles their size.
+        sizes = [2 * len(key.encode("utf-8")) + 3 for key in keys]
+        num_chunks = max(
+            math.ceil(len(keys) / self.filter_max_keys),
+            math.ceil(sum(sizes) / self.filter_max_bytes),
+            1,
+        )
+        chunk_size = math.ceil(len(keys) / num_chunks)
+        chunks = []
+        chunk, chunk_bytes = [], 0
+        for key, size in zip(keys, sizes):
+            if chunk and (
+                len(chunk) >= chunk_size or chunk_bytes + size > self.filter_max_bytes
+            ):
+                chunks.append(chunk)
+                chunk, chunk_bytes = [], 0
+            chunk.append(key)
+            chunk_bytes += size
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
     def close(self):
         self.cursor.close()
         self.conn.close()
 
     def __contains__(self, key):
-        if key in self.in_process_cache:
-            self.query_details["in_process_cache_access_count"] += 1
-            return not isinstance(self.in_process_cache[key], NotFound)
+        value = self._get_cached(key)
+        if value is not None:
+            return not isinstance(value, NotFound)
         has_item_query = (
             "SELECT value FROM {tablename} WHERE lookup = %s LIMIT 1".format(
                 tablename=self.tablename
             )
         )
-        self.cursor.execute(has_item_query, (key,))
+        self._execute(has_item_query, (key,))
         self.query_count += 1
         self.query_details["__contains__"] += 1
         item = self.cursor.fetchone()
         if item is not None:
-            self.in_process_cache[key] = pickle.loads(item[0])
+            self._set_cached(key, self._loads(item[0]), item[0])
         else:
-            self.in_process_cache[key] = NotFound()
+            self._set_cached(key, NotFound(), NOT_FOUND)
         return item is not None
 
     def __getitem__(self, key):
-        if key in self.in_process_cache:
-            if isinstance(self.in_process_cache[key], NotFound):
+        value = self._get_cached(key)
+        if value is not None:
+            if isinstance(value, NotFound):
                 raise KeyError(key)
-            self.query_details["in_process_cache_access_count"] += 1
-            return self.in_process_cache[key]
+            return value
         get_item_query = (
             "SELECT value FROM {tablename} WHERE lookup = %s LIMIT 1".format(
                 tablename=self.tablename
             )
         )
-        self.cursor.execute(get_item_query, (key,))
+        self._execute(get_item_query, (key,))
         self.query_count += 1
         self.query_details["__getitem__"] += 1
         item = self.cursor.fetchone()
         if item is None:
+            self._set_cached(key, NotFound(), NOT_FOUND)
             raise KeyError(key)
+        value = self._loads(item[0])
+        self._set_cached(key, value, item[0])
+        return value
+
+    @staticmethod
+    def _loads(data: bytes):
         try:
-            self.in_process_cache[key] = pickle.loads(item[0])
+            return pickle.loads(data)
         except pickle.UnpicklingError:
             # TODO: Apply this pattern across other usages of pickle.loads? It's not needed for now.
             # lr_checksum and lr_model values are not pickled.
-            self.in_process_cache[key] = item[0].decode("utf-8")
-        return self.in_process_cache[key]
+            return data.decode("utf-8")
+
+    def _execute(self, query: str, args: tuple = None):
+        """
+        Execute a query, bounded by the deadline of the request if there is one.
+        """
+        if self.deadline is not None:
+            self.deadline.check("dataset lookup")
+            # A max_statement_time of 0 would disable the limit.
+            query = "SET STATEMENT max_statement_time=%.3f FOR %s" % (
+                max(self.deadline.remaining(), 0.001),
+                query,
+            )
+        try:
+            if args is None:
+                self.cursor.execute(query)
+            else:
+                self.cursor.execute(query, args)
+        except Exception as e:
+            if (
+                self.deadline is not None
+                and e.args
+                and e.args[0] == STATEMENT_TIMEOUT_ERROR
+            ):
+                raise DeadlineExceeded("dataset lookup", self.deadline.budget) from e
+            raise
+
+    def _get_cached(self, key):
+        """
+        Look up a key in the in process cache, then in the lookup cache.
+        :return: The cached value, a NotFound instance if the key is known to be missing, or None if
+          the key isn't cached
+        """
+        if key in self.in_process_cache:
+            self.query_details["in_process_cache_access_count"] += 1
+            return self.in_process_cache[key]
+        if self.lookup_cache is None or self.checksum is None:
+            return None
+        data = self.lookup_cache.get(self.tablename, self.checksum, key)
+        if data is None:
+            self.query_details["lookup_cache_misses"] += 1
+            return None
+        self.query_details["lookup_cache_hits"] += 1
+        # The lookup cache keeps the pickled value; it's unpickled once per request.
+        value = NotFound() if data == NOT_FOUND else self._loads(data)
+        self.in_process_cache[key] = value
+        return value
+
+    def _set_cached(self, key, value, data: bytes):
+        """
+        :param value: The value, or a NotFound instance if the key is missing
+        :param data: The value as read from the table, or NOT_FOUND if the key is missing
+        """
+        self.in_process_cache[key] = value
+        if self.lookup_cache is not None and self.checksum is not None:
+            self.lookup_cache.set(self.tablename, self.checksum, key, data)
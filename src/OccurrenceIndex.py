@@ -0,0 +1,73 @@
+from bisect import bisect_left, bisect_right, insort
+from collections.abc import Iterable
+
+# Ends each text in the concatenated text, so that no occurrence spans two texts.
+SEPARATOR = "\x00"
+
+
+class OccurrenceIndex:
+    def __init__(self, texts: Iterable[str]):
+        """
+        Index of the occurrences of strings in the top-level text nodes of a page, used to compute
+        the match_index of a link: the number of occurrences of the link text before the link.
+
+        Occurrences are counted like str.count, i.e. non-overlapping from the start of each text.
+        Texts are identified by their position, so identical texts are counted separately.
+        The occurrences of a string are found once, in the concatenation of the original texts,
+        after which counting the occurrences before a position is a binary search. Texts that
+        were changed since (by adding links) are counted from their current value.
+        :param texts: The original texts of the nodes, in page order
+        """
+        self.texts = list(texts)
+        self.starts = []
+        start = 0
+        for text in self.texts:
+            self.starts.append(start)
+            start += len(text) + len(SEPARATOR)
+        self.text = SEPARATOR.join(self.texts)
+        self.positions = {}
+        # Indexes and current values of the texts that were changed.
+        self.changed = []
+        self.current = {}
+
+    def update(self, index: int, text: str):
+        """
+        Set the current value of a text.
+        """
+        if text == self.texts[index]:
+            if self.current.pop(index, None) is not None:
+                self.changed.remove(index)
+            return
+        if index not in self.current:
+            insort(self.changed, index)
+        self.current[index] = text
+
+    def count_before(self, string: str, index: int, offset: int) -> int:
+        """
+        :return: The number of occurrences of string in the current values of the texts before
+          the text at index, plus those that end at or before offset in the original value of the
+          text at index
+        """
+        if SEPARATOR in string or not string:
+            return sum(
+                self.current.get(i, text).count(string)
+                for i, text in enumerate(self.texts[:index])
+            ) + self.texts[index][:offset].count(string)
+        positions = self._get_positions(string)
+        count = bisect_right(positions, self.starts[index] + offset - len(string))
+        for changed in self.changed[: bisect_left(self.changed, index)]:
+            count += self.current[changed].count(string) - self.texts[changed].count(
+                string
+            )
+        return count
+
+    def _get_positions(self, string: str) -> list[int]:
+        positions = self.positions.get(string)
+        if positions is None:
+            positions = []
+            position = self.text.find(string)
+            while position >= 0:
+                positions.append(position)
+                position = self.text.find(string, position + len(string))
+            self.positions[string] = positions
+        return positions
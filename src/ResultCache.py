@@ -0,0 +1,231 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class ResultCacheStore:
+    """
+    Storage of cached results, as serialized JSON keyed by a hex digest (see ResultCache).
+    """
+
+    name = None
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        :return: The cached value, or None if the key isn't cached
+        """
+        raise NotImplementedError
+
+    def set(self, key: str, value: str):
+        raise NotImplementedError
+
+
+class MemoryStore(ResultCacheStore):
+    name = "memory"
+
+    def __init__(self, max_bytes: int = None):
+        """
+        Per-process store, which evicts the least recently used entries once they exceed
+        max_bytes.
+        :param max_bytes: Maximum size of the cached values in bytes (RESULT_CACHE_MAX_BYTES)
+        """
+        self.max_bytes = (
+            max_bytes
+            if max_bytes is not None
+            else int(os.environ.get("RESULT_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+        )
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str):
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= len(previous)
+            self.entries[key] = value
+            self.total_bytes += len(value)
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+
+class DiskStore(ResultCacheStore):
+    name = "disk"
+    PRUNE_INTERVAL = 100
+
+    def __init__(self, path: str = None, max_entries: int = None):
+        """
+        SQLite file shared by all processes on the host, e.g. the gunicorn workers and the
+        batch-query workers. The least recently stored entries are evicted once there are more
+        than max_entries, which is checked every PRUNE_INTERVAL entries that are stored.
+        :param path: Path of the SQLite file (RESULT_CACHE_PATH)
+        :param max_entries: Maximum number of entries (RESULT_CACHE_MAX_ENTRIES)
+        """
+        self.path = path or os.environ.get(
+            "RESULT_CACHE_PATH", "/tmp/linkrecommendations.results.sqlite"
+        )
+        self.max_entries = max_entries or int(
+            os.environ.get("RESULT_CACHE_MAX_ENTRIES", 100000)
+        )
+        self.sets_count = 0
+        # Connections can't be shared across threads, or forked processes.
+        self.local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS results_stored_at ON results (stored_at)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        if getattr(self.local, "pid", None) != os.getpid():
+            self.local.conn = sqlite3.connect(self.path, timeout=5)
+            self.local.pid = os.getpid()
+        return self.local.conn
+
+    def get(self, key: str) -> Optional[str]:
+        row = (
+            self._connect()
+            .execute("SELECT value FROM results WHERE key = ?", (key,))
+            .fetchone()
+        )
+        return row[0] if row is not None else None
+
+    def set(self, key: str, value: str):
+        with self._connect() as conn:
+            conn.execute(
+                "REPLACE INTO results (key, value, stored_at) VALUES (?, ?, ?)",
+                (key, value, time.time()),
+            )
+            self.sets_count += 1
+            if self.sets_count % self.PRUNE_INTERVAL:
+                return
+            conn.execute(
+                "DELETE FROM results WHERE key IN "
+                "(SELECT key FROM results ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+
+class MemcachedStore(ResultCacheStore):
+    name = "memcached"
+
+    def __init__(self, server: str, ttl: int = None):
+        """
+        Cache shared by all hosts. Requires pymemcache, which is not installed by default.
+        :param server: host:port of the memcached server (RESULT_CACHE_SERVER), e.g. the local
+          mcrouter
+        :param ttl: Time to live of the entries in seconds (RESULT_CACHE_TTL), 0 for no expiry
+        """
+        from pymemcache.client.base import Client
+
+        self.client = Client(server, connect_timeout=1, timeout=1)
+        self.ttl = (
+            ttl if ttl is not None else int(os.environ.get("RESULT_CACHE_TTL", 86400))
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.client.get(key)
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, key: str, value: str):
+        self.client.set(key, value.encode("utf-8"), expire=self.ttl, noreply=True)
+
+
+stores = {store.name: store for store in [MemoryStore, DiskStore, MemcachedStore]}
+
+
+def get_result_cache_store(name: str = None) -> Optional[ResultCacheStore]:
+    """
+    Create the store of the result cache.
+    :param name: The name of the store, defaults to the RESULT_CACHE_BACKEND environment variable;
+      an empty name disables the cache. Without RESULT_CACHE_SERVER, the memcached store falls back
+      to the disk store as a local stand-in.
+    """
+    name = name if name is not None else os.environ.get("RESULT_CACHE_BACKEND", "")
+    if not name:
+        return None
+    if name not in stores:
+        raise ValueError("Unknown result cache backend %s" % name)
+    if name == MemcachedStore.name:
+        server = os.environ.get("RESULT_CACHE_SERVER")
+        if not server:
+            return DiskStore()
+        return MemcachedStore(server)
+    return stores[name]()
+
+
+class ResultCache:
+    def __init__(self, store: ResultCacheStore = None):
+        """
+        Cache of the results of Query.run(), which are deterministic given the page, the
+        parameters and the model and datasets. The keys include the checksums of the model and
+        the datasets, so entries of a previous version of them are not used after a reload.
+        :param store: Storage of the results, defaults to get_result_cache_store(); without a
+          store, nothing is cached
+        """
+        self.store = store if store is not None else get_result_cache_store()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.store is not None
+
+    @staticmethod
+    def get_key(**parameters) -> str:
+        """
+        :param parameters: Everything the result depends on; the wikitext is hashed
+        :return: A hex digest of the parameters
+        """
+        parameters["wikitext"] = hashlib.sha256(
+            parameters["wikitext"].encode("utf-8")
+        ).hexdigest()
+        return hashlib.sha256(
+            json.dumps(parameters, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        """
+        :return: The cached result, or None if it isn't cached or the store is unavailable
+        """
+        try:
+            value = self.store.get(key)
+        except Exception:
+            # An unavailable store, e.g. a memcached server that is down, is a miss.
+            value = None
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    def set(self, key: str, result: dict):
+        try:
+            self.store.set(key, json.dumps(result))
+        except Exception:
+            # The result is still returned, it's only not cached.
+            pass
+
+    def get_stats(self) -> dict:
+        return {"backend": self.store.name, "hits": self.hits, "misses": self.misses}
+
+
+result_cache = ResultCache()
@@ -0,0 +1,247 @@
+import json
+import logging
+import multiprocessing
+import traceback
+from collections import deque
+from time import perf_counter
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from src.DatasetLoader import get_dataset_loader
+from src.Deadline import Deadline, DeadlineExceeded
+from src.query import Query
+from src.scripts.utils import normalise_title
+
+logger = logging.getLogger("logger")
+
+# Settings of the worker processes, set by init_worker().
+_worker_settings = {}
+
+
+def get_language_code(wiki_id: str) -> str:
+    """
+    :return: The language code of a Wikipedia, like the API uses the wiki domain
+    :raises ValueError: If the wiki is not a Wikipedia
+    """
+    if not wiki_id.endswith("wiki") or wiki_id == "wiki":
+        raise ValueError("language_code is required for %s" % wiki_id)
+    return wiki_id[: -len("wiki")]
+
+
+def parse_record(line: str) -> dict:
+    """
+    Parse a JSONL record of a page, with wiki (the wiki ID, e.g. "cswiki"), title, revid,
+    wikitext and optionally pageid, language_code (which defaults to the wiki domain for
+    Wikipedias) and sections_to_exclude.
+    :return: The page as an item of Query.run_batch(), along with wiki and language_code
+    :raises ValueError: If the record is invalid
+    """
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError("A record must be a JSON object")
+    missing = [
+        key for key in ("wiki", "title", "revid", "wikitext") if key not in record
+    ]
+    if missing:
+        raise ValueError("Missing fields: %s" % ", ".join(missing))
+    if not all(isinstance(record[key], str) for key in ("wiki", "title", "wikitext")):
+        raise ValueError("wiki, title and wikitext must be strings")
+    item = {
+        "wiki": record["wiki"],
+        "language_code": record.get("language_code")
+        or get_language_code(record["wiki"]),
+        "page_title": normalise_title(record["title"]),
+        "pageid": record.get("pageid"),
+        "revid": record["revid"],
+        "wikitext": record["wikitext"],
+    }
+    if "sections_to_exclude" in record:
+        item["sections_to_exclude"] = record["sections_to_exclude"]
+    return item
+
+
+def get_chunks(lines: Iterable[str], chunk_size: int) -> Iterator[List[dict]]:
+    """
+    Parse JSONL records and group consecutive pages of the same wiki and language into chunks
+    of up to chunk_size pages, which share the model and the dataset handles. Records that
+    cannot be parsed are passed on as errors, in a chunk of their own.
+    """
+    chunk = []
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            item = parse_record(line)
+        except ValueError as e:
+            if chunk:
+                yield chunk
+                chunk = []
+            yield [{"line": line_number, "error": {"code": 400, "message": str(e)}}]
+            continue
+        if chunk and (
+            len(chunk) >= chunk_size
+            or (chunk[0]["wiki"], chunk[0]["language_code"])
+            != (item["wiki"], item["language_code"])
+        ):
+            yield chunk
+            chunk = []
+        chunk.append(item)
+    if chunk:
+        yield chunk
+
+
+def init_worker(settings: dict):
+    """
+    Set the settings of a worker process. The dataset loaders and models are kept by the worker
+    (see get_dataset_loader() and ModelRegistry), so they are loaded once per wiki and worker.
+    :param settings: backend and data_dir of the datasets, the threshold, max_recommendations
+      and sections_to_exclude of the queries, and the timeout, i.e. the time budget per page in
+      seconds (a chunk has the budget of all its pages)
+    """
+    _worker_settings.update(settings)
+
+
+def run_chunk(chunk: List[dict]) -> List[dict]:
+    """
+    Recommend links for a chunk of pages (see get_chunks()) in a worker process.
+    :return: The result or error of each page in order (see Query.run_batch()), with the wiki
+    """
+    if "error" in chunk[0]:
+        return chunk
+    settings = _worker_settings
+    wiki_id = chunk[0]["wiki"]
+    try:
+        with get_dataset_loader(
+            backend=settings["backend"], wiki_id=wiki_id, data_dir=settings["data_dir"]
+        ) as datasetloader:
+            if not datasetloader.get_model_path()[0]:
+                return make_errors(chunk, 400, "No model found for %s" % wiki_id)
+            results = list(
+                Query(logger, datasetloader).run_batch(
+                    items=chunk,
+                    wiki_id=wiki_id,
+                    language_code=chunk[0]["language_code"],
+                    threshold=settings["threshold"],
+                    max_recommendations=settings["max_recommendations"],
+                    sections_to_exclude=settings["sections_to_exclude"],
+                    deadline=Deadline(settings["timeout"] * len(chunk)),
+                )
+            )
+    except DeadlineExceeded as e:
+        # The deadline passed before any page was processed, e.g. while loading the model.
+        return make_errors(chunk, 504, str(e))
+    except Exception as e:
+        logger.error(
+            {
+                "type": type(e).__name__,
+                "description": str(e),
+                "trace": traceback.format_tb(e.__traceback__),
+            }
+        )
+        return make_errors(chunk, 500, "%s: %s" % (type(e).__name__, e))
+    return [dict(result, wiki=wiki_id) for result in results]
+
+
+def make_errors(chunk: List[dict], code: int, message: str) -> List[dict]:
+    return [
+        dict(Query.make_error(item, code, message), wiki=item["wiki"]) for item in chunk
+    ]
+
+
+class BatchStats:
+    def __init__(self, clock=perf_counter):
+        """
+        Progress of a batch query.
+        :param clock: Function returning the current time in seconds
+        """
+        self.clock = clock
+        self.start = self.clock()
+        self.pages_count = 0
+        self.errors_count = 0
+        self.links_count = 0
+
+    def add(self, result: dict):
+        self.pages_count += 1
+        if "error" in result:
+            self.errors_count += 1
+        else:
+            self.links_count += result["links_count"]
+
+    def to_dict(self) -> dict:
+        elapsed = self.clock() - self.start
+        return {
+            "pages_count": self.pages_count,
+            "errors_count": self.errors_count,
+            "links_count": self.links_count,
+            "elapsed_seconds": round(elapsed, 3),
+            "pages_per_second": round(self.pages_count / elapsed, 3) if elapsed else 0,
+        }
+
+
+def run_batch_query(
+    lines: Iterable[str],
+    output,
+    processes: int,
+    chunk_size: int,
+    progress_interval: int,
+    progress: Callable[[dict], None],
+    worker_settings: dict,
+    start_method: Optional[str] = None,
+) -> dict:
+    """
+    Recommend links for the pages of a JSONL file and write the results as JSONL, in the order
+    of the records.
+    :param output: File to write the results to
+    :param processes: Number of worker processes; with 1, the pages are processed in this process
+    :param chunk_size: Maximum number of pages of a wiki that are sent to a worker at once
+    :param progress_interval: Number of pages after which progress is reported
+    :param progress: Function that is called with the statistics (see BatchStats.to_dict()) as
+      progress is made and at the end
+    :param worker_settings: The settings of the workers (see init_worker())
+    :param start_method: The multiprocessing start method, defaults to that of the platform
+    :return: The final statistics
+    """
+    stats = BatchStats()
+    chunks = get_chunks(lines, chunk_size)
+    if processes == 1:
+        init_worker(worker_settings)
+        results = (result for chunk in chunks for result in run_chunk(chunk))
+        write_results(results, output, stats, progress_interval, progress)
+    else:
+        context = multiprocessing.get_context(start_method)
+        with context.Pool(
+            processes, initializer=init_worker, initargs=(worker_settings,)
+        ) as pool:
+            results = get_pool_results(pool, chunks, 2 * processes)
+            write_results(results, output, stats, progress_interval, progress)
+    final_stats = stats.to_dict()
+    progress(final_stats)
+    return final_stats
+
+
+def get_pool_results(pool, chunks: Iterator[List[dict]], max_pending: int):
+    """
+    Run the chunks in the pool and yield their results in order. At most max_pending chunks are
+    submitted ahead, so that the input is not read into memory at once (unlike Pool.imap()).
+    """
+    pending = deque()
+    for chunk in chunks:
+        pending.append(pool.apply_async(run_chunk, (chunk,)))
+        if len(pending) >= max_pending:
+            yield from pending.popleft().get()
+    while pending:
+        yield from pending.popleft().get()
+
+
+def write_results(
+    results: Iterable[dict],
+    output,
+    stats: BatchStats,
+    progress_interval: int,
+    progress: Callable[[dict], None],
+):
+    for result in results:
+        output.write(json.dumps(result, ensure_ascii=False) + "\n")
+        stats.add(result)
+        if progress_interval and stats.pages_count % progress_interval == 0:
+            output.flush()
+            progress(stats.to_dict())
@@ -1,10 +1,17 @@
+import pickle
 import pymysql
 import os  # noqa: E402
+import threading  # noqa: E402
+import time  # noqa: E402
 from dotenv import load_dotenv  # noqa: E402
 
 load_dotenv()
 pymysql.install_as_MySQLdb()
 import MySQLdb  # noqa: E402
+from src.AnchorMatcher import build_anchor_matcher  # noqa: E402
+from src.BloomFilter import build_bloom_filter  # noqa: E402
+from src.EmbeddingStore import build_embedding_store  # noqa: E402
+from src.scripts.anchor_stats import build_anchor_stats  # noqa: E402
 
 
 def get_mysql_connection():
@@ -12,6 +19,114 @@ def get_mysql_connection():
     return MySQLdb.connect(**connection_dict)
 
 
+class ConnectionPool:
+    def __init__(
+        self,
+        size: int = None,
+        idle_timeout: float = None,
+        max_lifetime: float = None,
+        connect=get_mysql_connection,
+    ):
+        """
+        Process-level pool of MySQL connections, so that requests don't pay for the connection setup
+        (TLS and authentication handshakes).
+
+        Connections are pinged when borrowed and replaced if they are no longer usable. The pool is
+        reset in forked processes, as connections can't be shared between gunicorn workers.
+        :param size: Maximum number of idle connections to keep (DB_POOL_SIZE)
+        :param idle_timeout: Seconds after which an idle connection is closed (DB_POOL_IDLE_TIMEOUT)
+        :param max_lifetime: Seconds after which a connection is closed instead of being reused
+          (DB_POOL_MAX_LIFETIME)
+        :param connect: Function that opens a new connection
+        """
+        self.size = size if size is not None else int(os.environ.get("DB_POOL_SIZE", 2))
+        self.idle_timeout = (
+            idle_timeout
+            if idle_timeout is not None
+            else float(os.environ.get("DB_POOL_IDLE_TIMEOUT", 300))
+        )
+        self.max_lifetime = (
+            max_lifetime
+            if max_lifetime is not None
+            else float(os.environ.get("DB_POOL_MAX_LIFETIME", 3600))
+        )
+        self.connect = connect
+        self.lock = threading.Lock()
+        self._reset()
+
+    def borrow(self):
+        """
+        :return: A healthy connection, either from the pool or a new one
+        """
+        while True:
+            with self.lock:
+                if self.pid != os.getpid():
+                    self._reset()
+                if not self.idle:
+                    break
+                # Use the most recently used connection, so that surplus connections time out.
+                connection, released_at = self.idle.pop()
+            now = time.monotonic()
+            if (
+                now - released_at > self.idle_timeout
+                or now - self.created_at[id(connection)] > self.max_lifetime
+            ):
+                self._close(connection)
+                continue
+            try:
+                connection.ping(reconnect=False)
+            except Exception:
+                self._close(connection)
+                continue
+            return connection
+        connection = self.connect()
+        with self.lock:
+            self.created_at[id(connection)] = time.monotonic()
+        return connection
+
+    def release(self, connection):
+        """
+        Return a borrowed connection to the pool.
+        """
+        now = time.monotonic()
+        with self.lock:
+            created_at = self.created_at.get(id(connection))
+            if (
+                self.pid == os.getpid()
+                and created_at is not None
+                and len(self.idle) < self.size
+                and now - created_at <= self.max_lifetime
+            ):
+                self.idle.append((connection, now))
+                return
+        self._close(connection)
+
+    def _close(self, connection):
+        with self.lock:
+            self.created_at.pop(id(connection), None)
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _reset(self):
+        # Connections inherited from the parent process are dropped without closing them, as
+        # closing them would also close them for the parent.
+        self.pid = os.getpid()
+        self.idle = []
+        self.created_at = {}
+
+
+_connection_pool = None
+
+
+def get_connection_pool() -> ConnectionPool:
+    global _connection_pool
+    if _connection_pool is None:
+        _connection_pool = ConnectionPool()
+    return _connection_pool
+
+
 def get_connection_dict() -> dict:
     items = {
         "user": os.environ.get("DB_USER"),
@@ -41,3 +156,140 @@ def import_model_to_table(cursor: object, linkmodel: str, wiki_id: str):
     )
     query = "INSERT INTO lr_model (lookup, value) VALUES (%s,%s)"
     cursor.execute(query, (wiki_id, linkmodel))
+
+
+def import_anchor_stats_to_table(
+    cursor: object, wiki_id: str, table_prefix: str = "lr", batch_size: int = 10000
+) -> int:
+    """
+    Compute the page-independent statistics of each anchor (ambiguity and kurtosis of the link
+    distribution) from the anchors table and store them in the anchorstats table, so that they don't
+    have to be recomputed for every candidate link at query time.
+    The anchors table is read in batches on the same connection (see iterate_table), so that anchors
+    imported in the current (uncommitted) transaction are included.
+    :param cursor:
+    :param wiki_id:
+    :param table_prefix:
+    :param batch_size: Number of anchors to process per query
+    :return: The number of rows inserted
+    """
+    anchors_table = "%s_%s_anchors" % (table_prefix, wiki_id)
+    anchorstats_table = "%s_%s_anchorstats" % (table_prefix, wiki_id)
+    cursor.execute("DELETE FROM {tablename}".format(tablename=anchorstats_table))
+    insert_query = "INSERT INTO {tablename} (lookup, value) VALUES (%s,%s)".format(
+        tablename=anchorstats_table
+    )
+    num_rows = 0
+    for rows in iterate_table(cursor, anchors_table, batch_size):
+        anchor_stats = build_anchor_stats(rows)
+        cursor.executemany(
+            insert_query,
+            [(anchor, pickle.dumps(stats)) for anchor, stats in anchor_stats],
+        )
+        num_rows += len(rows)
+    return num_rows
+
+
+def import_anchor_filter_to_table(
+    cursor: object,
+    wiki_id: str,
+    checksum: str,
+    false_positive_rate: float = None,
+    table_prefix: str = "lr",
+) -> int:
+    """
+    Build the membership filter (see BloomFilter.py) over the keys of the anchors table and store it
+    in the anchorfilter table. Like the link model, the filters of all wikis are stored in a single
+    table keyed by wiki ID.
+    :param cursor:
+    :param wiki_id:
+    :param checksum: Checksum of the anchors dataset
+    :param false_positive_rate: The false positive rate of the filter, defaults to the
+      ANCHOR_FILTER_FALSE_POSITIVE_RATE environment variable
+    :param table_prefix:
+    :return: The number of anchors in the filter
+    """
+    anchors_table = "%s_%s_anchors" % (table_prefix, wiki_id)
+    anchorfilter_table = "%s_anchorfilter" % table_prefix
+    cursor.execute("SELECT COUNT(*) FROM {tablename}".format(tablename=anchors_table))
+    num_keys = cursor.fetchone()[0]
+    bloom_filter = build_bloom_filter(
+        (anchor for rows in iterate_table(cursor, anchors_table) for anchor, _ in rows),
+        num_keys,
+        false_positive_rate,
+        checksum,
+    )
+    cursor.execute(
+        "DELETE FROM {tablename} WHERE lookup = %s LIMIT 1".format(
+            tablename=anchorfilter_table
+        ),
+        (wiki_id,),
+    )
+    cursor.execute(
+        "INSERT INTO {tablename} (lookup, value) VALUES (%s,%s)".format(
+            tablename=anchorfilter_table
+        ),
+        (wiki_id, bloom_filter.to_bytes()),
+    )
+    return bloom_filter.count
+
+
+def build_embedding_store_from_table(
+    cursor: object, wiki_id: str, path: str, checksum: str, table_prefix: str = "lr"
+) -> int:
+    """
+    Build the memory-mapped embedding store (see EmbeddingStore.py) from the w2vfiltered table.
+    :param cursor:
+    :param wiki_id:
+    :param path: Path to the store directory
+    :param checksum: Checksum of the w2vfiltered dataset
+    :param table_prefix:
+    :return: The number of embeddings in the store
+    """
+    tablename = "%s_%s_w2vfiltered" % (table_prefix, wiki_id)
+    return build_embedding_store(
+        (item for rows in iterate_table(cursor, tablename) for item in rows),
+        path,
+        checksum,
+    )
+
+
+def build_anchor_matcher_from_table(
+    cursor: object, wiki_id: str, path: str, checksum: str, table_prefix: str = "lr"
+) -> int:
+    """
+    Build the anchor matcher (see AnchorMatcher.py) from the anchors table.
+    :param cursor:
+    :param wiki_id:
+    :param path: Path to the matcher directory
+    :param checksum: Checksum of the anchors dataset
+    :param table_prefix:
+    :return: The number of anchors in the matcher
+    """
+    tablename = "%s_%s_anchors" % (table_prefix, wiki_id)
+    return build_anchor_matcher(
+        (anchor for rows in iterate_table(cursor, tablename) for anchor, _ in rows),
+        path,
+        checksum,
+    )
+
+
+def iterate_table(cursor: object, tablename: str, batch_size: int = 10000):
+    """
+    Read all rows of a dataset table in batches, ordered by id.
+    :param cursor:
+    :param tablename:
+    :param batch_size: Number of rows to read per query
+    :return: Generator of lists of (lookup, unpickled value) pairs
+    """
+    select_query = (
+        "SELECT id, lookup, value FROM {tablename} WHERE id > %s ORDER BY id LIMIT %s"
+    ).format(tablename=tablename)
+    last_id = 0
+    while True:
+        cursor.execute(select_query, (last_id, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        yield [(lookup, pickle.loads(value)) for _, lookup, value in rows]
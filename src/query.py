@@ -1,22 +1,36 @@
-import xgboost as xgb
-from typing import List
-from src.scripts.model_utils import get_model_version
+import os
+import traceback
+from typing import Iterator, List
 from src.scripts import utils, utils_v2
+from src.scripts.utils import MentionRegexException
 from src.DatasetLoader import DatasetLoader
-import multiprocessing
+from src.Deadline import Deadline, DeadlineExceeded
+from src.LookupCache import lookup_cache
+from src.ModelRegistry import ModelRegistry, model_registry as default_model_registry
+from src.MySqlDict import MySqlDict
+from src.ResultCache import ResultCache, result_cache as default_result_cache
 from time import perf_counter
 
 
 class Query:
-    def __init__(self, logger, datasetloader: DatasetLoader):
+    def __init__(
+        self,
+        logger,
+        datasetloader: DatasetLoader,
+        model_registry: ModelRegistry = None,
+        result_cache: ResultCache = None,
+    ):
         # Increment this version only for major changes in the output format.
         self.format_version = 1
         self.logger = logger
         self.datasetloader = datasetloader
-        self.model = xgb.XGBClassifier(
-            n_jobs=min([int(multiprocessing.cpu_count() / 4), 8])
-        )
+        self.model_registry = model_registry or default_model_registry
+        self.result_cache = result_cache or default_result_cache
+        self.model = None
+        self.model_checksum = None
+        self.model_version = None
         self.datasets = []
+        self.dataset_checksums = {}
         self.wiki_id = None
 
     def run(
@@ -30,19 +44,224 @@ class Query:
         threshold: float,
         max_recommendations: int,
         sections_to_exclude: list,
+        deadline: Deadline = None,
     ) -> dict:
+        """
+        :param deadline: Deadline of the request, which bounds the dataset queries and the
+          processing of the page; when it passes, the links found so far are returned with the
+          reason in meta.info. Defaults to GUNICORN_TIMEOUT (minus one second) from now
+        :return: The result, from the result cache if it has been computed before (see
+          get_cache_key()), in which case meta.cached is true
+        """
         start = perf_counter()
-        self.model.load_model(self.datasetloader.get_model_path()[0])
+        if deadline is None:
+            deadline = Deadline()
+        self.load(wiki_id, deadline)
+        request_parameters = {
+            "article_length": len(wikitext),
+            "page_title": page_title,
+            "pageid": pageid,
+            "revid": revid,
+            "wiki": wiki_id,
+            "threshold": threshold,
+            "max_recommendations": max_recommendations,
+        }
+        cache_key = None
+        if self.result_cache.enabled:
+            cache_key = self.get_cache_key(
+                wikitext=wikitext,
+                page_title=page_title,
+                pageid=pageid,
+                revid=revid,
+                language_code=language_code,
+                threshold=threshold,
+                max_recommendations=max_recommendations,
+                sections_to_exclude=sections_to_exclude,
+            )
+            result = self.result_cache.get(cache_key)
+            if result is not None:
+                self.datasetloader.set_deadline(None)
+                result["meta"]["cached"] = True
+                self.log(
+                    {
+                        "suggested_links_count": result["links_count"],
+                        "cached": True,
+                        "request_parameters": request_parameters,
+                        "execution_time": perf_counter() - start,
+                    }
+                )
+                return result
+        response = self.process_page(
+            wikitext=wikitext,
+            page_title=page_title,
+            language_code=language_code,
+            threshold=threshold,
+            max_recommendations=max_recommendations,
+            sections_to_exclude=sections_to_exclude,
+            deadline=deadline,
+        )
+        # The response is put together even if the deadline has passed.
+        self.datasetloader.set_deadline(None)
+
+        stop = perf_counter()
+
+        self.log(
+            {
+                "suggested_links_count": len(response["links"]),
+                "info": response["info"],
+                "cached": False,
+                "request_parameters": request_parameters,
+                "execution_time": stop - start,
+            }
+        )
+
+        result = self.make_result(
+            page_title=page_title,
+            pageid=pageid,
+            revid=revid,
+            added_links=response["links"],
+            info=response["info"],
+        )
+        # Results that were cut short by the deadline are not cached.
+        if cache_key is not None and not response["deadline_exceeded"]:
+            self.result_cache.set(cache_key, result)
+        return result
+
+    def run_batch(
+        self,
+        items: List[dict],
+        wiki_id: str,
+        language_code: str,
+        threshold: float,
+        max_recommendations: int,
+        sections_to_exclude: list,
+        deadline: Deadline = None,
+    ) -> Iterator[dict]:
+        """
+        Recommend links for many pages of a wiki, sharing the model and the dataset handles. With
+        MySQL, the lookups are cached for the whole batch, so anchors and embeddings that occur in
+        several pages are only fetched once.
+        :param items: The pages, with page_title, pageid, revid, wikitext and optionally
+          sections_to_exclude (which defaults to the sections_to_exclude parameter)
+        :param deadline: Deadline of the whole batch. Pages that are not processed when it passes
+          get an error; the page that is processed at that time gets the links found so far.
+        :return: The result of each page in order, as returned by run(), or an error (see
+          make_error()); a page that can't be processed doesn't fail the other pages
+        """
+        start = perf_counter()
+        if deadline is None:
+            deadline = Deadline()
+        self.load(wiki_id, deadline)
+        # Fetch the embeddings of the page titles at once.
+        word2vec = self.datasetloader.get("w2vfiltered")
+        if isinstance(word2vec, MySqlDict):
+            word2vec.get_many([item["page_title"] for item in items])
+        links_count = 0
+        errors_count = 0
+        try:
+            for item in items:
+                try:
+                    deadline.check("batch")
+                    response = self.process_page(
+                        wikitext=item["wikitext"],
+                        page_title=item["page_title"],
+                        language_code=language_code,
+                        threshold=threshold,
+                        max_recommendations=max_recommendations,
+                        sections_to_exclude=item.get(
+                            "sections_to_exclude", sections_to_exclude
+                        ),
+                        deadline=deadline,
+                    )
+                except MentionRegexException as e:
+                    errors_count += 1
+                    yield self.make_error(item, e.status_code, e.message)
+                    continue
+                except DeadlineExceeded as e:
+                    errors_count += 1
+                    yield self.make_error(item, 504, str(e))
+                    continue
+                except Exception as e:
+                    # A page that can't be processed doesn't fail the other pages.
+                    self.logger.error(
+                        {
+                            "type": type(e).__name__,
+                            "description": str(e),
+                            "trace": traceback.format_tb(e.__traceback__),
+                        }
+                    )
+                    errors_count += 1
+                    yield self.make_error(item, 500, "Internal Server Error")
+                    continue
+                links_count += len(response["links"])
+                yield self.make_result(
+                    page_title=item["page_title"],
+                    pageid=item["pageid"],
+                    revid=item["revid"],
+                    added_links=response["links"],
+                    info=response["info"],
+                )
+        finally:
+            self.datasetloader.set_deadline(None)
+            self.log(
+                {
+                    "suggested_links_count": links_count,
+                    "request_parameters": {
+                        "batch_size": len(items),
+                        "wiki": wiki_id,
+                        "threshold": threshold,
+                        "max_recommendations": max_recommendations,
+                    },
+                    "errors_count": errors_count,
+                    "execution_time": perf_counter() - start,
+                }
+            )
+
+    def load(self, wiki_id: str, deadline: Deadline):
+        """
+        Load the model and the dataset handles of a wiki, bounding the dataset queries by the
+        deadline.
+        """
+        self.datasetloader.set_deadline(deadline)
+        self.model_checksum = self.datasetloader.get_model_checksum()
+        self.model, self.model_version = self.model_registry.get(
+            wiki_id=wiki_id,
+            checksum=self.model_checksum,
+            model_path=self.datasetloader.get_model_path()[0],
+        )
+        tablenames = ["anchors", "pageids", "redirects", "w2vfiltered", "model"]
+        if self.datasetloader.has_dataset("anchorstats"):
+            tablenames.append("anchorstats")
+        self.datasets = [self.datasetloader.get(tablename) for tablename in tablenames]
+        self.wiki_id = wiki_id
+        # Looked up once, as results are also put together after the deadline has passed.
+        self.dataset_checksums = self.get_dataset_checksums(tablenames)
+
+    def process_page(
+        self,
+        wikitext: str,
+        page_title: str,
+        language_code: str,
+        threshold: float,
+        max_recommendations: int,
+        sections_to_exclude: list,
+        deadline: Deadline,
+    ) -> dict:
+        """
+        Recommend links for a page with the model and datasets loaded by load().
+        :return: The links, info and deadline_exceeded, as returned by process_page()
+        """
         anchors = self.datasetloader.get("anchors")
         pageids = self.datasetloader.get("pageids")
         redirects = self.datasetloader.get("redirects")
         word2vec = self.datasetloader.get("w2vfiltered")
-        model = self.datasetloader.get("model")
-        self.datasets = [anchors, pageids, redirects, word2vec, model]
-        self.wiki_id = wiki_id
+        anchor_stats = None
+        if self.datasetloader.has_dataset("anchorstats"):
+            anchor_stats = self.datasetloader.get("anchorstats")
+        anchor_filter = self.datasetloader.get_anchor_filter()
 
-        if get_model_version(self.model) == "v2":
-            response = utils_v2.process_page(
+        if self.model_version == "v2":
+            return utils_v2.process_page(
                 wikitext=wikitext,
                 page=page_title,
                 anchors=anchors,
@@ -50,7 +269,7 @@ class Query:
                 redirects=redirects,
                 word2vec=word2vec,
                 model=self.model,
-                wiki_id=wiki_id,
+                wiki_id=self.wiki_id,
                 language_code=language_code,
                 threshold=threshold,
                 pr=True,
@@ -58,54 +277,50 @@ class Query:
                 context=10,
                 maxrec=max_recommendations,
                 sections_to_exclude=sections_to_exclude,
+                anchor_stats=anchor_stats,
+                anchor_filter=anchor_filter,
+                prefetch_sections=int(os.environ.get("ANCHOR_PREFETCH_SECTIONS", 0)),
+                anchor_matcher=self.datasetloader.get_anchor_matcher(),
+                deadline=deadline,
             )
-        else:
-            response = utils.process_page(
-                wikitext=wikitext,
-                page=page_title,
-                anchors=anchors,
-                pageids=pageids,
-                redirects=redirects,
-                word2vec=word2vec,
-                model=self.model,
-                language_code=language_code,
-                threshold=threshold,
-                return_wikitext=False,
-                maxrec=max_recommendations,
-                sections_to_exclude=sections_to_exclude,
-            )
-
-        stop = perf_counter()
+        return utils.process_page(
+            wikitext=wikitext,
+            page=page_title,
+            anchors=anchors,
+            pageids=pageids,
+            redirects=redirects,
+            word2vec=word2vec,
+            model=self.model,
+            language_code=language_code,
+            threshold=threshold,
+            return_wikitext=False,
+            maxrec=max_recommendations,
+            sections_to_exclude=sections_to_exclude,
+            anchor_stats=anchor_stats,
+            anchor_filter=anchor_filter,
+            prefetch_sections=int(os.environ.get("ANCHOR_PREFETCH_SECTIONS", 0)),
+            deadline=deadline,
+        )
 
-        log_data = {
-            "suggested_links_count": len(response["links"]),
-            "info": response["info"],
-            "request_parameters": {
-                "article_length": len(wikitext),
-                "page_title": page_title,
-                "pageid": pageid,
-                "revid": revid,
-                "wiki": wiki_id,
-                "threshold": threshold,
-                "max_recommendations": max_recommendations,
-            },
-            "execution_time": stop - start,
-        }
+    def log(self, log_data: dict):
+        """
+        Log a request, adding the statistics of the model registry and of the datasets.
+        """
+        log_data["model_registry"] = self.model_registry.get_stats()
+        if self.result_cache.enabled:
+            log_data["result_cache"] = self.result_cache.get_stats()
+        anchor_filter = self.datasetloader.get_anchor_filter()
+        if anchor_filter is not None:
+            log_data["anchor_filter"] = anchor_filter.get_stats()
 
         if self.datasetloader.backend == "mysql":
             query_total, query_detail = self.get_query_info()
             log_data["query_count"] = query_total
             log_data["query_count_by_dataset"] = query_detail
+            log_data["lookup_cache"] = lookup_cache.get_stats()
 
         self.logger.info(log_data)
 
-        return self.make_result(
-            page_title=page_title,
-            pageid=pageid,
-            revid=revid,
-            added_links=response["links"],
-        )
-
     def get_query_info(self):
         query_total = 0
         query_detail = {}
@@ -117,7 +332,12 @@ class Query:
         return query_total, query_detail
 
     def make_result(
-        self, page_title: str, pageid: int, revid: int, added_links: List[dict]
+        self,
+        page_title: str,
+        pageid: int,
+        revid: int,
+        added_links: List[dict],
+        info: str = "",
     ):
         return {
             "page_title": page_title,
@@ -126,7 +346,9 @@ class Query:
             "links_count": len(added_links),
             "meta": {
                 "format_version": self.format_version,
-                "dataset_checksums": self.get_dataset_checksums(),
+                "dataset_checksums": self.dataset_checksums,
+                "info": info,
+                "cached": False,
             },
             "links": [
                 self.make_link(link, pos)
@@ -134,20 +356,66 @@ class Query:
             ],
         }
 
-    def get_dataset_checksums(self) -> dict:
+    @staticmethod
+    def make_error(item: dict, code: int, message: str):
         """
+        :return: The result of a page of a batch that could not be processed
+        """
+        return {
+            "page_title": item["page_title"],
+            "pageid": item["pageid"],
+            "revid": item["revid"],
+            "error": {"code": code, "message": message},
+        }
+
+    def get_cache_key(
+        self,
+        wikitext: str,
+        page_title: str,
+        pageid: int,
+        revid: int,
+        language_code: str,
+        threshold: float,
+        max_recommendations: int,
+        sections_to_exclude: list,
+    ) -> str:
+        """
+        :return: The key of a result in the result cache, which covers the page, the parameters,
+          and the model and dataset checksums of the wiki loaded by load() (with SQLite, those of
+          the dataset files)
+        """
+        return ResultCache.get_key(
+            format_version=self.format_version,
+            wiki_id=self.wiki_id,
+            wikitext=wikitext,
+            page_title=page_title,
+            pageid=pageid,
+            revid=revid,
+            language_code=language_code,
+            threshold=threshold,
+            max_recommendations=max_recommendations,
+            sections_to_exclude=list(sections_to_exclude),
+            model_checksum=self.model_checksum,
+            model_version=self.model_version,
+            dataset_checksums=self.dataset_checksums,
+        )
+
+    def get_dataset_checksums(self, tablenames: List[str]) -> dict:
+        """
+        :param tablenames: The names of the datasets
         :return: Dictionary with dataset names as the keys and their stored checksums as the values.
+          With SQLite, these are the checksums of the files (see DatasetLoader.get_sqlite_checksum()).
         """
-        checksum_detail = {}
-        datasets = self.datasets
-        checksums = self.datasetloader.get("checksum")
         if self.datasetloader.backend != "mysql":
-            return checksum_detail
-        for dataset in datasets:
-            checksum_detail[dataset.datasetname] = checksums[
-                "%s_%s" % (self.wiki_id, dataset.datasetname)
-            ]
-        return checksum_detail
+            return {
+                tablename: self.datasetloader.get_sqlite_checksum(tablename)
+                for tablename in tablenames
+            }
+        checksums = self.datasetloader.get("checksum")
+        return {
+            tablename: checksums["%s_%s" % (self.wiki_id, tablename)]
+            for tablename in tablenames
+        }
 
     def make_link(self, link: dict, pos: int):
         return {
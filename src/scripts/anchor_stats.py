@@ -0,0 +1,47 @@
+from collections.abc import Generator, Iterable
+
+from scipy.stats import kurtosis  # type: ignore[import-untyped]
+
+from src.MySqlDict import MySqlDict
+
+
+def compute_anchor_stats(candidates: dict[str, int]) -> tuple[int, float]:
+    """compute the page-independent statistics of an anchor.
+    - ambiguity: how many different links were used with this text
+    - kurtosis: skew of the usage text/link distribution
+    """
+    ambig = len(candidates)
+    kur = kurtosis(
+        sorted(list(candidates.values()), reverse=True) + [1] * (1000 - ambig)
+    )
+    return ambig, float(kur)
+
+
+def build_anchor_stats(
+    anchors: Iterable[tuple[str, dict[str, int]]],
+) -> Generator[tuple[str, tuple[int, float]], None, None]:
+    """compute the statistics for all (anchor, candidates) items of an anchors dataset."""
+    for anchor, candidates in anchors:
+        yield anchor, compute_anchor_stats(candidates)
+
+
+def get_anchor_stats(
+    texts: list[str],
+    anchors: dict[str, dict[str, int]],
+    anchor_stats: dict[str, tuple[int, float]] | None = None,
+) -> dict[str, tuple[int, float]]:
+    """get the statistics for a list of anchors.
+    - read them from the precomputed anchorstats dataset if available
+    - fall back to computing them from the anchors dataset
+    """
+    stats = {}
+    if anchor_stats is not None:
+        if isinstance(anchor_stats, MySqlDict):
+            # batch the lookups in a SELECT ... IN query
+            stats = anchor_stats.filter(list(texts))
+        else:
+            stats = {text: anchor_stats[text] for text in texts if text in anchor_stats}
+    for text in texts:
+        if text not in stats:
+            stats[text] = compute_anchor_stats(anchors[text])
+    return stats
@@ -0,0 +1,65 @@
+from collections.abc import Iterable
+from typing import Any
+
+
+def get_many(dataset: Any, keys: Iterable[str]) -> dict[str, Any]:
+    """look up many keys of a dataset at once.
+    - batched for datasets that support it (MySqlDict, EmbeddingStore)
+    - one lookup per key otherwise (SQLite, dict)
+    - missing keys are left out
+    """
+    if hasattr(dataset, "get_many"):
+        return dataset.get_many(list(keys))
+    values = {}
+    for key in dict.fromkeys(keys):
+        try:
+            values[key] = dataset[key]
+        except KeyError:
+            pass
+    return values
+
+
+def resolve_redirects(
+    links: Iterable[str], redirects: Any, max_hops: int = 1
+) -> dict[str, str]:
+    """resolve the redirects of many links at once.
+    - one batched lookup per hop
+    - max_hops=1 is the same as resolving every link with redirects.get(link, link)
+    - with max_hops > 1, chains of redirects are followed up to max_hops redirects
+    """
+    resolved = {link: link for link in links}
+    pending = set(resolved)
+    for _ in range(max_hops):
+        if not pending:
+            break
+        targets = get_many(redirects, pending)
+        for link, target in resolved.items():
+            if target in targets:
+                resolved[link] = targets[target]
+        # only the targets that were redirects themselves can be redirected further
+        pending = {targets[target] for target in targets}
+    return resolved
+
+
+def resolve_links(
+    links: Iterable[tuple[str, str]],
+    redirects: Any = None,
+    pageids: Any = None,
+    max_hops: int = 1,
+) -> dict[str, str]:
+    """map the anchors of the links of a page to the (resolved) link targets.
+    - links: (link, anchor) pairs in page order; the last link with an anchor wins
+    - if redirects is not None, resolve the redirects
+    - if pageids is not None, keep only links appearing as key in pageids
+    - redirects and pageids are looked up for all links at once
+    """
+    links = list(links)
+    if redirects is not None:
+        resolved = resolve_redirects(
+            [link for link, _ in links], redirects, max_hops=max_hops
+        )
+        links = [(resolved[link], anchor) for link, anchor in links]
+    if pageids is not None:
+        existing = get_many(pageids, [link for link, _ in links])
+        links = [(link, anchor) for link, anchor in links if link in existing]
+    return {anchor: link for link, anchor in links}
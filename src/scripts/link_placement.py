@@ -0,0 +1,154 @@
+from functools import lru_cache
+
+# Characters that re.IGNORECASE considers equal although their lowercase forms differ, e.g.
+# "i" and the dotless "ı"; keyed and listed by code point. Copied from re._casefix (which is
+# private and only exists since Python 3.11), as generated for Unicode 14.0.
+EXTRA_CASES = {
+    0x0069: (0x0131,),  # 'i': 'ı'
+    0x0073: (0x017F,),  # 's': 'ſ'
+    0x00B5: (0x03BC,),  # 'µ': 'μ'
+    0x0131: (0x0069,),  # 'ı': 'i'
+    0x017F: (0x0073,),  # 'ſ': 's'
+    0x0345: (0x03B9, 0x1FBE),  # U+0345: 'ι', 'ι'
+    0x0390: (0x1FD3,),  # 'ΐ': 'ΐ'
+    0x03B0: (0x1FE3,),  # 'ΰ': 'ΰ'
+    0x03B2: (0x03D0,),  # 'β': 'ϐ'
+    0x03B5: (0x03F5,),  # 'ε': 'ϵ'
+    0x03B8: (0x03D1,),  # 'θ': 'ϑ'
+    0x03B9: (0x0345, 0x1FBE),  # 'ι': U+0345, 'ι'
+    0x03BA: (0x03F0,),  # 'κ': 'ϰ'
+    0x03BC: (0x00B5,),  # 'μ': 'µ'
+    0x03C0: (0x03D6,),  # 'π': 'ϖ'
+    0x03C1: (0x03F1,),  # 'ρ': 'ϱ'
+    0x03C2: (0x03C3,),  # 'ς': 'σ'
+    0x03C3: (0x03C2,),  # 'σ': 'ς'
+    0x03C6: (0x03D5,),  # 'φ': 'ϕ'
+    0x03D0: (0x03B2,),  # 'ϐ': 'β'
+    0x03D1: (0x03B8,),  # 'ϑ': 'θ'
+    0x03D5: (0x03C6,),  # 'ϕ': 'φ'
+    0x03D6: (0x03C0,),  # 'ϖ': 'π'
+    0x03F0: (0x03BA,),  # 'ϰ': 'κ'
+    0x03F1: (0x03C1,),  # 'ϱ': 'ρ'
+    0x03F5: (0x03B5,),  # 'ϵ': 'ε'
+    0x0432: (0x1C80,),  # 'в': 'ᲀ'
+    0x0434: (0x1C81,),  # 'д': 'ᲁ'
+    0x043E: (0x1C82,),  # 'о': 'ᲂ'
+    0x0441: (0x1C83,),  # 'с': 'ᲃ'
+    0x0442: (0x1C84, 0x1C85),  # 'т': 'ᲄ', 'ᲅ'
+    0x044A: (0x1C86,),  # 'ъ': 'ᲆ'
+    0x0463: (0x1C87,),  # 'ѣ': 'ᲇ'
+    0x1C80: (0x0432,),  # 'ᲀ': 'в'
+    0x1C81: (0x0434,),  # 'ᲁ': 'д'
+    0x1C82: (0x043E,),  # 'ᲂ': 'о'
+    0x1C83: (0x0441,),  # 'ᲃ': 'с'
+    0x1C84: (0x0442, 0x1C85),  # 'ᲄ': 'т', 'ᲅ'
+    0x1C85: (0x0442, 0x1C84),  # 'ᲅ': 'т', 'ᲄ'
+    0x1C86: (0x044A,),  # 'ᲆ': 'ъ'
+    0x1C87: (0x0463,),  # 'ᲇ': 'ѣ'
+    0x1C88: (0xA64B,),  # 'ᲈ': 'ꙋ'
+    0x1E61: (0x1E9B,),  # 'ṡ': 'ẛ'
+    0x1E9B: (0x1E61,),  # 'ẛ': 'ṡ'
+    0x1FBE: (0x0345, 0x03B9),  # 'ι': U+0345, 'ι'
+    0x1FD3: (0x0390,),  # 'ΐ': 'ΐ'
+    0x1FE3: (0x03B0,),  # 'ΰ': 'ΰ'
+    0xA64B: (0x1C88,),  # 'ꙋ': 'ᲈ'
+    0xFB05: (0xFB06,),  # 'ﬅ': 'ﬆ'
+    0xFB06: (0xFB05,),  # 'ﬆ': 'ﬅ'
+}
+
+
+def is_word_char(char: str) -> bool:
+    """whether a character matches \\w (of a str pattern)"""
+    return char.isalnum() or char == "_"
+
+
+@lru_cache(maxsize=65536)
+def fold_char(char: str) -> str:
+    """fold a character such that two characters are equal under re.IGNORECASE if and only if
+    their folded characters are equal.
+    - the simple (one character) lowercase mapping, as used by re
+    - the smallest character of the extra equivalences of re
+    """
+    lower = char.lower()[0]
+    extra = EXTRA_CASES.get(ord(lower))
+    if extra:
+        return chr(min(ord(lower), *extra))
+    return lower
+
+
+def fold(text: str) -> str:
+    """fold a text character by character; the folded text has the same length"""
+    return "".join(map(fold_char, text))
+
+
+def get_next_delimiters(text: str) -> list[int]:
+    """for each position in the text (and the end of the text), the position of the first
+    character at or after it that matches neither \\w nor \\s, or len(text) if there is none
+    """
+    next_delimiters = [len(text)] * (len(text) + 1)
+    for i in range(len(text) - 1, -1, -1):
+        char = text[i]
+        if is_word_char(char) or char.isspace():
+            next_delimiters[i] = next_delimiters[i + 1]
+        else:
+            next_delimiters[i] = i
+    return next_delimiters
+
+
+def find_mention(
+    text: str, mention: str, word_boundaries: bool = False, ignore_case: bool = False
+) -> int:
+    """find the first occurrence of a mention in a text at which a link can be placed.
+
+    Same result as searching for the pattern
+    (?<!\\[\\[)(?<!-->)MENTION(?![\\w\\s]*[\\]\\]])
+    i.e. the occurrence is not preceded by "[[" or "-->", and the first character after the
+    mention that is neither a word character nor whitespace is not "]" (the mention is not
+    inside the text of a link). In one pass, as opposed to the lookahead, which can take
+    quadratic time on long paragraphs.
+    - word_boundaries: the mention must start and end at a word boundary (\\b...\\b)
+    - ignore_case: compare like re.IGNORECASE
+    :return: The start of the occurrence, or -1 if there is none
+    """
+    if not mention:
+        return -1
+    haystack, needle = (fold(text), fold(mention)) if ignore_case else (text, mention)
+    next_delimiters = None
+    start = haystack.find(needle)
+    while start >= 0:
+        end = start + len(mention)
+        if (
+            text[max(0, start - 2) : start] != "[["
+            and text[max(0, start - 3) : start] != "-->"
+            and (
+                not word_boundaries
+                or (is_boundary(text, start) and is_boundary(text, end))
+            )
+        ):
+            if next_delimiters is None:
+                next_delimiters = get_next_delimiters(text)
+            delimiter = next_delimiters[end]
+            if delimiter == len(text) or text[delimiter] != "]":
+                return start
+        start = haystack.find(needle, start + 1)
+    return -1
+
+
+def is_boundary(text: str, position: int) -> bool:
+    """whether \\b matches at a position in a text"""
+    before = position > 0 and is_word_char(text[position - 1])
+    after = position < len(text) and is_word_char(text[position])
+    return before != after
+
+
+def replace_mention(
+    text: str, mention: str, replacement: str, word_boundaries: bool = False
+) -> tuple[str, int]:
+    """replace the first occurrence of a mention at which a link can be placed (see
+    find_mention) with the replacement, which is inserted literally.
+    :return: The new text and the number of replacements (0 or 1), like re.subn
+    """
+    start = find_mention(text, mention, word_boundaries=word_boundaries)
+    if start < 0:
+        return text, 0
+    return text[:start] + replacement + text[start + len(mention) :], 1
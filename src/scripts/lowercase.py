@@ -0,0 +1,57 @@
+from dataclasses import dataclass
+from functools import lru_cache
+
+from icu import Locale, UnicodeString  # type: ignore[import-untyped]
+
+
+@lru_cache(maxsize=None)
+def get_locale(language_code: str) -> Locale:
+    """get the ICU locale of a language, created once per process"""
+    return Locale(language_code)
+
+
+def to_lower(text: str, language_code: str) -> str:
+    """lowercase a text with the rules of a language.
+    e.g. in Azeri, İnsan should be lowercased to insan, but the default lower-casing in
+    python will change the İ to an i with two dots.
+    """
+    return str(UnicodeString(text).toLower(get_locale(language_code)))
+
+
+@dataclass(frozen=True)
+class LowercasedText:
+    """a text and its lowercased version.
+    - offsets: for each offset in lower (including its end), the offset in text it comes
+      from, or None if lowercasing did not change the length of the text
+    """
+
+    text: str
+    lower: str
+    offsets: tuple[int, ...] | None = None
+
+    def to_original(self, offset: int) -> int:
+        """map an offset in the lowercased text to the offset in the text"""
+        if self.offsets is None:
+            return offset
+        return self.offsets[offset]
+
+
+def lowercase(text: str, language_code: str) -> LowercasedText:
+    """lowercase a text, keeping track of the offsets if the length changes.
+    The offsets are derived by lowercasing character by character; if that differs from
+    lowercasing the whole text (the rules depend on the context in a few languages), each
+    offset in the lowercased text is kept as is, clamped to the text.
+    """
+    lower = to_lower(text, language_code)
+    if len(lower) == len(text):
+        return LowercasedText(text, lower)
+    offsets = []
+    pieces = []
+    for i, char in enumerate(text):
+        piece = to_lower(char, language_code)
+        pieces.append(piece)
+        offsets.extend([i] * len(piece))
+    offsets.append(len(text))
+    if "".join(pieces) != lower:
+        offsets = [min(i, len(text)) for i in range(len(lower) + 1)]
+    return LowercasedText(text, lower, tuple(offsets))
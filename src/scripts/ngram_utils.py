@@ -1,7 +1,32 @@
-from collections.abc import Generator
+import os
+from collections.abc import Generator, Iterable
+from functools import lru_cache
 
 from mwtokenizer import Tokenizer  # type: ignore[import-untyped]
 
+from src.AnchorMatcher import AnchorMatcher
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(language_code: str) -> Tokenizer:
+    """get the tokenizer of a language.
+    - created once per process, as creating a tokenizer loads its resources
+    """
+    return Tokenizer(language_code=language_code)
+
+
+def warm_tokenizers(language_codes: Iterable[str] | None = None) -> list[str]:
+    """create the tokenizers of some languages ahead of the first request.
+    - language_codes defaults to the comma-separated TOKENIZER_LANGUAGES environment variable
+    - returns the language codes
+    """
+    if language_codes is None:
+        language_codes = os.environ.get("TOKENIZER_LANGUAGES", "").split(",")
+    language_codes = [code.strip() for code in language_codes if code.strip()]
+    for language_code in language_codes:
+        get_tokenizer(language_code)
+    return language_codes
+
 
 def tokenize_sentence(text: str, tokenizer: Tokenizer) -> Generator[str, None, None]:
     """split text into sentences.
@@ -20,18 +45,69 @@ def get_tokens(sent: str, tokenizer: Tokenizer) -> list[str]:
     return list(tokenizer.word_tokenize(sent, use_abbreviation=True))
 
 
+def get_ngram_spans(
+    tokens: list[str], n: int
+) -> Generator[tuple[int, int], None, None]:
+    """get the (start, end) character spans of the n-grams of n non-whitespace tokens.
+    - spans are offsets in the concatenated tokens, in order of the first token
+    - the tokens are not concatenated for every n-gram
+    """
+    if n < 1:
+        return
+    offsets = [0]
+    for token in tokens:
+        offsets.append(offsets[-1] + len(token))
+    words = [i for i, token in enumerate(tokens) if token != " "]
+    for k in range(len(words) - n + 1):
+        yield offsets[words[k]], offsets[words[k + n - 1] + 1]
+
+
 def get_ngrams(tokens: list[str], n: int) -> Generator[str, None, None]:
     """concatenate n non-whitespace tokens"""
-    for i_start, w_start in enumerate(tokens):
-        if w_start == " ":
+    text = "".join(tokens)
+    for start, end in get_ngram_spans(tokens, n):
+        yield text[start:end]
+
+
+def get_anchor_ngrams(
+    tokens: list[str],
+    anchor_matcher: AnchorMatcher,
+    gram_length_max: int,
+    gram_length_min: int = 1,
+) -> list[str] | None:
+    """get the n-grams of a tokenized sentence that are anchors, using an anchor matcher.
+    - same n-grams as get_ngrams for all n, restricted to those in the matcher
+    - ordered like ngram_iterator: by descending n, then by position
+    - None if lowercasing changes the length of the text, as the offsets of the matches
+      can't be mapped to tokens then
+    """
+    text = "".join(tokens)
+    text_lower = text.lower()
+    if len(text_lower) != len(text):
+        return None
+    # character offsets where n-grams can start and end (at non-whitespace tokens),
+    # and the number of non-whitespace tokens before each token
+    starts, ends, counts = {}, {}, [0]
+    offset = 0
+    for i, token in enumerate(tokens):
+        if token != " ":
+            starts[offset] = i
+        offset += len(token)
+        if token != " ":
+            ends[offset] = i
+        counts.append(counts[-1] + (token != " "))
+    grams = []
+    for start, end in anchor_matcher.find(text_lower):
+        i_start = starts.get(start)
+        i_end = ends.get(end)
+        if i_start is None or i_end is None:
+            continue
+        gram_length = counts[i_end + 1] - counts[i_start]
+        if not gram_length_min <= gram_length <= gram_length_max:
+            continue
+        gram = text[start:end]
+        if gram.lower() != text_lower[start:end] and gram.lower() not in anchor_matcher:
             continue
-        gram = ""
-        gram_count = 0
-        for j in range(i_start, len(tokens)):
-            w = tokens[j]
-            gram += w
-            if w != " ":
-                gram_count += 1
-            if gram_count == n:
-                yield gram
-                break
+        grams.append((-gram_length, i_start, gram))
+    grams.sort(key=lambda gram: gram[:2])
+    return [gram for _, _, gram in grams]
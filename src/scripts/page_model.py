@@ -0,0 +1,353 @@
+import re
+import urllib.parse as up
+from collections import Counter
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+import mwparserfromhell  # type: ignore[import-untyped]
+import wikitextparser as wtp  # type: ignore[import-untyped]
+from mwparserfromhell.definitions import is_single  # type: ignore[import-untyped]
+from mwparserfromhell.nodes import Heading, Tag, Text, Wikilink  # type: ignore[import-untyped]
+from mwparserfromhell.smart_list import SmartList  # type: ignore[import-untyped]
+from mwparserfromhell.wikicode import Wikicode  # type: ignore[import-untyped]
+
+from src.OccurrenceIndex import SEPARATOR
+
+# Extension tags whose contents can contain links, but which mwparserfromhell does not
+# parse (wikitextparser, which getLinks uses, does).
+LINK_TAGS = {"categorytree", "gallery", "imagemap", "inputbox", "section"}
+
+# Lines that may be headings; whether they are is checked with the parser.
+HEADING_LINE = re.compile(r"^=.*$", re.MULTILINE)
+# Markup that can span lines, and thus headings: comments, templates, links, tables,
+# tags and bold/italic.
+MARKUP = re.compile(
+    r"<!--|-->|\{\{|\}\}|\[\[|\]\]|^[ \t]*\{\||^[ \t]*\|\}"
+    r"|<(/?)([a-zA-Z][\w-]*)[^<>]*?(/?)>|'{2,}",
+    re.MULTILINE,
+)
+# Closing markup and the markup it closes.
+CLOSING_MARKUP = {"}}": "{{", "]]": "[[", "|}": "{|"}
+
+
+def normalise_title(title: str) -> str:
+    """
+    Normalising title (links)
+    - deal with quotes
+    - strip()
+    - '_'--> ' '
+    - capitalize first letter
+    """
+    title = up.unquote(title)
+    title = title.strip()
+    if len(title) > 0:
+        title = title[0].upper() + title[1:]
+    n_title = title.replace("_", " ")
+    if "#" in n_title:
+        n_title = n_title.split("#")[0]
+    return n_title
+
+
+def normalise_anchor(anchor: str) -> str:
+    """
+    Normalising anchor  (text):
+    - strip()
+    - lowercase
+    Note that we do not do the other normalisations since we want to match the strings from the text
+    """
+    # anchor = up.unquote(anchor)
+    n_anchor = anchor.strip()  # .replace("_", " ")
+    return n_anchor.lower()
+
+
+@dataclass(frozen=True)
+class TextNode:
+    """A top-level text node of a page.
+    - node: the parsed node; its value changes when links are added to the page
+    - index: position among all top-level text nodes (and skipped sections) of the page
+    - start, end: offsets of the node in the original wikitext
+    - text: the original text of the node
+    """
+
+    node: Text
+    index: int
+    start: int
+    end: int
+    text: str
+
+
+@dataclass(frozen=True)
+class SkippedSection:
+    """An excluded section of a page that was not parsed.
+    - index: position among all top-level text nodes of the page; the section takes a
+      single position for all its text nodes
+    - start, end: offsets of the section in the original wikitext
+    - text: the wikitext of the section
+    """
+
+    index: int
+    start: int
+    end: int
+    text: str
+
+    def get_text(self) -> str:
+        """get the top-level texts of the section, joined like in OccurrenceIndex."""
+        return SEPARATOR.join(
+            str(node)
+            for node in mwparserfromhell.parse(self.text).nodes
+            if isinstance(node, Text)
+        )
+
+
+@dataclass(frozen=True)
+class Section:
+    """A section of a page, from its heading to the next heading of any level.
+    - heading: the stripped heading title, None for the lead section
+    """
+
+    heading: str | None
+    text_nodes: tuple[TextNode, ...]
+
+
+@dataclass(frozen=True)
+class PageModel:
+    """A page parsed once for link recommendation.
+    - wikicode: the parsed page, which links are added to; skipped sections are kept as
+      plain text
+    - sections: the non-empty parsed sections of the page in page order
+    - text_nodes: all parsed top-level text nodes of the page in page order
+    - links: the existing links of the page as normalised (link, anchor) pairs in page order
+    - skipped_sections: the excluded sections that were not parsed
+    """
+
+    wikitext: str
+    wikicode: Wikicode
+    sections: tuple[Section, ...]
+    text_nodes: tuple[TextNode, ...]
+    links: tuple[tuple[str, str], ...]
+    skipped_sections: tuple[SkippedSection, ...] = ()
+
+    def get_sections(self, sections_to_exclude: Iterable[str]) -> list[Section]:
+        """get the sections to process.
+        - sections are matched by heading, case-insensitively
+        - "%LEAD%" excludes the lead section
+        - excluding a section does not exclude its sub-sections
+        """
+        sections_to_exclude = list(sections_to_exclude)
+        sections_to_exclude_nocase = {
+            section.casefold() for section in sections_to_exclude
+        }
+        return [
+            section
+            for section in self.sections
+            if (
+                section.heading.casefold() not in sections_to_exclude_nocase
+                if section.heading is not None
+                else "%LEAD%" not in sections_to_exclude
+            )
+        ]
+
+    def get_texts(self) -> list[str]:
+        """
+        get the original texts of the top-level text nodes, by TextNode.index.
+        Skipped sections are parsed for their texts only if a text node follows them; the
+        texts after the last text node do not count for the match_index of any link.
+        """
+        texts = [""] * (len(self.text_nodes) + len(self.skipped_sections))
+        for text_node in self.text_nodes:
+            texts[text_node.index] = text_node.text
+        last_index = self.text_nodes[-1].index if self.text_nodes else -1
+        for skipped_section in self.skipped_sections:
+            if skipped_section.index < last_index:
+                texts[skipped_section.index] = skipped_section.get_text()
+        return texts
+
+
+def get_link_anchor(wikilink: Wikilink) -> tuple[str, str]:
+    """
+    extract the normalised link and anchor of a wikilink, like wtpGetLinkAnchor.
+    - the title does not include the fragment
+    - links without text (or with empty text) use the title as anchor
+    """
+    title = str(wikilink.title).split("#", 1)[0]
+    text = str(wikilink.text) if wikilink.text is not None else ""
+    return normalise_title(title), normalise_anchor(text if text else title)
+
+
+def get_links(node: mwparserfromhell.nodes.Node) -> list[tuple[str, str]]:
+    """get the (link, anchor) pairs of all links in and below a node, in page order."""
+    links = []
+    for child in Wikicode([node]).ifilter(recursive=True):
+        if isinstance(child, Wikilink):
+            links.append(get_link_anchor(child))
+        elif isinstance(child, Tag) and str(child.tag).lower() in LINK_TAGS:
+            for tag_node in mwparserfromhell.parse(str(child.contents)).nodes:
+                links.extend(get_links(tag_node))
+    return links
+
+
+def get_wikitext_links(wikitext: str) -> list[tuple[str, str]]:
+    """get the (link, anchor) pairs of all links in unparsed wikitext, like getLinks."""
+    links = []
+    for wikilink in wtp.parse(wikitext).wikilinks:
+        title = wikilink.title
+        anchor = wikilink.text if wikilink.text else title
+        links.append((normalise_title(title), normalise_anchor(anchor)))
+    return links
+
+
+def is_self_contained(wikitext: str) -> bool:
+    """
+    check whether wikitext closes all markup it opens, such that it parses the same on its
+    own as within the page.
+    The check is conservative, e.g. unbalanced braces inside nowiki tags fail it.
+    """
+    counts: Counter[str] = Counter()
+    italic = bold = 0
+    in_comment = False
+    for match in MARKUP.finditer(wikitext):
+        token = match.group().strip()
+        if in_comment:
+            in_comment = token != "-->"
+        elif token == "<!--":
+            in_comment = True
+        elif token.startswith("'"):
+            # 2 apostrophes are italic, 3 bold, 4 an apostrophe and bold, 5 or more both
+            italic += len(token) == 2 or len(token) >= 5
+            bold += len(token) >= 3
+        elif match.group(2):
+            name = match.group(2).lower()
+            if match.group(3) or is_single(name):
+                continue
+            counts[name] += -1 if match.group(1) else 1
+            if counts[name] < 0:
+                return False
+        elif token in CLOSING_MARKUP:
+            counts[CLOSING_MARKUP[token]] -= 1
+            if counts[CLOSING_MARKUP[token]] < 0:
+                return False
+        elif token != "-->":
+            counts[token] += 1
+    return (
+        not in_comment
+        and italic % 2 == 0
+        and bold % 2 == 0
+        and not any(counts.values())
+    )
+
+
+def split_sections(
+    wikitext: str, sections_to_exclude: Iterable[str]
+) -> list[tuple[int, int, bool]] | None:
+    """
+    split a page at its headings without parsing it, to skip the excluded sections.
+    - the page is split at every heading, as excluding a section does not exclude its
+      sub-sections
+    - heading lines are found with a regex and checked by parsing only the line
+    :return: The start and end offsets of each section and whether it is excluded, or None
+      if no section is excluded or markup spans a heading
+    """
+    sections_to_exclude = list(sections_to_exclude)
+    sections_to_exclude_nocase = {section.casefold() for section in sections_to_exclude}
+    starts = [0]
+    excluded = ["%LEAD%" in sections_to_exclude]
+    for match in HEADING_LINE.finditer(wikitext):
+        nodes = mwparserfromhell.parse(match.group()).nodes
+        if not nodes or not isinstance(nodes[0], Heading):
+            continue
+        if match.start() == 0:
+            starts.pop()
+            excluded.pop()
+        starts.append(match.start())
+        excluded.append(
+            str(nodes[0].title).strip().casefold() in sections_to_exclude_nocase
+        )
+    sections = [
+        (start, end, is_excluded)
+        for start, end, is_excluded in zip(
+            starts, starts[1:] + [len(wikitext)], excluded
+        )
+        if start < end
+    ]
+    if not any(is_excluded for _, _, is_excluded in sections):
+        return None
+    if not all(is_self_contained(wikitext[start:end]) for start, end, _ in sections):
+        return None
+    return sections
+
+
+def parse_page(wikitext: str, sections_to_exclude: Iterable[str] = ()) -> PageModel:
+    """
+    parse a page in one pass over its top-level nodes.
+    - sections are split at every heading, like get_sections(flat=True)
+    - offsets are those of the node itself, also for text that occurs more than once
+    - links are collected at any depth, like getLinks
+    - excluded sections are split off and not parsed where that is safe (see
+      split_sections); they stay in the wikicode as plain text
+    """
+    sections_to_exclude = list(sections_to_exclude)
+    page_sections = (
+        split_sections(wikitext, sections_to_exclude) if sections_to_exclude else None
+    )
+    if page_sections is None:
+        page_sections = [(0, len(wikitext), False)]
+    page_nodes = []
+    sections = []
+    text_nodes: list[TextNode] = []
+    skipped_sections: list[SkippedSection] = []
+    links = []
+    heading = None
+    section_nodes: list[TextNode] = []
+    has_nodes = False
+    for start, end, is_excluded in page_sections:
+        section_text = wikitext[start:end]
+        if is_excluded:
+            if has_nodes:
+                sections.append(Section(heading, tuple(section_nodes)))
+            heading = None
+            section_nodes = []
+            has_nodes = False
+            skipped_sections.append(
+                SkippedSection(
+                    index=len(text_nodes) + len(skipped_sections),
+                    start=start,
+                    end=end,
+                    text=section_text,
+                )
+            )
+            page_nodes.append(Text(section_text))
+            links.extend(get_wikitext_links(section_text))
+            continue
+        offset = start
+        for node in mwparserfromhell.parse(section_text).nodes:
+            node_str = str(node)
+            if isinstance(node, Heading):
+                if has_nodes:
+                    sections.append(Section(heading, tuple(section_nodes)))
+                heading = str(node.title).strip()
+                section_nodes = []
+            if isinstance(node, Text):
+                text_node = TextNode(
+                    node=node,
+                    index=len(text_nodes) + len(skipped_sections),
+                    start=offset,
+                    end=offset + len(node_str),
+                    text=node_str,
+                )
+                text_nodes.append(text_node)
+                section_nodes.append(text_node)
+            else:
+                links.extend(get_links(node))
+            page_nodes.append(node)
+            has_nodes = True
+            offset += len(node_str)
+    if has_nodes:
+        sections.append(Section(heading, tuple(section_nodes)))
+    return PageModel(
+        wikitext=wikitext,
+        wikicode=Wikicode(SmartList(page_nodes)),
+        sections=tuple(sections),
+        text_nodes=tuple(text_nodes),
+        links=tuple(links),
+        skipped_sections=tuple(skipped_sections),
+    )
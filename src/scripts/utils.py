@@ -1,16 +1,20 @@
 from Levenshtein import jaro as levenshtein_score
-from icu import UnicodeString, Locale
-from scipy.stats import kurtosis
-import os
 
+from src.Deadline import Deadline, DeadlineExceeded
+from src.EmbeddingStore import EmbeddingStore
+from src.InferenceBackend import as_inference_backend
+from src.LinkedMentionIndex import LinkedMentionIndex
 from src.MySqlDict import MySqlDict
-import time
+from src.OccurrenceIndex import OccurrenceIndex
+from src.scripts.anchor_stats import compute_anchor_stats, get_anchor_stats
+from src.scripts.dataset_utils import get_many, resolve_links
+from src.scripts.link_placement import find_mention, replace_mention
+from src.scripts.lowercase import lowercase
+from src.scripts.ngram_utils import get_ngram_spans
+from src.scripts.page_model import normalise_anchor, normalise_title, parse_page
 import operator
 import numpy as np
-import urllib.parse as up
 import wikitextparser as wtp
-import mwparserfromhell
-import re
 import requests
 import nltk
 
@@ -31,36 +35,6 @@ class MentionRegexException(Exception):
 ######################
 
 
-def normalise_title(title):
-    """
-    Normalising title (links)
-    - deal with quotes
-    - strip()
-    - '_'--> ' '
-    - capitalize first letter
-    """
-    title = up.unquote(title)
-    title = title.strip()
-    if len(title) > 0:
-        title = title[0].upper() + title[1:]
-    n_title = title.replace("_", " ")
-    if "#" in n_title:
-        n_title = n_title.split("#")[0]
-    return n_title
-
-
-def normalise_anchor(anchor):
-    """
-    Normalising anchor  (text):
-    - strip()
-    - lowercase
-    Note that we do not do the other normalisations since we want to match the strings from the text
-    """
-    # anchor = up.unquote(anchor)
-    n_anchor = anchor.strip()  # .replace("_", " ")
-    return n_anchor.lower()
-
-
 def wtpGetLinkAnchor(wikilink):
     """
     extract anchor and link from a wikilink from wikitextparser.
@@ -75,23 +49,18 @@ def wtpGetLinkAnchor(wikilink):
     return link, anchor
 
 
-def getLinks(wikicode, redirects=None, pageids=None):
+def getLinks(wikicode, redirects=None, pageids=None, max_hops=1):
     """
     get all links in a page
+    - redirects and pageids are looked up for all links at once
+    - max_hops: number of redirects to follow per link
     """
-    link_dict = {}
-    linklist = wtp.parse(str(wikicode)).wikilinks
-    for l in linklist:
-        link, anchor = wtpGetLinkAnchor(l)
-        # if redirects is not None, resolve the redirect
-        if redirects is not None:
-            link = resolveRedirect(link, redirects)
-        # if pageids is not None, keep only links appearing as key in pageids
-        if pageids is not None:
-            if link not in pageids:
-                continue
-        link_dict[anchor] = link
-    return link_dict
+    return resolve_links(
+        [wtpGetLinkAnchor(l) for l in wtp.parse(str(wikicode)).wikilinks],
+        redirects=redirects,
+        pageids=pageids,
+        max_hops=max_hops,
+    )
 
 
 def resolveRedirect(link, redirects):
@@ -129,20 +98,13 @@ def get_tokens(sent):
 
 
 def get_ngrams(tokens, n):
-    """concatenate n non-whitespace tokens"""
-    for i_start, w_start in enumerate(tokens):
-        if w_start == " ":
-            continue
-        gram = w_start
-        gram_count = 1
-        for j in range(i_start, len(tokens) - 1):
-            if gram_count == n:
-                yield gram
-                break
-            w = tokens[j + 1]
-            gram += w
-            if w != " ":
-                gram_count += 1
+    """concatenate n non-whitespace tokens
+    (n-grams that end with the last token are not generated)
+    """
+    text = "".join(tokens)
+    for start, end in get_ngram_spans(tokens, n):
+        if end < len(text):
+            yield text[start:end]
 
 
 def ngram_iterator(text, gram_length_max, gram_length_min=1):
@@ -150,14 +112,14 @@ def ngram_iterator(text, gram_length_max, gram_length_min=1):
     iterator yields all n-grams from a text.
     - splits at newline
     - spits sentence
-    - tokenizes
+    - tokenizes (once per sentence)
     - create string of n tokens for variable n
     """
     lines = list(filter(None, text.split("\n")))
     for line in lines:
         for sent in tokenizeSent(line):
+            tokens = get_tokens(sent)
             for gram_length in range(gram_length_max, gram_length_min - 1, -1):
-                tokens = get_tokens(sent)
                 for gram in get_ngrams(tokens, gram_length):
                     yield gram
 
@@ -168,6 +130,9 @@ def ngram_iterator(text, gram_length_max, gram_length_min=1):
 
 
 def getDistEmb(ent_a, ent_b, embd):
+    if isinstance(embd, EmbeddingStore):
+        # The store holds unit-normalized vectors, so this is just a dot product.
+        return embd.similarity(ent_a, ent_b)
     dst = 0
     try:  # try if entities are in embd
         a = embd[ent_a]
@@ -189,13 +154,14 @@ def getDistEmb(ent_a, ent_b, embd):
 # Return the features for each link candidate in the context of the text and the page
 
 
-def get_feature_set(page, text, link, anchors, word2vec):
+def get_feature_set(page, text, link, anchors, word2vec, anchor_stats=None):
     ngram = len(text.split())  # simple space based tokenizer to compute n-grams
     freq = anchors[text][link]  # How many times was the link use with this text
-    ambig = len(anchors[text])  # home many different links where used with this text
-    kur = kurtosis(
-        sorted(list(anchors[text].values()), reverse=True) + [1] * (1000 - ambig)
-    )  # Skew of usage text/link distribution
+    # home many different links where used with this text, and the skew of usage text/link distribution.
+    # These only depend on the anchor, so they can be precomputed (see anchor_stats.py).
+    if anchor_stats is None:
+        anchor_stats = compute_anchor_stats(anchors[text])
+    ambig, kur = anchor_stats
     w2v = getDistEmb(
         page, link, word2vec
     )  # W2V Distance between the source and target page
@@ -210,35 +176,79 @@ def get_feature_set(page, text, link, anchors, word2vec):
 # for a given page X and a piece of text "lipsum".. check all the candidate and make inference
 # Returns the most likely candidate according to the pre-trained link model
 # If the probability is below a certain threshold, return None
-def classify_links(page, text, anchors, word2vec, model, threshold=0.95):
-    # start_time = time.time()
-    cand_prediction = {}
+def classify_links(
+    page, text, anchors, word2vec, model, threshold=0.95, anchor_stats=None
+):
+    return classify_mentions(
+        page,
+        [text],
+        anchors,
+        word2vec,
+        model,
+        threshold=threshold,
+        anchor_stats=anchor_stats,
+    )[text]
+
+
+def get_candidates(text, anchors):
     # Work with the 10 most frequent candidates
     limited_cands = anchors[text]
     if len(limited_cands) > 10:
         limited_cands = dict(
             sorted(anchors[text].items(), key=operator.itemgetter(1), reverse=True)[:10]
         )
-    for cand in limited_cands:
-        # get the features
-        #         cand_feats = get_feature_set(page, text, cand, anchors, word2vec,pageids)
-        cand_feats = get_feature_set(page, text, cand, anchors, word2vec)
+    return limited_cands
 
-        # compute the model probability
-        cand_prediction[cand] = model.predict_proba(
-            np.array(cand_feats).reshape((1, -1))
-        )[0, 1]
 
-    # Compute the top candidate
-    if not cand_prediction:
-        return None
-    top_candidate = max(cand_prediction.items(), key=operator.itemgetter(1))
-
-    # Check if the max probability meets the threshold before returning
-    if top_candidate[1] < threshold:
-        return None
-    # print("--- %s seconds ---" % (time.time() - start_time))
-    return top_candidate
+# Batched version of classify_links: the candidates of all mentions are scored with a single
+# predict_proba call, as the per-call overhead of the model dominates the tree evaluation.
+# Returns a dictionary mapping each mention to its top candidate (or None).
+def classify_mentions(
+    page, mentions, anchors, word2vec, model, threshold=0.95, anchor_stats=None
+):
+    feature_rows = []
+    row_keys = []
+    mention_stats = get_anchor_stats(mentions, anchors, anchor_stats)
+    mention_candidates = {text: get_candidates(text, anchors) for text in mentions}
+    # Fetch the embeddings of the page and of all candidate targets in one go; the features
+    # are computed from the prefetched embeddings.
+    if isinstance(word2vec, MySqlDict):
+        word2vec = word2vec.get_many(
+            [page]
+            + [
+                cand
+                for candidates in mention_candidates.values()
+                for cand in candidates
+            ]
+        )
+    for text in mentions:
+        for cand in mention_candidates[text]:
+            # get the features
+            feature_rows.append(
+                get_feature_set(
+                    page, text, cand, anchors, word2vec, mention_stats[text]
+                )
+            )
+            row_keys.append((text, cand))
+
+    predictions = {text: None for text in mentions}
+    if not feature_rows:
+        return predictions
+    # compute the model probabilities
+    probabilities = as_inference_backend(model).predict_proba(np.array(feature_rows))[
+        :, 1
+    ]
+
+    cand_predictions = {}
+    for (text, cand), probability in zip(row_keys, probabilities):
+        cand_predictions.setdefault(text, {})[cand] = probability
+    for text, cand_prediction in cand_predictions.items():
+        # Compute the top candidate
+        top_candidate = max(cand_prediction.items(), key=operator.itemgetter(1))
+        # Check if the max probability meets the threshold
+        if top_candidate[1] >= threshold:
+            predictions[text] = top_candidate
+    return predictions
 
 
 # helper class to break out of nested for-loop when reaching set number of recommendations
@@ -246,12 +256,6 @@ class MaxRecError(Exception):
     pass
 
 
-# Helper class to break out of page processing loop when maximum page processing time
-# has been reached.
-class MaxTimeError(Exception):
-    pass
-
-
 # Actual Linking function
 def process_page(
     wikitext,
@@ -268,6 +272,10 @@ def process_page(
     context=10,
     maxrec=-1,
     sections_to_exclude=None,
+    anchor_stats=None,
+    anchor_filter=None,
+    prefetch_sections=0,
+    deadline=None,
 ):
     """
     Recommend links for a given wikitext.
@@ -278,7 +286,8 @@ def process_page(
     :param dict pageids: Pageid dataset for the wiki (title -> id)
     :param dict redirects: Redirect dataset for the wiki (original title -> redirect target)
     :param dict word2vec: word2vec dataset for the wiki (word -> vector)
-    :param xgboost.XGBClassifier model: The wiki's model for predicting link targets for words
+    :param xgboost.XGBClassifier model: The wiki's model for predicting link targets for words, or an
+    InferenceBackend for it
     :param string language_code: The ISO 639 language code to use with processing.
     :param float threshold: Minimum probability score required to include a prediction
     :param bool pr: Whether to include probability scores in the wikitext as 'pr' link parameters
@@ -287,6 +296,14 @@ def process_page(
     :param int maxrec: Maximum number of recommendations to return (-1 for unlimited)
     :param list sections_to_exclude: List of section names to exclude from link suggestion generation,
     e.g. "References"
+    :param dict anchor_stats: Precomputed anchor statistics for the wiki (link text -> (ambiguity, kurtosis)),
+    computed from the anchors dataset when omitted or missing an anchor
+    :param BloomFilter anchor_filter: Membership filter over the anchors of the wiki, used to drop mentions that
+    are not anchors before looking them up
+    :param int prefetch_sections: With MySQL, look up the mentions of this many sections at once instead of the
+    mentions of each text node separately (-1 for the whole page, 0 to disable)
+    :param Deadline deadline: Deadline of the request; when it passes, the links found so far are returned with
+    the reason in "info" and "deadline_exceeded" set. Defaults to GUNICORN_TIMEOUT (minus one second) from now
     :return: When return_wikitext is true, return updated wikitext with the new links added (or
     pseudo-wikitext with the custom 'pr' parameters if pr=True). Otherwise, return a data structure
     suitable for returning from the API.
@@ -294,159 +311,231 @@ def process_page(
     """
     if sections_to_exclude is None:
         sections_to_exclude = []
-    sections_to_exclude_nocase = list(
-        section.casefold() for section in sections_to_exclude
-    )
-    response = {"links": [], "info": ""}
-    init_time = time.time()
-    # Give ourselves a one second buffer to return the response after the
-    # configured timeout limit has been reached.
-    max_page_process_time_buffer = 1
-    max_page_process_time = (
-        int(os.environ.get("GUNICORN_TIMEOUT", 30)) - max_page_process_time_buffer
-    )
-    page_wikicode = mwparserfromhell.parse(wikitext)
-
-    page_wikicode_init = str(page_wikicode)  # save the initial state
-    page_wikicode_text_nodes = page_wikicode.filter_text(recursive=False)
-
-    # get all existing links
-    dict_links = getLinks(
-        page_wikicode, redirects=redirects, pageids=pageids
-    )  # get all links, resolve redirects
-    linked_mentions = set(dict_links.keys())
-    linked_links = set(dict_links.values())
-    # include also current pagetitle
-    linked_mentions.add(normalise_anchor(page))
-    linked_links.add(normalise_title(page))
+    response = {"links": [], "info": "", "deadline_exceeded": False}
+    if deadline is None:
+        deadline = Deadline()
+    # Parse the page once, except for the excluded sections; the sections, the top-level
+    # text nodes with their offsets and the existing links all come from the page model.
+    page_model = parse_page(wikitext, sections_to_exclude)
+    page_wikicode = page_model.wikicode
 
     tested_mentions = set()
+    # the lowercased texts of the page, as a node can get several links
+    lowercased = {}
+
+    def get_lowercased(text):
+        if text not in lowercased:
+            lowercased[text] = lowercase(text, language_code)
+        return lowercased[text]
+
+    # occurrences of the link texts in the top-level text nodes, for the match_index;
+    # built at the first link, as it parses the skipped sections before the last text node
+    occurrence_index = None
+
+    def get_occurrence_index():
+        nonlocal occurrence_index
+        if occurrence_index is None:
+            occurrence_index = OccurrenceIndex(page_model.get_texts())
+        return occurrence_index
+
+    def get_mentions(text_node):
+        mentions = {}
+        # The ngram_iterator generates substrings from the text of the article to check as candidate-anchors
+        # for links. It will do that by concatenating individual word-tokens (roughly speaking everything that
+        # is separated by a whitespace) to ngrams (strings that consist of n tokens); for example "Atlantic Ocean"
+        # would be a 2-gram. The arguments gram_length_max, gram_length_min define the range in which we vary n
+        # The current range n=5,...,1 means we first check all substrings of length 5, then 4, and so on until we
+        # reach 1. This range is defined by looking at the typical size of existing links in the anchor-dictionary.
+        # There are text-anchors that are not covered by this; they have much larger values for n; however,
+        # most anchors have small values of n.
+        # Reducing the range of the ngram-iterator we have fewer substrings for which we check the
+        # anchor-dictionary (and subsequently other lookups from checking whether to put a link).
+        grams = ngram_iterator(
+            text=text_node.text, gram_length_max=5, gram_length_min=1
+        )
+        for gram in grams:
+            deadline.check("mention generation")
+            mentions[gram.lower()] = gram
+
+        # Drop the mentions that are definitely not anchors.
+        if anchor_filter is not None:
+            mentions = {
+                mention: mention_original
+                for mention, mention_original in mentions.items()
+                if mention in anchor_filter
+            }
+        return mentions
 
     # try-except to break out of nested for-loop once we found maxrec links to add
     try:
-        for section in page_wikicode.get_sections(
-            include_lead=True, include_headings=True, flat=True
-        ):
-            if not section:
-                # This means the section is empty; one instance where this occurs
-                # is in articles that have no lead and instead begin with a section heading
-                continue
-            # Special-handling for lead section, which doesn't have a name.
+        deadline.check("parsing")
+        # get all existing links, resolve redirects
+        dict_links = resolve_links(
+            page_model.links, redirects=redirects, pageids=pageids
+        )
+        # index of the linked anchors, to check whether a mention is part of any of them
+        linked_mentions = LinkedMentionIndex(dict_links.keys())
+        linked_links = set(dict_links.values())
+        # include also current pagetitle
+        linked_mentions.add(normalise_anchor(page))
+        linked_links.add(normalise_title(page))
+        deadline.check("link resolution")
+
+        sections = page_model.get_sections(sections_to_exclude)
+        # With a negative prefetch_sections, the window is the whole page.
+        prefetch_window = len(sections) if prefetch_sections < 0 else prefetch_sections
+        prefetched_mentions = {}
+        prefetched_anchors = None
+        for i_section, section in enumerate(sections):
             if (
-                not isinstance(section.nodes[0], mwparserfromhell.nodes.heading.Heading)
-                and "%LEAD%" in sections_to_exclude
+                prefetch_window
+                and isinstance(anchors, MySqlDict)
+                and i_section % prefetch_window == 0
             ):
-                continue
-
-            section_heading = str(section.nodes[0].title).strip()
-            if section_heading.casefold() in sections_to_exclude_nocase:
-                continue
-            for node in section.filter_text(recursive=False):
-                mentions = {}
-                # check the offset of the node in the wikitext_init
-                node_val = node.value
-                i1_node_init = page_wikicode_init.find(node_val)
-                i2_node_init = i1_node_init + len(node_val)
-                # The ngram_iterator generates substrings from the text of the article to check as candidate-anchors
-                # for links. It will do that by concatenating individual word-tokens (roughly speaking everything that
-                # is separated by a whitespace) to ngrams (strings that consist of n tokens); for example "Atlantic Ocean"
-                # would be a 2-gram. The arguments gram_length_max, gram_length_min define the range in which we vary n
-                # The current range n=5,...,1 means we first check all substrings of length 5, then 4, and so on until we
-                # reach 1. This range is defined by looking at the typical size of existing links in the anchor-dictionary.
-                # There are text-anchors that are not covered by this; they have much larger values for n; however,
-                # most anchors have small values of n.
-                # Reducing the range of the ngram-iterator we have fewer substrings for which we check the
-                # anchor-dictionary (and subsequently other lookups from checking whether to put a link).
-                grams = ngram_iterator(text=node, gram_length_max=5, gram_length_min=1)
-                for gram in grams:
-                    if time.time() > init_time + max_page_process_time:
-                        response["info"] = (
-                            "Stopping page processing as maximum processing time %d seconds reached"
-                            % (max_page_process_time + max_page_process_time_buffer)
-                        )
-                        raise MaxTimeError
-                    mentions[gram.lower()] = gram
+                # Gather the mentions of all nodes in a window of sections, and look
+                # them up in as few queries as possible.
+                prefetched_mentions = {
+                    text_node.index: get_mentions(text_node)
+                    for window_section in sections[
+                        i_section : i_section + prefetch_window
+                    ]
+                    for text_node in window_section.text_nodes
+                }
+                prefetched_anchors = anchors.filter(
+                    list(set().union(*prefetched_mentions.values()))
+                )
+                # Likewise for the embeddings of the candidate targets, which fills the
+                # in process cache used by get_many when scoring each node.
+                if isinstance(word2vec, MySqlDict):
+                    word2vec.get_many(
+                        [page]
+                        + [
+                            cand
+                            for mention in prefetched_anchors
+                            for cand in get_candidates(mention, prefetched_anchors)
+                        ]
+                    )
+            for text_node in section.text_nodes:
+                node = text_node.node
+                # the offset of the node in the original wikitext
+                i1_node_init = text_node.start
+                if text_node.index in prefetched_mentions:
+                    mentions = prefetched_mentions.pop(text_node.index)
+                else:
+                    mentions = get_mentions(text_node)
 
                 if not mentions:
                     continue
 
                 # Get the subset of anchors that contain a mention; this batches a SELECT ... IN query rather
                 # than performing (thousands of) individual SELECT queries.
-                if isinstance(anchors, MySqlDict):
+                if prefetched_anchors is not None:
+                    anchors_with_mentions = {
+                        mention: prefetched_anchors[mention]
+                        for mention in mentions
+                        if mention in prefetched_anchors
+                    }
+                    if not anchors_with_mentions:
+                        continue
+                elif isinstance(anchors, MySqlDict):
                     anchors_with_mentions = anchors.filter(list(mentions))
                     if not anchors_with_mentions:
                         continue
                 else:
-                    # SQLite will not batch its queries.
-                    anchors_with_mentions = anchors
-
-                for mention, mention_original in mentions.items():
-                    if (
+                    # SQLite will not batch its queries, but each mention that was not
+                    # tested before is looked up only once.
+                    anchors_with_mentions = get_many(
+                        anchors,
+                        [
+                            mention
+                            for mention in mentions
+                            if mention not in tested_mentions
+                        ],
+                    )
+                    if not anchors_with_mentions:
+                        continue
+                # The candidate links of each mention that exists in the DB, as the
+                # mentions are checked again after scoring.
+                mention_links = {
+                    mention: set(links.keys())
+                    for mention, links in anchors_with_mentions.items()
+                }
+
+                def is_candidate_mention(mention):
+                    return (
                         # if the mention exist in the DB
-                        mention in anchors_with_mentions
+                        mention in mention_links
+                        # it was not tested before
+                        and mention not in tested_mentions
                         # it was not previously linked (or part of a link)
-                        and not any(mention in s for s in linked_mentions)
+                        and not linked_mentions.contains(mention)
                         # none of its candidate links is already used
-                        and not bool(
-                            set(anchors_with_mentions[mention].keys()) & linked_links
-                        )
-                        # it was not tested before (for efficiency)
-                        and mention not in tested_mentions
-                    ):
+                        and not bool(mention_links[mention] & linked_links)
+                    )
+
+                deadline.check("classification")
+                # Score all mentions of the node in one go. Accepting a link can only make
+                # later mentions ineligible, so the check is repeated below before using a score.
+                predictions = classify_mentions(
+                    page,
+                    [mention for mention in mentions if is_candidate_mention(mention)],
+                    anchors_with_mentions,
+                    word2vec,
+                    model,
+                    threshold=threshold,
+                    anchor_stats=anchor_stats,
+                )
+
+                for mention, mention_original in mentions.items():
+                    if is_candidate_mention(mention):
                         # logic
                         # print("testing:", mention, len(anchors[mention]))
-                        candidate = classify_links(
-                            page,
-                            mention,
-                            anchors_with_mentions,
-                            word2vec,
-                            model,
-                            threshold=threshold,
-                        )
+                        candidate = predictions[mention]
                         if candidate:
+                            deadline.check("link placement")
                             candidate_link, candidate_proba = candidate
                             # print(">> ", mention, candidate)
                             ############## Critical ##############
                             # Insert The Link in the current wikitext
-                            mention_regex = re.compile(
-                                r"(?<!\[\[)(?<!-->)\b{}\b(?![\w\s]*[\]\]])".format(
-                                    re.escape(mention_original)
-                                )
-                            )
-                            mention_regex_i = re.compile(
-                                mention_regex.pattern, re.IGNORECASE
-                            )
                             new_str = "[[" + candidate_link + "|" + mention_original
                             # add the probability
                             if pr:
                                 new_str += "|pr=" + str(candidate_proba)
                             new_str += "]]"
-                            newval, found = mention_regex.subn(new_str, node.value, 1)
+                            # (the first occurrence that is a word and not part of a link)
+                            newval, found = replace_mention(
+                                node.value,
+                                mention_original,
+                                new_str,
+                                word_boundaries=True,
+                            )
                             node.value = newval
+                            get_occurrence_index().update(text_node.index, newval)
                             ######################################
                             # Book-keeping
                             linked_mentions.add(mention)
                             linked_links.add(candidate_link)
                             if found == 1:
-                                page_wikicode_init_substr = page_wikicode_init[
-                                    i1_node_init:i2_node_init
-                                ]
-                                # Handle lower-casing of characters in some languages, e.g.
-                                # in Azeri, İnsan should be lowercased to insan, but the default lower-casing
-                                # in python will change the İ to an i with two dots.
-                                page_wikicode_init_substr_lower = str(
-                                    UnicodeString(page_wikicode_init_substr).toLower(
-                                        Locale(language_code)
-                                    )
+                                page_wikicode_init_substr = text_node.text
+                                # Handle lower-casing of characters in some languages (see
+                                # to_lower). The offset of the match is mapped back to the
+                                # original text in case lower-casing changed its length.
+                                page_wikicode_init_substr_lower = get_lowercased(
+                                    page_wikicode_init_substr
                                 )
-                                match = mention_regex_i.search(
-                                    page_wikicode_init_substr_lower
+                                i1_sub_lower = find_mention(
+                                    page_wikicode_init_substr_lower.lower,
+                                    mention_original,
+                                    word_boundaries=True,
+                                    ignore_case=True,
                                 )
-                                if match is None:
+                                if i1_sub_lower < 0:
                                     raise MentionRegexException(
-                                        mention, page_wikicode_init_substr_lower
+                                        mention, page_wikicode_init_substr_lower.lower
                                     )
-                                i1_sub = match.start()
+                                i1_sub = page_wikicode_init_substr_lower.to_original(
+                                    i1_sub_lower
+                                )
                                 start_offset = i1_node_init + i1_sub
                                 end_offset = start_offset + len(mention)
                                 ## provide context of the mention (+/- c characters in substring and wikitext)
@@ -487,14 +576,8 @@ def process_page(
                                 # Find 0-based index of anchor text match in a way that hopefully mostly survives
                                 # wikitext -> HTML transformation: count occurrences of the text in top-level
                                 # text nodes u
-                                preceding_nodes = page_wikicode_text_nodes[
-                                    : page_wikicode_text_nodes.index(node)
-                                ]
-                                match_index = sum(
-                                    str(node).count(mention_original)
-                                    for node in preceding_nodes
-                                ) + page_wikicode_init_substr[:i1_sub].count(
-                                    mention_original
+                                match_index = get_occurrence_index().count_before(
+                                    mention_original, text_node.index, i1_sub
                                 )
                                 new_link = {
                                     "link_target": candidate_link,
@@ -517,8 +600,14 @@ def process_page(
                                     raise MaxRecError
                         # More Book-keeping
                         tested_mentions.add(mention)
-    except (MaxRecError, MaxTimeError):
+    except MaxRecError:
         pass
+    except DeadlineExceeded as e:
+        response["deadline_exceeded"] = True
+        response["info"] = (
+            "Stopping page processing as maximum processing time %g seconds reached during %s"
+            % (e.budget, e.stage)
+        )
     # if yes, we return the adapted wikitext
     # else just return list of links with offsets
     if return_wikitext:
@@ -11,5 +11,7 @@ def model():
     model = MagicMock()
     model.get_booster.return_value = booster
 
-    model.predict_proba.return_value = np.array([[0.1, 0.9]])
+    model.predict_proba.side_effect = lambda features: np.tile(
+        [0.1, 0.9], (len(features), 1)
+    )
     return model
@@ -0,0 +1,74 @@
+from src.AnchorMatcher import build_anchor_matcher, open_anchor_matcher
+from src.scripts.ngram_utils import get_anchor_ngrams, get_ngrams
+
+
+def make_matcher(tmp_path, anchors):
+    path = str(tmp_path / "testwiki.anchors.matcher")
+    build_anchor_matcher(anchors, path, "abc")
+    return open_anchor_matcher(path)
+
+
+def test_find_overlapping_anchors(tmp_path):
+    matcher = make_matcher(tmp_path, ["he", "she", "his", "hers", "usher"])
+    assert sorted(matcher.find("ushers")) == [(0, 5), (1, 4), (2, 4), (2, 6)]
+    assert "hers" in matcher
+    assert "her" not in matcher
+    assert matcher.checksum == "abc"
+
+
+def test_empty_matcher(tmp_path):
+    matcher = make_matcher(tmp_path, [])
+    assert list(matcher.find("anything")) == []
+    assert "" not in matcher
+
+
+def test_open_anchor_matcher_reopens_rebuilt_matcher(tmp_path):
+    path = str(tmp_path / "testwiki.anchors.matcher")
+    assert open_anchor_matcher(path) is None
+    build_anchor_matcher(["foo"], path, "abc")
+    matcher = open_anchor_matcher(path)
+    assert open_anchor_matcher(path) is matcher
+    build_anchor_matcher(["bar"], path, "def")
+    rebuilt = open_anchor_matcher(path)
+    assert rebuilt.checksum == "def"
+    assert "bar" in rebuilt
+
+
+def test_get_anchor_ngrams_matches_ngrams(tmp_path):
+    tokens = [
+        "The",
+        " ",
+        "New",
+        " ",
+        "York",
+        " ",
+        "Times",
+        ",",
+        " ",
+        "New",
+        " ",
+        "Yorker",
+    ]
+    anchors = ["new york", "new york times", "york", "times,", "new", "ork", "yorker"]
+    matcher = make_matcher(tmp_path, anchors)
+    expected = [
+        gram
+        for gram_length in range(5, 0, -1)
+        for gram in get_ngrams(tokens, gram_length)
+        if gram.lower() in anchors
+    ]
+    assert get_anchor_ngrams(tokens, matcher, 5) == expected
+    assert expected == [
+        "New York Times",
+        "New York",
+        "Times,",
+        "New",
+        "York",
+        "New",
+        "Yorker",
+    ]
+
+
+def test_get_anchor_ngrams_falls_back_when_lowercasing_changes_length(tmp_path):
+    matcher = make_matcher(tmp_path, ["i̇nduizm"])
+    assert get_anchor_ngrams(["İnduizm"], matcher, 5) is None
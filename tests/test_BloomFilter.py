@@ -0,0 +1,42 @@
+import pytest
+
+from src.BloomFilter import BloomFilter, build_bloom_filter, open_bloom_filter
+
+
+def test_no_false_negatives():
+    keys = ["anchor%d" % i for i in range(1000)]
+    bloom_filter = build_bloom_filter(keys, len(keys), 0.01)
+    assert all(key in bloom_filter for key in keys)
+    assert bloom_filter.count == 1000
+
+
+def test_false_positive_rate():
+    keys = ["anchor%d" % i for i in range(1000)]
+    bloom_filter = build_bloom_filter(keys, len(keys), 0.01)
+    false_positives = sum("other%d" % i in bloom_filter for i in range(10000))
+    assert false_positives < 300
+    stats = bloom_filter.get_stats()
+    assert stats["false_positive_rate"] == 0.01
+    assert stats["expected_false_positive_rate"] == pytest.approx(0.01, rel=0.2)
+    assert stats["checks"] == 10000
+    assert stats["rejections"] == 10000 - false_positives
+
+
+def test_false_positive_rate_from_env(monkeypatch):
+    monkeypatch.setenv("ANCHOR_FILTER_FALSE_POSITIVE_RATE", "0.001")
+    assert build_bloom_filter([], 100).false_positive_rate == 0.001
+
+
+def test_serialization(tmp_path):
+    bloom_filter = build_bloom_filter(["foo", "bär"], 2, 0.01, checksum="abc")
+    path = str(tmp_path / "testwiki.anchors.bloom")
+    bloom_filter.save(path)
+    loaded = open_bloom_filter(path)
+    assert open_bloom_filter(path) is loaded
+    assert loaded.checksum == "abc"
+    assert loaded.count == 2
+    assert "foo" in loaded and "bär" in loaded
+    assert loaded.to_bytes() == bloom_filter.to_bytes()
+    with pytest.raises(ValueError):
+        BloomFilter.from_bytes(b"x" * 64)
+    assert open_bloom_filter(str(tmp_path / "missing.bloom")) is None
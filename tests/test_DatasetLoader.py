@@ -0,0 +1,137 @@
+from unittest.mock import MagicMock
+
+from src.AnchorMatcher import build_anchor_matcher
+from src.BloomFilter import build_bloom_filter
+from src.DatasetLoader import DatasetLoader, get_dataset_loader
+
+
+def test_get_dataset_loader_reuses_loader(tmp_path):
+    data_dir = str(tmp_path)
+    with get_dataset_loader(
+        backend="sqlite", wiki_id="testwiki", data_dir=data_dir
+    ) as datasetloader:
+        # A concurrent request gets its own loader.
+        other = get_dataset_loader(
+            backend="sqlite", wiki_id="testwiki", data_dir=data_dir
+        )
+        assert other is not datasetloader
+    with get_dataset_loader(
+        backend="sqlite", wiki_id="testwiki", data_dir=data_dir
+    ) as same_datasetloader:
+        assert same_datasetloader is datasetloader
+
+
+def test_get_dataset_loader_closes_evicted_loaders(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATASET_LOADER_CACHE_SIZE", "1")
+    data_dir = str(tmp_path)
+    with get_dataset_loader(
+        backend="sqlite", wiki_id="testwiki", data_dir=data_dir
+    ) as datasetloader:
+        (tmp_path / "data" / "testwiki").mkdir(parents=True)
+        datasetloader.get("anchors")
+    with get_dataset_loader(backend="sqlite", wiki_id="otherwiki", data_dir=data_dir):
+        pass
+    assert datasetloader.datasets == {}
+
+
+def test_get_dataset_loader_closes_loaders_evicted_while_in_use(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATASET_LOADER_CACHE_SIZE", "1")
+    data_dir = str(tmp_path)
+    (tmp_path / "data" / "testwiki").mkdir(parents=True)
+    with get_dataset_loader(
+        backend="sqlite", wiki_id="testwiki", data_dir=data_dir
+    ) as datasetloader:
+        datasetloader.get("anchors")
+        with get_dataset_loader(
+            backend="sqlite", wiki_id="otherwiki", data_dir=data_dir
+        ):
+            pass
+        # Evicted, but still in use.
+        assert "anchors" in datasetloader.datasets
+    assert datasetloader.datasets == {}
+
+
+def test_get_dataset_loader_closes_uncached_loaders(tmp_path):
+    data_dir = str(tmp_path)
+    (tmp_path / "data" / "testwiki").mkdir(parents=True)
+    with get_dataset_loader(backend="sqlite", wiki_id="testwiki", data_dir=data_dir):
+        with get_dataset_loader(
+            backend="sqlite", wiki_id="testwiki", data_dir=data_dir
+        ) as other:
+            other.get("anchors")
+        assert other.datasets == {}
+
+
+def test_get_model_path_reloads_model_after_checksum_change(tmp_path):
+    datasetloader = DatasetLoader(backend="mysql", wiki_id="testwiki")
+    datasetloader.model_path = str(tmp_path / "testwiki.linkmodel.json")
+    checksums = {"testwiki_model": "a"}
+    datasetloader.datasets["checksum"] = checksums
+    cursor = MagicMock()
+    cursor.fetchone.return_value = (b"model a",)
+    datasetloader.mysql_connection = MagicMock()
+    datasetloader.mysql_connection.cursor.return_value = cursor
+
+    path, _ = datasetloader.get_model_path()
+    assert open(path).read() == "model a"
+    # The saved model is reused while the checksum doesn't change.
+    cursor.fetchone.return_value = (b"model b",)
+    assert open(datasetloader.get_model_path()[0]).read() == "model a"
+
+    checksums["testwiki_model"] = "b"
+    assert datasetloader.get_model_checksum() == "b"
+    assert open(datasetloader.get_model_path()[0]).read() == "model b"
+    assert cursor.execute.call_count == 2
+
+
+def make_sqlite_loader(tmp_path, anchors_checksum):
+    (tmp_path / "data" / "testwiki").mkdir(parents=True, exist_ok=True)
+    datasetloader = DatasetLoader(
+        backend="sqlite", wiki_id="testwiki", data_dir=str(tmp_path)
+    )
+    with open("%s.checksum" % datasetloader.get_sqlite_path("anchors"), "w") as file:
+        file.write("%s  testwiki.anchors.sqlite\n" % anchors_checksum)
+    return datasetloader
+
+
+def test_get_anchor_filter_ignores_stale_sqlite_filter(tmp_path):
+    datasetloader = make_sqlite_loader(tmp_path, "a")
+    assert datasetloader.get_sqlite_checksum("anchors") == "a"
+    build_bloom_filter(["anchor1"], 1, checksum="a").save(
+        datasetloader.get_anchor_filter_path()
+    )
+    assert "anchor1" in datasetloader.get_anchor_filter()
+    # The anchors were refreshed after the filter was built.
+    datasetloader = make_sqlite_loader(tmp_path, "b")
+    assert datasetloader.get_anchor_filter() is None
+
+
+def test_get_sqlite_checksum_without_checksum_file(tmp_path):
+    datasetloader = DatasetLoader(
+        backend="sqlite", wiki_id="testwiki", data_dir=str(tmp_path)
+    )
+    assert datasetloader.get_sqlite_checksum("anchors") is None
+    (tmp_path / "data" / "testwiki").mkdir(parents=True)
+    datasetloader.get("anchors")["anchor1"] = {"Page1": 1}
+    datasetloader.get("anchors").commit()
+    assert datasetloader.get_sqlite_checksum("anchors")
+
+
+def test_get_anchor_matcher_ignores_stale_sqlite_matcher(tmp_path):
+    datasetloader = make_sqlite_loader(tmp_path, "a")
+    build_anchor_matcher(["anchor1"], datasetloader.get_anchor_matcher_path(), "a")
+    assert datasetloader.get_anchor_matcher().checksum == "a"
+    datasetloader = make_sqlite_loader(tmp_path, "b")
+    assert datasetloader.get_anchor_matcher() is None
+
+
+def test_has_dataset_ignores_stale_sqlite_anchor_stats(tmp_path):
+    datasetloader = make_sqlite_loader(tmp_path, "a")
+    anchorstats_path = datasetloader.get_sqlite_path("anchorstats")
+    datasetloader.get("anchorstats").commit()
+    assert not datasetloader.has_dataset("anchorstats")
+    with open("%s.checksum" % anchorstats_path, "w") as file:
+        file.write("a  testwiki.anchorstats.sqlite\n")
+    assert datasetloader.has_dataset("anchorstats")
+    datasetloader = make_sqlite_loader(tmp_path, "b")
+    assert not datasetloader.has_dataset("anchorstats")
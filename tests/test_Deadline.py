@@ -0,0 +1,43 @@
+import pytest
+
+from src.Deadline import Deadline, DeadlineExceeded
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_deadline():
+    clock = FakeClock()
+    deadline = Deadline(10, clock=clock)
+    clock.now += 4
+    assert deadline.remaining() == 6
+    deadline.check("parsing")
+    clock.now += 6
+    assert deadline.remaining() == 0
+    assert deadline.expired()
+    with pytest.raises(DeadlineExceeded) as e:
+        deadline.check("parsing")
+    assert e.value.stage == "parsing"
+    assert e.value.budget == 10
+
+
+def test_deadline_defaults_to_gunicorn_timeout(monkeypatch):
+    monkeypatch.setenv("GUNICORN_TIMEOUT", "60")
+    assert Deadline().budget == 59
+
+
+@pytest.mark.parametrize(
+    "value,expected_budget",
+    [(None, 29), ("5", 5), ("2.5", 2.5), ("100", 29), ("0", 29), ("soon", 29)],
+)
+def test_deadline_from_header(monkeypatch, value, expected_budget):
+    monkeypatch.delenv("GUNICORN_TIMEOUT", raising=False)
+    clock = FakeClock()
+    deadline = Deadline.from_header(value, clock=clock)
+    assert deadline.budget == expected_budget
+    assert deadline.remaining() == expected_budget
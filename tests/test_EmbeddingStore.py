@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+import pytest
+
+from src.EmbeddingStore import (
+    EmbeddingStore,
+    build_embedding_store,
+    open_embedding_store,
+)
+from src.scripts.utils_v2 import getDistEmb
+
+word2vec = {
+    "Lipsko": [0.1, 0.2, 0.3],
+    "Praha": [0.3, -0.2, 0.1],
+    "Škoda": [1.0, 1.0, 0.0],
+    "Zero": [0.0, 0.0, 0.0],
+    "Ångström": [-0.5, 0.2, 0.9],
+}
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    path = str(tmp_path / "testwiki.w2vfiltered.store")
+    assert build_embedding_store(word2vec.items(), path, "abc") == len(word2vec)
+    return path
+
+
+def test_lookup(store_path):
+    store = EmbeddingStore(store_path)
+    assert len(store) == len(word2vec)
+    assert store.checksum == "abc"
+    for title, vector in word2vec.items():
+        assert title in store
+        norm = np.linalg.norm(vector)
+        expected = np.array(vector) / norm if norm else np.zeros(3)
+        np.testing.assert_allclose(store[title], expected, rtol=1e-6)
+    assert "Missing" not in store
+    assert store.get("Missing") is None
+    with pytest.raises(KeyError):
+        store["Missing"]
+
+
+@pytest.mark.parametrize(
+    "title_a,title_b",
+    [
+        ("Lipsko", "Praha"),
+        ("Škoda", "Ångström"),
+        ("Lipsko", "Zero"),
+        ("Lipsko", "Missing"),
+    ],
+)
+def test_similarity_matches_getDistEmb(store_path, title_a, title_b):
+    store = EmbeddingStore(store_path)
+    assert getDistEmb(title_a, title_b, store) == pytest.approx(
+        getDistEmb(title_a, title_b, word2vec), abs=1e-6
+    )
+
+
+def test_open_embedding_store(store_path, tmp_path):
+    store = open_embedding_store(store_path)
+    assert open_embedding_store(store_path) is store
+    assert open_embedding_store(str(tmp_path / "missing")) is None
+
+    # Rebuilding the store replaces it and is picked up when it is opened again.
+    build_embedding_store({"Lipsko": [1.0, 0.0, 0.0]}.items(), store_path, "def")
+    os.utime(os.path.join(store_path, "meta.json"), ns=(0, 0))
+    rebuilt_store = open_embedding_store(store_path)
+    assert rebuilt_store is not store
+    assert rebuilt_store.checksum == "def"
+    assert len(rebuilt_store) == 1
+
+
+def test_get_many(store_path):
+    store = EmbeddingStore(store_path)
+    embeddings = store.get_many(["Praha", "Missing", "Škoda"])
+    assert list(embeddings) == ["Praha", "Škoda"]
+    np.testing.assert_allclose(embeddings["Praha"], store["Praha"])
@@ -0,0 +1,143 @@
+import json
+import os
+
+import numpy as np
+import pytest
+import xgboost as xgb
+from unittest.mock import MagicMock
+
+from src.InferenceBackend import (
+    ClassifierBackend,
+    InplacePredictBackend,
+    NumpyTreeBackend,
+    as_inference_backend,
+    get_inference_backend,
+    parse_base_score,
+)
+
+
+def train_model(num_features, **kwargs):
+    rng = np.random.default_rng(0)
+    features = rng.random((500, num_features))
+    labels = (features[:, 0] + features[:, 1] * features[:, 2] > 0.7).astype(int)
+    model = xgb.XGBClassifier(n_estimators=30, max_depth=4, **kwargs)
+    model.fit(features, labels)
+    return model
+
+
+@pytest.fixture(params=[6, 7], ids=["v1", "v2"])
+def link_model(request, tmp_path):
+    # Round-trip through the JSON format, like the link models used by the service.
+    path = str(tmp_path / "linkmodel.json")
+    train_model(request.param).save_model(path)
+    model = xgb.XGBClassifier()
+    model.load_model(path)
+    return model
+
+
+def make_features(model, rows):
+    rng = np.random.default_rng(1)
+    features = rng.random((rows, model.get_booster().num_features()))
+    # Features like the embedding distance can be missing.
+    features[::7, 4] = np.nan
+    return features
+
+
+@pytest.mark.parametrize("backend_class", [InplacePredictBackend, NumpyTreeBackend])
+@pytest.mark.parametrize("rows", [1, 100])
+def test_backend_matches_predict_proba(link_model, backend_class, rows):
+    features = make_features(link_model, rows)
+    expected = link_model.predict_proba(features)
+    actual = backend_class(link_model).predict_proba(features)
+    assert actual.shape == expected.shape
+    np.testing.assert_allclose(actual, expected, rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.integration
+@pytest.mark.parametrize("wiki_id", ["simplewiki", "bat_smgwiki"])
+@pytest.mark.parametrize("backend_class", [InplacePredictBackend, NumpyTreeBackend])
+def test_backend_matches_predict_proba_on_fixture_models(wiki_id, backend_class):
+    # The real link models downloaded by .pipeline/integration.sh, with 6 and 7 features.
+    model = xgb.XGBClassifier()
+    model.load_model(
+        os.path.join(
+            os.path.dirname(__file__),
+            "..",
+            "data/{0}/{0}.linkmodel.json".format(wiki_id),
+        )
+    )
+    # Spread the features over the ranges of the real ones, e.g. counts and distances.
+    features = make_features(model, 1000) * np.array(
+        [1, 1000, 100, 10, 1, 1, 10][: model.get_booster().num_features()]
+    )
+    expected = model.predict_proba(features)
+    for rows in [features[:1], features]:
+        np.testing.assert_allclose(
+            backend_class(model).predict_proba(rows),
+            expected[: len(rows)],
+            rtol=1e-5,
+            atol=1e-6,
+        )
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [("5E-1", 0.5), ("[5E-1]", 0.5), (" [2.5E-1] ", 0.25), ("0.3", 0.3)],
+)
+def test_parse_base_score(value, expected):
+    assert parse_base_score(value) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("value", ["[5E-1,5E-1]", "[]", "foo"])
+def test_parse_base_score_invalid(value):
+    with pytest.raises(ValueError):
+        parse_base_score(value)
+
+
+def test_numpy_backend_reads_vector_base_score(link_model):
+    # Models saved by XGBoost 3 have "[5E-1]" instead of "5E-1".
+    raw = json.loads(link_model.get_booster().save_raw(raw_format="json"))
+    learner_model_param = raw["learner"]["learner_model_param"]
+    learner_model_param["base_score"] = "[%s]" % learner_model_param["base_score"]
+    model = MagicMock()
+    model.get_booster.return_value.save_raw.return_value = json.dumps(raw).encode()
+    model.get_booster.return_value.attr.return_value = None
+    features = make_features(link_model, 20)
+    np.testing.assert_allclose(
+        NumpyTreeBackend(model).predict_proba(features),
+        link_model.predict_proba(features),
+        rtol=1e-5,
+        atol=1e-6,
+    )
+
+
+def test_backends_respect_best_iteration():
+    model = train_model(7)
+    model.get_booster().set_attr(best_iteration="4")
+    features = make_features(model, 20)
+    expected = model.predict_proba(features)
+    for backend in [InplacePredictBackend(model), NumpyTreeBackend(model)]:
+        np.testing.assert_allclose(
+            backend.predict_proba(features), expected, rtol=1e-5, atol=1e-6
+        )
+
+
+def test_get_inference_backend(link_model, monkeypatch):
+    assert isinstance(get_inference_backend(link_model), InplacePredictBackend)
+    assert isinstance(get_inference_backend(link_model, "numpy"), NumpyTreeBackend)
+    monkeypatch.setenv("INFERENCE_BACKEND", "classifier")
+    assert isinstance(get_inference_backend(link_model), ClassifierBackend)
+    with pytest.raises(ValueError):
+        get_inference_backend(link_model, "foo")
+
+
+def test_get_inference_backend_falls_back_for_unsupported_models():
+    model = train_model(7, booster="dart")
+    assert isinstance(get_inference_backend(model, "numpy"), InplacePredictBackend)
+
+
+def test_as_inference_backend():
+    backend = NumpyTreeBackend(train_model(7))
+    assert as_inference_backend(backend) is backend
+    model = MagicMock()
+    assert as_inference_backend(model).model is model
@@ -0,0 +1,34 @@
+import random
+
+from src.LinkedMentionIndex import LinkedMentionIndex
+
+
+def test_contains():
+    index = LinkedMentionIndex(["new york city", "berlin"])
+    assert index.contains("york")
+    assert index.contains("new york city")
+    assert index.contains("lin")
+    assert not index.contains("city berlin")
+    assert not index.contains("paris")
+    index.add("paris")
+    assert index.contains("ari")
+    assert len(index) == 3
+
+
+def test_contains_empty():
+    assert not LinkedMentionIndex().contains("")
+    assert not LinkedMentionIndex().contains("a")
+    assert LinkedMentionIndex(["a"]).contains("")
+
+
+def test_contains_matches_substring_scan():
+    rng = random.Random(0)
+    anchors = set()
+    index = LinkedMentionIndex()
+    for _ in range(50):
+        anchor = "".join(rng.choice("ab ") for _ in range(rng.randint(1, 8)))
+        anchors.add(anchor)
+        index.add(anchor)
+        for _ in range(20):
+            mention = "".join(rng.choice("ab ") for _ in range(rng.randint(1, 5)))
+            assert index.contains(mention) == any(mention in s for s in anchors)
@@ -0,0 +1,94 @@
+import pickle
+from unittest.mock import MagicMock
+
+from src.LookupCache import LookupCache, get_entry_size
+from src.MySqlDict import NOT_FOUND, MySqlDict
+
+
+def test_get_and_set():
+    cache = LookupCache(max_bytes=10000)
+    assert cache.get("lr_testwiki_anchors", "abc", "foo") is None
+    value = pickle.dumps({"Foo": 1})
+    cache.set("lr_testwiki_anchors", "abc", "foo", value)
+    assert cache.get("lr_testwiki_anchors", "abc", "foo") == value
+    assert cache.get_stats() == {
+        "hits": 1,
+        "misses": 1,
+        "entries": 1,
+        "bytes": get_entry_size("foo", value),
+    }
+
+
+def test_checksum_change_invalidates_table():
+    cache = LookupCache(max_bytes=10000)
+    cache.set("lr_testwiki_anchors", "abc", "foo", b"1")
+    cache.set("lr_testwiki_anchors", "abc", "bar", b"2")
+    cache.set("lr_testwiki_pageids", "def", "Foo", b"3")
+    assert cache.get("lr_testwiki_anchors", "xyz", "foo") is None
+    assert cache.get("lr_testwiki_pageids", "def", "Foo") == b"3"
+    assert cache.get_stats()["entries"] == 1
+    assert cache.total_bytes == get_entry_size("Foo", b"3")
+    assert cache.table_keys["lr_testwiki_pageids"] == {"Foo"}
+
+
+def test_evicts_least_recently_used():
+    cache = LookupCache(max_bytes=2 * get_entry_size("a", b"1"))
+    cache.set("table", "abc", "a", b"1")
+    cache.set("table", "abc", "b", b"2")
+    cache.get("table", "abc", "a")
+    cache.set("table", "abc", "c", b"3")
+    assert cache.get("table", "abc", "b") is None
+    assert cache.get("table", "abc", "a") == b"1"
+    assert cache.get("table", "abc", "c") == b"3"
+    assert cache.total_bytes <= cache.max_bytes
+    assert cache.table_keys["table"] == {"a", "c"}
+
+
+def test_size_bounds_stored_values():
+    # The cache stores the pickled values, whose size is what is counted.
+    value = pickle.dumps({"Page %d" % i: i for i in range(100)})
+    cache = LookupCache(max_bytes=10 * get_entry_size("anchor 00", value))
+    for i in range(20):
+        cache.set("table", "abc", "anchor %02d" % i, value)
+    assert cache.get_stats()["entries"] == 10
+    assert all(isinstance(entry[0], bytes) for entry in cache.entries.values())
+
+
+def make_mysqldict(rows, cache):
+    cursor = MagicMock()
+
+    def execute(query, keys=()):
+        cursor.fetchall.return_value = [
+            (key, pickle.dumps(rows[key])) for key in keys if key in rows
+        ]
+        cursor.fetchone.return_value = (
+            (pickle.dumps(rows[keys[0]]),) if keys and keys[0] in rows else None
+        )
+
+    cursor.execute.side_effect = execute
+    conn = MagicMock()
+    conn.cursor.return_value = cursor
+    return MySqlDict(
+        tablename="lr_testwiki_anchors",
+        conn=conn,
+        datasetname="anchors",
+        lookup_cache=cache,
+        checksum="abc",
+    )
+
+
+def test_mysqldict_shares_lookups_across_instances():
+    cache = LookupCache(max_bytes=10000)
+    rows = {"foo": {"Foo": 1}}
+    first = make_mysqldict(rows, cache)
+    assert first.filter(["foo", "bar"]) == {"foo": {"Foo": 1}}
+    assert first.query_count == 1
+
+    second = make_mysqldict(rows, cache)
+    assert second.filter(["foo", "bar"]) == {"foo": {"Foo": 1}}
+    assert "foo" in second
+    assert "bar" not in second
+    assert second["foo"] == {"Foo": 1}
+    assert second.query_count == 0
+    assert second.query_details["lookup_cache_hits"] == 2
+    assert cache.get("lr_testwiki_anchors", "abc", "bar") == NOT_FOUND
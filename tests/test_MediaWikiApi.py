@@ -1,4 +1,6 @@
+from src.Deadline import Deadline, DeadlineExceeded
 from src.MediaWikiApi import MediaWikiApi
+import requests
 import requests_mock
 import pytest
 
@@ -58,6 +60,23 @@ def test_get_article_revision():
         }
 
 
+def test_get_article_deadline():
+    deadline = Deadline(10)
+    mw_api = MediaWikiApi(wiki_domain="cs", api_url="https://api/", deadline=deadline)
+    with requests_mock.Mocker() as m:
+        m.get("https://api/api.php", json=get_default_response())
+        mw_api.get_article("Lipsko")
+        assert 0 < m.last_request.timeout <= 10
+
+        m.get("https://api/api.php", exc=requests.exceptions.ReadTimeout)
+        with pytest.raises(DeadlineExceeded):
+            mw_api.get_article("Lipsko")
+
+    mw_api.deadline = Deadline(0)
+    with pytest.raises(DeadlineExceeded):
+        mw_api.get_article("Lipsko")
+
+
 def test_host_headers():
     mw_api = MediaWikiApi(
         wiki_domain="cs", project="wikipedia", proxy_api_url="https://proxy/"
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+import xgboost as xgb
+
+from src.ModelRegistry import ModelRegistry
+
+
+def save_model(path, num_features):
+    rng = np.random.default_rng(0)
+    x = rng.random((50, num_features))
+    y = (x[:, 0] > 0.5).astype(int)
+    model = xgb.XGBClassifier(n_estimators=5, max_depth=2)
+    model.fit(x, y)
+    model.save_model(str(path))
+    return str(path)
+
+
+@pytest.fixture
+def model_path(tmp_path):
+    return save_model(tmp_path / "testwiki.linkmodel.json", 7)
+
+
+def test_get_reuses_loaded_model(model_path):
+    registry = ModelRegistry()
+    model, version = registry.get("testwiki", "abc", model_path)
+    assert version == "v2"
+    same_model, _ = registry.get("testwiki", "abc", model_path)
+    assert same_model is model
+    assert registry.get_stats()["hits"] == 1
+    assert registry.get_stats()["misses"] == 1
+
+
+def test_get_detects_v1_model(tmp_path):
+    registry = ModelRegistry()
+    _, version = registry.get(
+        "testwiki", "abc", save_model(tmp_path / "v1.linkmodel.json", 6)
+    )
+    assert version == "v1"
+
+
+def test_get_reloads_on_checksum_change(model_path):
+    registry = ModelRegistry()
+    model, _ = registry.get("testwiki", "abc", model_path)
+    new_model, _ = registry.get("testwiki", "def", model_path)
+    assert new_model is not model
+    assert registry.get_stats()["models"] == 1
+
+
+def test_evicts_least_recently_used(model_path):
+    registry = ModelRegistry(max_models=2)
+    registry.get("awiki", "abc", model_path)
+    registry.get("bwiki", "abc", model_path)
+    registry.get("awiki", "abc", model_path)
+    registry.get("cwiki", "abc", model_path)
+    assert list(registry.entries.keys()) == ["awiki", "cwiki"]
+
+
+def test_evicts_by_size(model_path):
+    registry = ModelRegistry(max_bytes=1)
+    registry.get("awiki", "abc", model_path)
+    registry.get("bwiki", "abc", model_path)
+    # The most recently used model is kept even if it exceeds the limit by itself.
+    assert list(registry.entries.keys()) == ["bwiki"]
+    assert registry.total_bytes == registry.entries["bwiki"].size
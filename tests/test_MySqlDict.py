@@ -0,0 +1,132 @@
+import pickle
+from unittest.mock import MagicMock
+
+import pytest
+from mwtokenizer import Tokenizer
+
+from src.Deadline import Deadline, DeadlineExceeded
+from src.MySqlDict import MySqlDict
+from src.scripts.utils_v2 import classify_mentions, process_page
+
+
+def make_mysqldict(rows, **kwargs):
+    cursor = MagicMock()
+
+    def execute(query, keys=()):
+        cursor.fetchall.return_value = [
+            (key, pickle.dumps(rows[key])) for key in keys if key in rows
+        ]
+
+    cursor.execute.side_effect = execute
+    conn = MagicMock()
+    conn.cursor.return_value = cursor
+    return MySqlDict(
+        tablename="lr_testwiki_anchors", conn=conn, datasetname="anchors", **kwargs
+    )
+
+
+def test_filter_chunks_by_number_of_keys():
+    anchors = make_mysqldict({}, filter_max_keys=100)
+    chunks = anchors.get_filter_chunks(["key%d" % i for i in range(250)])
+    assert [len(chunk) for chunk in chunks] == [84, 84, 82]
+    assert make_mysqldict({}).get_filter_chunks(["a"]) == [["a"]]
+
+
+def test_filter_chunks_by_size():
+    anchors = make_mysqldict({}, filter_max_bytes=100)
+    keys = ["x" * 20] * 9
+    chunks = anchors.get_filter_chunks(keys)
+    assert sum(chunks, []) == keys
+    assert all(len(chunk) * (2 * 20 + 3) <= 100 for chunk in chunks)
+
+
+def test_filter():
+    anchors = make_mysqldict({"foo": {"Foo": 1}}, filter_max_keys=2)
+    assert anchors.filter(["foo", "bar", "baz"]) == {"foo": {"Foo": 1}}
+    assert anchors.query_details["filter"] == 2
+
+
+def test_process_page_prefetches_anchors(model):
+    wikitext = (
+        "Lorem anchor1 ipsum\n== Foo ==\nanchor2 dolor\n== Bar ==\nsit anchor3 amet\n"
+    )
+    rows = {
+        "anchor1": {"Page1": 1},
+        "anchor2": {"Page2": 1},
+        "anchor3": {"Page3": 1},
+    }
+    results = {}
+    for prefetch_sections in [0, 2, -1]:
+        anchors = make_mysqldict(rows)
+        links = process_page(
+            wikitext,
+            "Page",
+            anchors,
+            {"Page1": 1, "Page2": 2, "Page3": 3},
+            {},
+            {},
+            model,
+            language_code="en",
+            wiki_id="enwiki",
+            pr=False,
+            return_wikitext=False,
+            sections_to_exclude=[],
+            prefetch_sections=prefetch_sections,
+        )["links"]
+        results[prefetch_sections] = (
+            [link["link_target"] for link in links],
+            anchors.query_details["filter"],
+        )
+    assert results[0] == (["Page1", "Page2", "Page3"], 3)
+    assert results[2] == (["Page1", "Page2", "Page3"], 2)
+    assert results[-1] == (["Page1", "Page2", "Page3"], 1)
+
+
+def test_get_many():
+    word2vec = make_mysqldict({"Foo": [0.1, 0.2], "Bar": [0.3, 0.4]})
+    assert word2vec.get_many(["Foo", "Baz", "Foo", "Bar"]) == {
+        "Foo": [0.1, 0.2],
+        "Bar": [0.3, 0.4],
+    }
+    assert word2vec.query_details["filter"] == 1
+    # Later lookups are served from the in process cache.
+    assert word2vec["Foo"] == [0.1, 0.2]
+    assert "Baz" not in word2vec
+    assert word2vec.query_count == 1
+
+
+def test_classify_mentions_prefetches_embeddings(model):
+    word2vec = make_mysqldict({"Page": [1.0, 0.0], "Page1": [1.0, 0.0]})
+    anchors = {"anchor1": {"Page1": 2, "Page2": 1}, "anchor2": {"Page3": 1}}
+    predictions = classify_mentions(
+        "Page",
+        ["anchor1", "anchor2"],
+        anchors,
+        word2vec,
+        model,
+        "enwiki",
+        Tokenizer(language_code="en"),
+        threshold=0.5,
+    )
+    assert set(predictions) == {"anchor1", "anchor2"}
+    assert word2vec.query_count == 1
+    # The embedding distance is the fifth feature.
+    features = model.predict_proba.call_args[0][0]
+    assert list(features[:, 4]) == [1.0, 0.0, 0.0]
+
+
+def test_queries_are_bounded_by_deadline():
+    anchors = make_mysqldict({"foo": {"Foo": 1}}, deadline=Deadline(10))
+    assert anchors.filter(["foo"]) == {"foo": {"Foo": 1}}
+    query = anchors.cursor.execute.call_args[0][0]
+    assert query.startswith("SET STATEMENT max_statement_time=")
+    assert " FOR SELECT lookup, value FROM lr_testwiki_anchors WHERE" in query
+
+    anchors.set_deadline(Deadline(0))
+    with pytest.raises(DeadlineExceeded):
+        anchors.filter(["bar"])
+
+    anchors.set_deadline(Deadline(10))
+    anchors.cursor.execute.side_effect = Exception(1969, "max_statement_time exceeded")
+    with pytest.raises(DeadlineExceeded):
+        anchors.filter(["baz"])
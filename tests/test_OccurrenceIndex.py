@@ -0,0 +1,61 @@
+import random
+
+from src.OccurrenceIndex import OccurrenceIndex
+
+
+def count_before(texts, current, string, index, offset):
+    return sum(current[i].count(string) for i in range(index)) + texts[index][
+        :offset
+    ].count(string)
+
+
+def test_count_before():
+    index = OccurrenceIndex(["foo bar foo", " foo", "aaaa"])
+    assert index.count_before("foo", 0, 0) == 0
+    assert index.count_before("foo", 0, 3) == 1
+    assert index.count_before("foo", 0, 10) == 1
+    assert index.count_before("foo", 1, 1) == 2
+    assert index.count_before("foo", 2, 0) == 3
+    # non-overlapping, like str.count
+    assert index.count_before("aa", 2, 4) == 2
+    assert index.count_before("aa", 2, 3) == 1
+
+
+def test_count_before_changed_texts():
+    index = OccurrenceIndex(["foo bar", "foo"])
+    index.update(0, "[[Foo|foo]] bar")
+    assert index.count_before("foo", 1, 0) == 1
+    assert index.count_before("Foo", 1, 0) == 1
+    # the text itself is counted from its original value
+    assert index.count_before("Foo", 0, 7) == 0
+    index.update(0, "foo bar")
+    assert index.count_before("Foo", 1, 0) == 0
+
+
+def test_count_before_duplicate_texts():
+    # Texts are identified by their position, so an identical earlier text is counted as well.
+    index = OccurrenceIndex(["foo ", "bar", "foo "])
+    assert index.count_before("foo", 2, 0) == 1
+    index.update(2, "[[Foo|foo]] ")
+    assert index.count_before("foo", 2, 0) == 1
+    assert index.count_before("foo", 0, 3) == 1
+
+
+def test_count_before_matches_str_count():
+    rng = random.Random(0)
+    texts = [
+        "".join(rng.choice("ab ") for _ in range(rng.randint(0, 12))) for _ in range(8)
+    ]
+    current = list(texts)
+    index = OccurrenceIndex(texts)
+    for _ in range(200):
+        if rng.random() < 0.2:
+            i = rng.randrange(len(texts))
+            current[i] = "".join(rng.choice("ab[]") for _ in range(rng.randint(0, 12)))
+            index.update(i, current[i])
+        string = "".join(rng.choice("ab ") for _ in range(rng.randint(1, 3)))
+        i = rng.randrange(len(texts))
+        offset = rng.randint(0, len(texts[i]))
+        assert index.count_before(string, i, offset) == count_before(
+            texts, current, string, i, offset
+        )
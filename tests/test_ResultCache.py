@@ -0,0 +1,68 @@
+import pytest
+
+from src.ResultCache import DiskStore, MemoryStore, ResultCache, get_result_cache_store
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = MemoryStore(max_bytes=2)
+    store.set("a", "1")
+    store.set("b", "2")
+    store.get("a")
+    store.set("c", "3")
+    assert store.get("b") is None
+    assert store.get("a") == "1"
+    assert store.get("c") == "3"
+
+
+def test_disk_store(tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    store = DiskStore(path=path, max_entries=2)
+    store.PRUNE_INTERVAL = 1
+    for key in ["a", "b", "c"]:
+        store.set(key, key.upper())
+    assert store.get("a") is None
+    assert store.get("c") == "C"
+    # The entries are shared with other processes.
+    assert DiskStore(path=path).get("b") == "B"
+
+
+def test_get_result_cache_store(monkeypatch, tmp_path):
+    monkeypatch.setenv("RESULT_CACHE_PATH", str(tmp_path / "results.sqlite"))
+    monkeypatch.delenv("RESULT_CACHE_SERVER", raising=False)
+    assert get_result_cache_store("") is None
+    assert isinstance(get_result_cache_store("memory"), MemoryStore)
+    # Without a server, the shared cache falls back to the disk store.
+    assert isinstance(get_result_cache_store("memcached"), DiskStore)
+    with pytest.raises(ValueError):
+        get_result_cache_store("redis")
+
+
+def test_get_key():
+    parameters = {"wikitext": "foo", "revid": 1, "dataset_checksums": {"anchors": "a"}}
+    key = ResultCache.get_key(**parameters)
+    assert key == ResultCache.get_key(**parameters)
+    assert key != ResultCache.get_key(**dict(parameters, wikitext="bar"))
+    assert key != ResultCache.get_key(
+        **dict(parameters, dataset_checksums={"anchors": "b"})
+    )
+
+
+def test_get_and_set():
+    cache = ResultCache(MemoryStore())
+    assert cache.get("key") is None
+    cache.set("key", {"links": []})
+    assert cache.get("key") == {"links": []}
+    assert cache.get_stats() == {"backend": "memory", "hits": 1, "misses": 1}
+
+
+def test_unavailable_store_is_a_miss():
+    class FailingStore(MemoryStore):
+        def get(self, key):
+            raise ConnectionError()
+
+        def set(self, key, value):
+            raise ConnectionError()
+
+    cache = ResultCache(FailingStore())
+    cache.set("key", {"links": []})
+    assert cache.get("key") is None
@@ -0,0 +1,40 @@
+import pytest
+from scipy.stats import kurtosis
+
+from src.scripts.anchor_stats import (
+    build_anchor_stats,
+    compute_anchor_stats,
+    get_anchor_stats,
+)
+
+
+@pytest.mark.parametrize(
+    "candidates",
+    [{"Page1": 3}, {"Page1": 10, "Page2": 3, "Page3": 1}],
+)
+def test_compute_anchor_stats(candidates):
+    ambig, kur = compute_anchor_stats(candidates)
+    assert ambig == len(candidates)
+    assert kur == kurtosis(
+        sorted(list(candidates.values()), reverse=True) + [1] * (1000 - ambig)
+    )
+
+
+def test_build_anchor_stats():
+    anchors = {"anchor1": {"Page1": 3}, "anchor2": {"Page1": 5, "Page2": 2}}
+    assert dict(build_anchor_stats(anchors.items())) == {
+        anchor: compute_anchor_stats(candidates)
+        for anchor, candidates in anchors.items()
+    }
+
+
+def test_get_anchor_stats_falls_back_to_computing():
+    anchors = {"anchor1": {"Page1": 3}, "anchor2": {"Page1": 5, "Page2": 2}}
+    precomputed = {"anchor1": (1, 42.0)}
+    assert get_anchor_stats(["anchor1", "anchor2"], anchors, precomputed) == {
+        "anchor1": (1, 42.0),
+        "anchor2": compute_anchor_stats(anchors["anchor2"]),
+    }
+    assert get_anchor_stats(["anchor1"], anchors) == {
+        "anchor1": compute_anchor_stats(anchors["anchor1"])
+    }
@@ -5,6 +5,7 @@ import os
 from pytest_cases import parametrize, fixture
 
 import app
+from src.Deadline import DeadlineExceeded
 
 # Needed so that the tests will make use of SQLite files downloaded by
 # .pipeline/integration.sh
@@ -261,3 +262,65 @@ def test_query_post(
             del expected_data["meta"]
 
     assert json.dumps(response_json) == json.dumps(expected_data)
+
+
+@pytest.mark.integration
+def test_batch_query(client, pytestconfig):
+    fixture_path = os.path.join(
+        pytestconfig.rootdir, "tests", "fixtures", "provide_query_post", "0"
+    )
+    with open(os.path.join(fixture_path, "source.wikitext")) as file:
+        wikitext = file.read()
+    with open(os.path.join(fixture_path, "expected_data.json")) as file:
+        expected_data = json.loads(file.read())
+    expected_data.pop("meta", None)
+    items = [
+        {"page_title": "Cat", "pageid": 2815, "revid": 8097163, "wikitext": wikitext},
+        {"page_title": "Cat", "pageid": 2815, "revid": 8097163, "wikitext": wikitext},
+    ]
+    res = client.post(
+        "v1/batch/linkrecommendations/wikipedia/simple",
+        json={"items": items},
+        query_string={"threshold": 0.5, "max_recommendations": 2},
+    )
+    assert res.status_code == 200
+    response_json = json.loads(res.data)
+    assert response_json["results_count"] == 2
+    for result in response_json["results"]:
+        del result["meta"]
+        assert json.dumps(result) == json.dumps(expected_data)
+
+
+@pytest.mark.integration
+def test_batch_query_invalid(client):
+    res = client.post(
+        "v1/batch/linkrecommendations/wikipedia/simple",
+        json={"items": [{"page_title": "Cat"}]},
+    )
+    assert res.status_code == 400
+
+
+def test_batch_query_stream(client, monkeypatch):
+    class FakeQuery:
+        def __init__(self, logger, datasetloader):
+            pass
+
+        def run_batch(self, items, **kwargs):
+            for item in items[:1]:
+                yield {"page_title": item["page_title"], "meta": {}, "links": []}
+            raise DeadlineExceeded("batch", 1)
+
+    monkeypatch.setattr(app, "Query", FakeQuery)
+    monkeypatch.setattr(app, "check_model_path", lambda *args: None)
+    item = {"pageid": 1, "revid": 2, "wikitext": "x"}
+    res = client.post(
+        "v1/batch/linkrecommendations/wikipedia/simple",
+        json={"items": [dict(item, page_title="Cat"), dict(item, page_title="Dog")]},
+        headers={"Accept": "application/x-ndjson"},
+    )
+    assert res.status_code == 200
+    assert res.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in res.data.decode().splitlines()]
+    assert [line.get("page_title") for line in lines] == ["Cat", None]
+    assert "application_version" in lines[0]["meta"]
+    assert lines[1]["error"]["code"] == 504
@@ -0,0 +1,175 @@
+import io
+import json
+
+import pytest
+
+from src import batch_query
+from src.Deadline import DeadlineExceeded
+from src.query import Query
+
+
+class FakeDatasetLoader:
+    def __init__(self, wiki_id):
+        self.wiki_id = wiki_id
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def get_model_path(self):
+        return ("model.json" if self.wiki_id != "nomodelwiki" else None), []
+
+
+class FakeQuery(Query):
+    def __init__(self, logger, datasetloader):
+        self.datasetloader = datasetloader
+
+    def run_batch(self, items, wiki_id, language_code, deadline, **kwargs):
+        if wiki_id == "slowwiki":
+            raise DeadlineExceeded("loading", deadline.budget)
+        for item in items:
+            yield {
+                "page_title": item["page_title"],
+                "pageid": item["pageid"],
+                "revid": item["revid"],
+                "links_count": 1,
+                "meta": {"language_code": language_code},
+                "links": [],
+            }
+
+
+@pytest.fixture
+def fake_query(monkeypatch):
+    monkeypatch.setattr(batch_query, "Query", FakeQuery)
+    monkeypatch.setattr(
+        batch_query,
+        "get_dataset_loader",
+        lambda backend, wiki_id, data_dir: FakeDatasetLoader(wiki_id),
+    )
+
+
+def make_line(wiki, title, **kwargs):
+    return json.dumps(dict(wiki=wiki, title=title, revid=1, wikitext="x", **kwargs))
+
+
+def run(lines, **kwargs):
+    output = io.StringIO()
+    progress = []
+    stats = batch_query.run_batch_query(
+        lines=lines,
+        output=output,
+        processes=kwargs.pop("processes", 1),
+        chunk_size=kwargs.pop("chunk_size", 2),
+        progress_interval=2,
+        progress=progress.append,
+        worker_settings={
+            "backend": "sqlite",
+            "data_dir": "",
+            "threshold": 0.5,
+            "max_recommendations": 15,
+            "sections_to_exclude": [],
+            "timeout": 1,
+        },
+        **kwargs,
+    )
+    return (
+        [json.loads(line) for line in output.getvalue().splitlines()],
+        stats,
+        progress,
+    )
+
+
+def test_parse_record():
+    item = batch_query.parse_record(make_line("cswiki", "foo_bar", pageid=3))
+    assert item == {
+        "wiki": "cswiki",
+        "language_code": "cs",
+        "page_title": "Foo bar",
+        "pageid": 3,
+        "revid": 1,
+        "wikitext": "x",
+    }
+    item = batch_query.parse_record(
+        make_line("cswiktionary", "Foo", language_code="cs", sections_to_exclude=["A"])
+    )
+    assert item["language_code"] == "cs"
+    assert item["sections_to_exclude"] == ["A"]
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        "{",
+        "[]",
+        json.dumps({"wiki": "cswiki", "title": "Foo"}),
+        make_line("cswiktionary", "Foo"),
+    ],
+)
+def test_parse_record_invalid(line):
+    with pytest.raises(ValueError):
+        batch_query.parse_record(line)
+
+
+def test_get_chunks():
+    lines = [
+        make_line("cswiki", "A"),
+        make_line("cswiki", "B"),
+        make_line("cswiki", "C"),
+        "",
+        make_line("dewiki", "D"),
+        "{",
+        make_line("dewiki", "E"),
+    ]
+    chunks = list(batch_query.get_chunks(lines, 2))
+    assert [[item.get("page_title") for item in chunk] for chunk in chunks] == [
+        ["A", "B"],
+        ["C"],
+        ["D"],
+        [None],
+        ["E"],
+    ]
+    assert chunks[3][0]["line"] == 6
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_run_batch_query(fake_query, processes):
+    lines = [
+        make_line("cswiki", "A"),
+        "{",
+        make_line("cswiki", "B"),
+        make_line("cswiki", "C"),
+        make_line("nomodelwiki", "D"),
+        make_line("slowwiki", "E"),
+        make_line("dewiki", "F"),
+    ]
+    results, stats, progress = run(lines, processes=processes, start_method="fork")
+    assert [result.get("page_title") for result in results] == [
+        "A",
+        None,
+        "B",
+        "C",
+        "D",
+        "E",
+        "F",
+    ]
+    assert [result.get("wiki") for result in results] == [
+        "cswiki",
+        None,
+        "cswiki",
+        "cswiki",
+        "nomodelwiki",
+        "slowwiki",
+        "dewiki",
+    ]
+    assert results[0]["meta"]["language_code"] == "cs"
+    assert [result["error"]["code"] for result in results if "error" in result] == [
+        400,
+        400,
+        504,
+    ]
+    assert stats["pages_count"] == 7
+    assert stats["errors_count"] == 3
+    assert stats["links_count"] == 4
+    assert [entry["pages_count"] for entry in progress] == [2, 4, 6, 7]
@@ -0,0 +1,49 @@
+from src.scripts.dataset_utils import get_many, resolve_redirects
+from src.scripts.utils_v2 import getLinks
+from tests.test_MySqlDict import make_mysqldict
+
+
+def test_get_many():
+    assert get_many({"a": 1, "b": 2}, ["a", "c", "a"]) == {"a": 1}
+
+
+def test_get_many_looks_up_each_key_once():
+    class CountingDict(dict):
+        lookups = 0
+
+        def __contains__(self, key):
+            raise AssertionError("get_many must not check membership")
+
+        def __getitem__(self, key):
+            CountingDict.lookups += 1
+            return super().__getitem__(key)
+
+    assert get_many(CountingDict(a=1, b=2), ["a", "c", "a"]) == {"a": 1}
+    assert CountingDict.lookups == 2
+
+
+def test_resolve_redirects():
+    redirects = {"A": "B", "B": "C", "D": "D"}
+    assert resolve_redirects(["A", "B", "D", "E"], redirects) == {
+        "A": "B",
+        "B": "C",
+        "D": "D",
+        "E": "E",
+    }
+    assert resolve_redirects(["A", "E"], redirects, max_hops=3) == {
+        "A": "C",
+        "E": "E",
+    }
+
+
+def test_get_links_looks_up_links_in_bulk():
+    wikitext = "[[Foo|foo]] and [[Bar]] and [[Baz|baz]] and [[Missing|missing]]"
+    redirects = make_mysqldict({"Foo": "Foo (band)", "Bar": "Baz"})
+    pageids = make_mysqldict({"Foo (band)": 1, "Baz": 2})
+    assert getLinks(wikitext, redirects=redirects, pageids=pageids) == {
+        "foo": "Foo (band)",
+        "bar": "Baz",
+        "baz": "Baz",
+    }
+    assert redirects.query_count == 1
+    assert pageids.query_count == 1
@@ -0,0 +1,92 @@
+import random
+import re
+
+import pytest
+
+from src.scripts.link_placement import (
+    EXTRA_CASES,
+    find_mention,
+    fold,
+    replace_mention,
+)
+
+
+def find_mention_regex(text, mention, word_boundaries=False, ignore_case=False):
+    boundary = r"\b" if word_boundaries else ""
+    match = re.search(
+        rf"(?<!\[\[)(?<!-->){boundary}{re.escape(mention)}{boundary}(?![\w\s]*[\]\]])",
+        text,
+        re.IGNORECASE if ignore_case else 0,
+    )
+    return match.start() if match is not None else -1
+
+
+@pytest.mark.parametrize(
+    "text,mention,expected",
+    [
+        ("foo bar", "bar", 4),
+        ("[[bar]] bar", "bar", 8),
+        ("[[Foo|bar]] bar", "bar", 12),
+        ("<!-- x -->bar bar", "bar", 14),
+        ("[[Foo|bar baz]]", "bar", -1),
+        ("bar] bar", "bar", 5),
+        ("bar.] bar", "bar", 0),
+    ],
+)
+def test_find_mention(text, mention, expected):
+    assert find_mention(text, mention) == expected
+    assert find_mention_regex(text, mention) == expected
+
+
+def test_find_mention_word_boundaries():
+    assert find_mention("foobar bar", "bar", word_boundaries=True) == 7
+    assert find_mention("bar_ bar", "bar", word_boundaries=True) == 5
+    assert find_mention("foobar", "bar", word_boundaries=True) == -1
+
+
+def test_find_mention_ignore_case():
+    assert fold("İnsan") == "insan"
+    assert find_mention("den. ınduizm", "İnduizm", ignore_case=True) == 5
+    assert find_mention("Foo", "fOO", ignore_case=True) == 0
+    assert find_mention("Foo", "fOO") == -1
+
+
+@pytest.mark.parametrize(
+    "char,other",
+    [
+        (chr(code), chr(other_code))
+        for code, other_codes in EXTRA_CASES.items()
+        for other_code in other_codes
+    ],
+)
+def test_fold_extra_cases(char, other):
+    # e.g. "ſ" and "s", or "ς" and "σ", which only re.IGNORECASE considers equal
+    assert fold(char) == fold(other)
+    assert re.fullmatch(re.escape(char), other, re.IGNORECASE)
+    text = "x %s]] x %s" % (other, other)
+    assert find_mention(text, char, ignore_case=True) == find_mention_regex(
+        text, char, ignore_case=True
+    )
+
+
+def test_find_mention_matches_regex():
+    rng = random.Random(0)
+    alphabet = "ab_ []->!İiıKK"
+    for _ in range(5000):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 20)))
+        mention = "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 3)))
+        for word_boundaries in [False, True]:
+            for ignore_case in [False, True]:
+                assert find_mention(
+                    text, mention, word_boundaries, ignore_case
+                ) == find_mention_regex(text, mention, word_boundaries, ignore_case)
+
+
+def test_replace_mention():
+    assert replace_mention("[[bar]] bar", "bar", "[[Bar|bar]]") == (
+        "[[bar]] [[Bar|bar]]",
+        1,
+    )
+    # the replacement is inserted literally, unlike with re.subn
+    assert replace_mention("bar", "bar", r"[[A\1|bar]]") == (r"[[A\1|bar]]", 1)
+    assert replace_mention("foobar", "bar", "x", word_boundaries=True) == ("foobar", 0)
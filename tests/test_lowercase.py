@@ -0,0 +1,21 @@
+from src.scripts.lowercase import get_locale, lowercase
+
+
+def test_lowercase():
+    lowercased = lowercase("Foo Bar", "en")
+    assert lowercased.lower == "foo bar"
+    assert lowercased.offsets is None
+    assert lowercased.to_original(4) == 4
+
+
+def test_lowercase_maps_offsets_when_length_changes():
+    # the dotted İ is lowercased to i and a combining dot above, except in Turkish and Azeri
+    lowercased = lowercase("İnsan dini", "en")
+    assert lowercased.lower == "i̇nsan dini"
+    assert lowercased.to_original(lowercased.lower.index("dini")) == 6
+    assert lowercased.to_original(len(lowercased.lower)) == len("İnsan dini")
+    assert lowercase("İnsan dini", "az").lower == "insan dini"
+
+
+def test_get_locale_is_cached():
+    assert get_locale("az") is get_locale("az")
@@ -0,0 +1,59 @@
+from unittest.mock import MagicMock
+
+from src.mysql import ConnectionPool
+
+
+def make_pool(**kwargs):
+    return ConnectionPool(connect=MagicMock(side_effect=lambda: MagicMock()), **kwargs)
+
+
+def test_borrow_reuses_released_connection():
+    pool = make_pool(size=2)
+    connection = pool.borrow()
+    pool.release(connection)
+    assert pool.borrow() is connection
+    assert pool.connect.call_count == 1
+    connection.ping.assert_called_once_with(reconnect=False)
+
+
+def test_borrow_replaces_broken_connection():
+    pool = make_pool(size=2)
+    connection = pool.borrow()
+    connection.ping.side_effect = Exception("MySQL server has gone away")
+    pool.release(connection)
+    assert pool.borrow() is not connection
+    connection.close.assert_called_once()
+    assert pool.connect.call_count == 2
+
+
+def test_idle_timeout_and_max_lifetime():
+    pool = make_pool(size=2, idle_timeout=0)
+    connection = pool.borrow()
+    pool.release(connection)
+    assert pool.borrow() is not connection
+    connection.close.assert_called_once()
+
+    pool = make_pool(size=2, max_lifetime=0)
+    connection = pool.borrow()
+    pool.release(connection)
+    connection.close.assert_called_once()
+    assert pool.idle == []
+
+
+def test_release_closes_surplus_connections():
+    pool = make_pool(size=1)
+    first, second = pool.borrow(), pool.borrow()
+    pool.release(first)
+    pool.release(second)
+    assert len(pool.idle) == 1
+    second.close.assert_called_once()
+
+
+def test_pool_is_reset_after_fork():
+    pool = make_pool(size=2)
+    connection = pool.borrow()
+    pool.release(connection)
+    pool.pid = -1
+    assert pool.borrow() is not connection
+    # Connections inherited from the parent process must not be closed.
+    connection.close.assert_not_called()
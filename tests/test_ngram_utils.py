@@ -0,0 +1,61 @@
+import random
+
+import pytest
+
+from src.scripts import utils
+from src.scripts.ngram_utils import get_ngram_spans, get_ngrams
+
+
+def get_ngrams_concatenating(tokens, n):
+    # get_ngrams before it was span based
+    for i_start, w_start in enumerate(tokens):
+        if w_start == " ":
+            continue
+        gram = ""
+        gram_count = 0
+        for j in range(i_start, len(tokens)):
+            w = tokens[j]
+            gram += w
+            if w != " ":
+                gram_count += 1
+            if gram_count == n:
+                yield gram
+                break
+
+
+def get_ngrams_v1_concatenating(tokens, n):
+    # utils.get_ngrams before it was span based
+    for i_start, w_start in enumerate(tokens):
+        if w_start == " ":
+            continue
+        gram = w_start
+        gram_count = 1
+        for j in range(i_start, len(tokens) - 1):
+            if gram_count == n:
+                yield gram
+                break
+            w = tokens[j + 1]
+            gram += w
+            if w != " ":
+                gram_count += 1
+
+
+def test_get_ngram_spans():
+    tokens = ["Berlin", ",", " ", "Germany"]
+    assert list(get_ngram_spans(tokens, 2)) == [(0, 7), (6, 15)]
+    assert list(get_ngrams(tokens, 3)) == ["Berlin, Germany"]
+    assert list(get_ngram_spans(tokens, 4)) == []
+    assert list(get_ngram_spans(tokens, 0)) == []
+
+
+@pytest.mark.parametrize("n", [1, 2, 3, 5])
+def test_get_ngrams_matches_concatenation(n):
+    rng = random.Random(n)
+    for _ in range(200):
+        tokens = [
+            rng.choice(["a", "bc", " ", "  ", ","]) for _ in range(rng.randint(0, 10))
+        ]
+        assert list(get_ngrams(tokens, n)) == list(get_ngrams_concatenating(tokens, n))
+        assert list(utils.get_ngrams(tokens, n)) == list(
+            get_ngrams_v1_concatenating(tokens, n)
+        )
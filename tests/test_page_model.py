@@ -0,0 +1,163 @@
+import glob
+import os
+
+import pytest
+
+from src.scripts.page_model import parse_page
+from src.scripts.utils_v2 import getLinks, process_page
+
+
+def test_parse_page_sections():
+    wikitext = "Lead\n== A ==\nfoo\n=== B ===\nbar {{t}} baz\n== C ==\n"
+    page_model = parse_page(wikitext)
+    assert [section.heading for section in page_model.sections] == [
+        None,
+        "A",
+        "B",
+        "C",
+    ]
+    assert [
+        [text_node.text for text_node in section.text_nodes]
+        for section in page_model.sections
+    ] == [["Lead\n"], ["\nfoo\n"], ["\nbar ", " baz\n"], ["\n"]]
+    assert [
+        section.heading for section in page_model.get_sections(["%LEAD%", "a"])
+    ] == ["B", "C"]
+
+
+def test_parse_page_without_lead():
+    page_model = parse_page("== A ==\nfoo")
+    assert [section.heading for section in page_model.sections] == ["A"]
+
+
+def test_parse_page_offsets_of_repeated_text():
+    wikitext = "foo [[Bar]] foo [[Bar]] foo"
+    page_model = parse_page(wikitext)
+    assert [
+        (text_node.index, text_node.start, text_node.end)
+        for text_node in page_model.text_nodes
+    ] == [(0, 0, 4), (1, 11, 16), (2, 23, 27)]
+    for text_node in page_model.text_nodes:
+        assert wikitext[text_node.start : text_node.end] == text_node.text
+
+
+@pytest.mark.parametrize(
+    "wikitext",
+    [
+        "[[ Foo # bar | baz ]] [[Foo#]] [[Foo|]] [[a|b|c]] [[foo_bar]]",
+        "{{t|x=[[C]]}} <ref>[[D]]</ref> [[File:X.png|thumb|cap [[E]]]]",
+        "<gallery>\nF.jpg|[[G]]\n</gallery> <!-- [[A]] --> <nowiki>[[B]]</nowiki>",
+        "== [[H]] ==\n[[I|[[J]]]] [[J|i]]",
+    ],
+)
+def test_parse_page_links(wikitext):
+    assert dict((anchor, link) for link, anchor in parse_page(wikitext).links) == (
+        getLinks(wikitext)
+    )
+
+
+def test_parse_page_links_of_fixtures(pytestconfig):
+    for path in glob.glob(
+        os.path.join(pytestconfig.rootdir, "tests", "fixtures", "**", "*.wikitext"),
+        recursive=True,
+    ):
+        with open(path) as file:
+            wikitext = file.read()
+        assert dict(
+            (anchor, link) for link, anchor in parse_page(wikitext).links
+        ) == getLinks(wikitext)
+
+
+def test_process_page_offsets_of_repeated_text(model):
+    # The text node also occurs in the template before it.
+    wikitext = "{{Quote| lorem anchor1 ipsum}} lorem anchor1 ipsum"
+    links = process_page(
+        wikitext,
+        "Page",
+        {"anchor1": {"Page1": 1}},
+        {"Page1": 1},
+        {},
+        {},
+        model,
+        language_code="en",
+        wiki_id="enwiki",
+        pr=False,
+        return_wikitext=False,
+    )["links"]
+    assert len(links) == 1
+    assert links[0]["start_offset"] == wikitext.rindex("anchor1")
+    assert links[0]["end_offset"] == wikitext.rindex("anchor1") + len("anchor1")
+
+
+def test_parse_page_skips_excluded_sections():
+    wikitext = (
+        "Lead [[A]]\n== Foo ==\nfoo\n== See also ==\n* [[B|b]]\n"
+        "=== Bar ===\nbar\n== References ==\n{{reflist}}\n"
+    )
+    sections_to_exclude = ["see also", "References"]
+    page_model = parse_page(wikitext, sections_to_exclude)
+    full_page_model = parse_page(wikitext)
+    assert [
+        wikitext[skipped_section.start : skipped_section.end]
+        for skipped_section in page_model.skipped_sections
+    ] == ["== See also ==\n* [[B|b]]\n", "== References ==\n{{reflist}}\n"]
+    # The indexes differ, as a skipped section takes a single index.
+    assert [
+        (
+            section.heading,
+            [(node.start, node.end, node.text) for node in section.text_nodes],
+        )
+        for section in page_model.sections
+    ] == [
+        (
+            section.heading,
+            [(node.start, node.end, node.text) for node in section.text_nodes],
+        )
+        for section in full_page_model.get_sections(sections_to_exclude)
+    ]
+    assert page_model.links == full_page_model.links
+    assert str(page_model.wikicode) == wikitext
+
+
+@pytest.mark.parametrize(
+    "wikitext",
+    [
+        "Lead\n== Foo ==\nfoo",
+        "{{t|\n== References ==\n}}",
+        "''lead\n== References ==\nrefs''",
+        "<ref>lead\n== References ==\n</ref>",
+        "<!-- lead\n== References ==\n-->",
+        "{|\n|lead\n== References ==\n|}",
+    ],
+)
+def test_parse_page_does_not_skip_sections(wikitext):
+    page_model = parse_page(wikitext, ["References"])
+    assert page_model.skipped_sections == ()
+    assert page_model.text_nodes == parse_page(wikitext).text_nodes
+
+
+def test_parse_page_texts_of_skipped_sections():
+    wikitext = "a [[A]] b\n== Foo ==\nfoo\n== Bar ==\nbar\n== Baz ==\nbaz"
+    page_model = parse_page(wikitext, ["%LEAD%", "bar", "baz"])
+    assert page_model.get_texts() == ["a \x00 b\n", "\nfoo\n", "", ""]
+
+
+def test_process_page_match_index_after_skipped_section(model):
+    wikitext = "anchor1 [[Page2]]\n== Foo ==\nfoo anchor1"
+    links = process_page(
+        wikitext,
+        "Page",
+        {"anchor1": {"Page1": 1}},
+        {"Page1": 1},
+        {},
+        {},
+        model,
+        sections_to_exclude=["%LEAD%"],
+        language_code="en",
+        wiki_id="enwiki",
+        pr=False,
+        return_wikitext=False,
+    )["links"]
+    assert len(links) == 1
+    assert links[0]["match_index"] == 1
+    assert links[0]["start_offset"] == wikitext.rindex("anchor1")
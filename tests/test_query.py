@@ -0,0 +1,188 @@
+from unittest.mock import MagicMock
+
+from src.Deadline import Deadline
+from src.query import Query
+from src.scripts import utils_v2
+from src.scripts.utils import MentionRegexException
+from src.ResultCache import MemoryStore, ResultCache
+
+
+class FakeDatasetLoader:
+    backend = "sqlite"
+
+    def __init__(self):
+        self.datasets = {
+            "anchors": {"anchor1": {"Page1": 1}, "anchor2": {"Page2": 1}},
+            "pageids": {"Page1": 1, "Page2": 2},
+            "redirects": {},
+            "w2vfiltered": {},
+            "model": {},
+            "checksum": {},
+        }
+        self.sqlite_checksums = {"anchors": "a"}
+        self.deadline = None
+
+    def set_deadline(self, deadline):
+        self.deadline = deadline
+
+    def get(self, tablename):
+        return self.datasets[tablename]
+
+    def has_dataset(self, tablename):
+        return tablename in self.datasets
+
+    def get_model_checksum(self):
+        return None
+
+    def get_sqlite_checksum(self, tablename):
+        return self.sqlite_checksums.get(tablename)
+
+    def get_model_path(self):
+        return "model.json", []
+
+    def get_anchor_filter(self):
+        return None
+
+    def get_anchor_matcher(self):
+        return None
+
+
+def make_query(model, result_cache=None):
+    model_registry = MagicMock()
+    model_registry.get.return_value = (model, "v2")
+    return Query(
+        MagicMock(),
+        FakeDatasetLoader(),
+        model_registry=model_registry,
+        result_cache=result_cache,
+    )
+
+
+def run_batch(query, deadline=None):
+    return list(
+        query.run_batch(
+            items=[
+                {"page_title": "A", "pageid": 1, "revid": 10, "wikitext": "x anchor1"},
+                {
+                    "page_title": "B",
+                    "pageid": 2,
+                    "revid": 20,
+                    "wikitext": "anchor2\n== Foo ==\nanchor1",
+                    "sections_to_exclude": ["%LEAD%"],
+                },
+            ],
+            wiki_id="enwiki",
+            language_code="en",
+            threshold=0.5,
+            max_recommendations=15,
+            sections_to_exclude=[],
+            deadline=deadline,
+        )
+    )
+
+
+def test_run_batch(model):
+    query = make_query(model)
+    results = run_batch(query)
+    assert [
+        (result["page_title"], [link["link_target"] for link in result["links"]])
+        for result in results
+    ] == [("A", ["Page1"]), ("B", ["Page1"])]
+    assert query.model_registry.get.call_count == 1
+    # The deadline is not kept once the batch is done.
+    assert query.datasetloader.deadline is None
+
+
+def test_run_batch_deadline(model):
+    results = run_batch(make_query(model), deadline=Deadline(0))
+    assert [(result["pageid"], result["error"]["code"]) for result in results] == [
+        (1, 504),
+        (2, 504),
+    ]
+
+
+def test_run_batch_page_errors(model, monkeypatch):
+    query = make_query(model)
+    process_page = query.process_page
+
+    def fail_page(wikitext, **kwargs):
+        if wikitext == "x anchor1":
+            raise utils_v2.MentionRegexException("anchor1", wikitext)
+        return process_page(wikitext=wikitext, **kwargs)
+
+    monkeypatch.setattr(query, "process_page", fail_page)
+    results = run_batch(query)
+    assert results[0]["error"]["code"] == 400
+    assert [link["link_target"] for link in results[1]["links"]] == ["Page1"]
+
+    def crash_page(**kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(query, "process_page", crash_page)
+    results = run_batch(query)
+    assert [result["error"]["code"] for result in results] == [500, 500]
+
+
+def test_mention_regex_exception_is_shared():
+    assert utils_v2.MentionRegexException is MentionRegexException
+
+
+def run(query, deadline=None, **kwargs):
+    parameters = {
+        "wikitext": "x anchor1",
+        "page_title": "A",
+        "pageid": 1,
+        "revid": 10,
+        "wiki_id": "enwiki",
+        "language_code": "en",
+        "threshold": 0.5,
+        "max_recommendations": 15,
+        "sections_to_exclude": [],
+    }
+    parameters.update(kwargs)
+    return query.run(deadline=deadline, **parameters)
+
+
+def test_run_result_cache(model):
+    result_cache = ResultCache(MemoryStore())
+    result = run(make_query(model, result_cache))
+    assert result["meta"]["cached"] is False
+    cached_result = run(make_query(model, result_cache))
+    assert cached_result["meta"]["cached"] is True
+    assert cached_result["links"] == result["links"]
+    assert model.predict_proba.call_count == 1
+    result = run(make_query(model, result_cache), threshold=0.6)
+    assert result["meta"]["cached"] is False
+
+
+def test_run_result_cache_skips_stopped_results(model):
+    result_cache = ResultCache(MemoryStore())
+    result = run(make_query(model, result_cache), deadline=Deadline(0))
+    assert result["meta"]["info"]
+    result = run(make_query(model, result_cache))
+    assert result["meta"]["cached"] is False
+    assert result["links"]
+
+
+def test_run_result_cache_keeps_results_stopped_at_max_recommendations(model):
+    result_cache = ResultCache(MemoryStore())
+    result = run(make_query(model, result_cache), max_recommendations=1)
+    assert result["meta"]["info"] == (
+        "Stopping page processing as max recommendations limit 1 reached."
+    )
+    assert result["meta"]["cached"] is False
+    result = run(make_query(model, result_cache), max_recommendations=1)
+    assert result["meta"]["cached"] is True
+    assert len(result["links"]) == 1
+
+
+def test_run_result_cache_sqlite_dataset_checksums(model):
+    result_cache = ResultCache(MemoryStore())
+    result = run(make_query(model, result_cache))
+    assert result["meta"]["dataset_checksums"]["anchors"] == "a"
+    query = make_query(model, result_cache)
+    # The anchors file was refreshed.
+    query.datasetloader.sqlite_checksums["anchors"] = "b"
+    result = run(query)
+    assert result["meta"]["cached"] is False
+    assert result["meta"]["dataset_checksums"]["anchors"] == "b"
@@ -196,6 +196,26 @@ def test_process_page(
         assert expected_item.items() <= actual_item.items()
 
 
+def test_process_page_offsets_after_length_changing_lowercase(model):
+    # "İ" is lowercased to two characters with language_code="en"
+    wikitext = "İnsan dini anchor1 ipsum"
+    actual_data = process_page(
+        wikitext,
+        "Page",
+        anchors,
+        pageids,
+        redirects,
+        word2vec,
+        model,
+        language_code="en",
+        pr=False,
+        return_wikitext=False,
+    )["links"]
+    assert len(actual_data) == 1
+    assert actual_data[0]["start_offset"] == wikitext.index("anchor1")
+    assert actual_data[0]["context_plaintext"] == ["nsan dini ", " ipsum"]
+
+
 def test_process_page_lowercase(pytestconfig, model):
     """
     Regression test for T308244. Exception should be thrown with "en" language code on this text; no exception
@@ -269,3 +289,37 @@ def test_get_language_code():
     actual_language_code = get_language_code("https://bat-smg.wikipedia.org/w/api.php")
     expected_language_code = "sgs"
     assert actual_language_code == expected_language_code
+
+
+class LookupCountingAnchors(dict):
+    # Like SqliteDict, every membership check and lookup is a query.
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.lookups = []
+
+    def __contains__(self, key):
+        self.lookups.append(key)
+        return super().__contains__(key)
+
+    def __getitem__(self, key):
+        self.lookups.append(key)
+        return super().__getitem__(key)
+
+
+def test_process_page_looks_up_each_mention_once(model):
+    counting_anchors = LookupCountingAnchors(anchors)
+    response = process_page(
+        "Lorem anchor1 ipsum",
+        "Page",
+        counting_anchors,
+        pageids,
+        redirects,
+        word2vec,
+        model,
+        language_code="en",
+        pr=False,
+        return_wikitext=False,
+    )
+    assert [link["link_target"] for link in response["links"]] == ["Page1"]
+    assert counting_anchors.lookups.count("anchor1") == 1
+    assert len(counting_anchors.lookups) == len(set(counting_anchors.lookups))
@@ -3,7 +3,11 @@ import os
 
 import pytest
 
-from src.scripts.utils_v2 import process_page
+from src.AnchorMatcher import build_anchor_matcher, open_anchor_matcher
+from src.BloomFilter import build_bloom_filter
+from src.Deadline import Deadline
+from src.scripts.ngram_utils import get_tokenizer, warm_tokenizers
+from src.scripts.utils_v2 import classify_mentions, process_page
 
 
 anchors = {
@@ -77,6 +81,13 @@ def provide_process_page():
             "Lorem ipsum xanchor1 dolor sit amet\n==Foo== [[Page1|anchor1]] blah\n",
             [{"link_target": "Page1", "link_text": "anchor1", "match_index": 1}],
         ],
+        [
+            # identical text nodes are counted by their position for match_index
+            "xanchor1<br>xanchor1<br>anchor1",
+            [],
+            "xanchor1<br>xanchor1<br>[[Page1|anchor1]]",
+            [{"link_target": "Page1", "link_text": "anchor1", "match_index": 2}],
+        ],
         [
             # basic
             "Lorem ipsum anchor1 dolor sit amet",
@@ -288,3 +299,164 @@ def test_process_page_azerbaijani_induizm(model):
     assert actual_data[0]["link_target"] == "İnduizm"
     assert actual_data[0]["start_offset"] == wikitext.index("İnduizm")
     assert actual_data[0]["end_offset"] == wikitext.index("İnduizm") + len("İnduizm")
+
+
+def test_process_page_scores_node_in_one_call(model):
+    wikitext = "Lorem anchor1 ipsum anchor2 dolor anchor3 sit amet"
+    actual_data = process_page(
+        wikitext,
+        "Page",
+        {
+            "anchor1": {"Page1": 1},
+            "anchor2": {"Page2": 3, "Page3": 1},
+            "anchor3": {"Page4": 1},
+        },
+        {"Page1": 1, "Page2": 2, "Page3": 3, "Page4": 4},
+        redirects,
+        word2vec,
+        model,
+        language_code="en",
+        wiki_id="enwiki",
+        pr=False,
+        return_wikitext=False,
+        sections_to_exclude=[],
+    )["links"]
+
+    assert [link["link_target"] for link in actual_data] == ["Page1", "Page2", "Page4"]
+    assert model.predict_proba.call_count == 1
+    assert model.predict_proba.call_args[0][0].shape == (4, 7)
+
+
+@pytest.mark.parametrize(
+    "original_wikitext,sections_to_exclude,expected_wikitext,expected_data",
+    provide_process_page(),
+)
+def test_process_page_with_anchor_matcher(
+    original_wikitext,
+    sections_to_exclude,
+    expected_wikitext,
+    expected_data,
+    model,
+    tmp_path,
+):
+    path = str(tmp_path / "enwiki.anchors.matcher")
+    build_anchor_matcher(anchors.keys(), path)
+    actual_wikitext = process_page(
+        original_wikitext,
+        "Page",
+        anchors,
+        pageids,
+        redirects,
+        word2vec,
+        model,
+        language_code="en",
+        wiki_id="enwiki",
+        pr=False,
+        return_wikitext=True,
+        sections_to_exclude=sections_to_exclude,
+        anchor_matcher=open_anchor_matcher(path),
+    )
+    assert actual_wikitext == expected_wikitext
+
+
+def test_process_page_with_anchor_filter(model):
+    wikitext = "Lorem anchor1 ipsum dolor sit amet"
+    anchor_filter = build_bloom_filter(anchors.keys(), len(anchors), 0.01)
+    actual_data = process_page(
+        wikitext,
+        "Page",
+        anchors,
+        pageids,
+        redirects,
+        word2vec,
+        model,
+        language_code="en",
+        wiki_id="enwiki",
+        pr=False,
+        return_wikitext=False,
+        sections_to_exclude=[],
+        anchor_filter=anchor_filter,
+    )["links"]
+
+    assert [link["link_text"] for link in actual_data] == ["anchor1"]
+    assert anchor_filter.rejections > 0
+
+
+def test_get_tokenizer_is_cached(monkeypatch):
+    monkeypatch.setenv("TOKENIZER_LANGUAGES", "en, az,")
+    assert warm_tokenizers() == ["en", "az"]
+    assert get_tokenizer("az") is get_tokenizer("az")
+
+
+def test_classify_mentions_memoizes_ngram_lengths(model):
+    ngram_lengths = {"anchor1": 7}
+    tokenizer = get_tokenizer("en")
+    classify_mentions(
+        "Page",
+        ["anchor1", "anchor two"],
+        {"anchor1": {"Page1": 1}, "anchor two": {"Page2": 1}},
+        {},
+        model,
+        "enwiki",
+        tokenizer,
+        ngram_lengths=ngram_lengths,
+    )
+    assert ngram_lengths == {"anchor1": 7, "anchor two": 2}
+
+
+def test_process_page_stops_at_deadline(model):
+    response = process_page(
+        "Lorem anchor1 ipsum",
+        "Page",
+        {"anchor1": {"Page1": 1}},
+        {"Page1": 1},
+        {},
+        {},
+        model,
+        language_code="en",
+        wiki_id="enwiki",
+        pr=False,
+        return_wikitext=False,
+        deadline=Deadline(0),
+    )
+    assert response["links"] == []
+    assert response["deadline_exceeded"] is True
+    assert response["info"] == (
+        "Stopping page processing as maximum processing time 0 seconds reached "
+        "during parsing"
+    )
+
+
+class LookupCountingAnchors(dict):
+    # Like SqliteDict, every membership check and lookup is a query.
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.lookups = []
+
+    def __contains__(self, key):
+        self.lookups.append(key)
+        return super().__contains__(key)
+
+    def __getitem__(self, key):
+        self.lookups.append(key)
+        return super().__getitem__(key)
+
+
+def test_process_page_looks_up_each_mention_once(model):
+    counting_anchors = LookupCountingAnchors(anchors)
+    response = process_page(
+        "Lorem anchor1 ipsum",
+        "Page",
+        counting_anchors,
+        pageids,
+        redirects,
+        word2vec,
+        model,
+        language_code="en",
+        wiki_id="enwiki",
+        pr=False,
+        return_wikitext=False,
+    )
+    assert [link["link_target"] for link in response["links"]] == ["Page1"]
+    assert counting_anchors.lookups.count("anchor1") == 1
+    assert len(counting_anchors.lookups) == len(set(counting_anchors.lookups))
@@ -0,0 +1,62 @@
+"""
+Microbenchmark for the link model inference backends.
+
+Compares XGBClassifier.predict_proba with the backends in src/InferenceBackend.py for a single
+feature row and for a batch of 100 rows (roughly the candidates of one text node).
+
+Usage, from the repository root:
+  python -m utils.benchmark_inference [--model data/simplewiki/simplewiki.linkmodel.json]
+
+Without --model, a model of a similar size to the production link models is trained on random data.
+"""
+
+import argparse
+import timeit
+
+import numpy as np
+import xgboost as xgb
+
+from src.InferenceBackend import backends
+
+
+def handle_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", type=str, default=None, help="Path to a link model")
+    parser.add_argument(
+        "--repeat", type=int, default=1000, help="Number of calls to time per case"
+    )
+    return parser.parse_args()
+
+
+def get_model(model_path):
+    model = xgb.XGBClassifier()
+    if model_path:
+        model.load_model(model_path)
+        return model
+    rng = np.random.default_rng(0)
+    features = rng.random((5000, 7))
+    labels = (features[:, 0] + features[:, 4] > 1).astype(int)
+    model.set_params(n_estimators=100, max_depth=6)
+    model.fit(features, labels)
+    return model
+
+
+def main():
+    args = handle_args()
+    model = get_model(args.model)
+    rng = np.random.default_rng(1)
+    print("%-12s %14s %14s" % ("backend", "1 row (us)", "100 rows (us)"))
+    for name, backend_class in backends.items():
+        backend = backend_class(model)
+        timings = []
+        for rows in [1, 100]:
+            features = rng.random((rows, model.get_booster().num_features()))
+            seconds = timeit.timeit(
+                lambda: backend.predict_proba(features), number=args.repeat
+            )
+            timings.append(seconds / args.repeat * 1e6)
+        print("%-12s %14.1f %14.1f" % (name, *timings))
+
+
+if __name__ == "__main__":
+    main()